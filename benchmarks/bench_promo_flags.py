@@ -0,0 +1,57 @@
+"""Benchmark the vectorized promo interval join at increasing scale.
+
+Run from the repository root:
+    python benchmarks/bench_promo_flags.py
+
+Prints rows/second per size; a roughly constant throughput means the join
+scales linearly in the number of market x SKU x week rows.
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+from src.data_processing import flag_promos
+
+N_WEEKS = 13
+PROMO_TYPES = np.array(['display', 'discount', 'bundle'])
+
+def make_inputs(n_markets, n_skus, promos_per_series=1.0, seed=0):
+    """Build a synthetic future grid and promo table"""
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range('2025-01-20', periods=N_WEEKS, freq='W-MON')
+    markets = np.array([f'M{i:03d}' for i in range(n_markets)])
+    skus = np.array([f'S{i:05d}' for i in range(n_skus)])
+    future_df = pd.MultiIndex.from_product(
+        [weeks, markets, skus], names=['week_start', 'market', 'sku_id']
+    ).to_frame(index=False)
+    
+    n_promos = int(n_markets * n_skus * promos_per_series)
+    start_idx = rng.integers(0, N_WEEKS, n_promos)
+    end_idx = np.minimum(start_idx + rng.integers(0, 3, n_promos), N_WEEKS - 1)
+    promos = pd.DataFrame({
+        'market': markets[rng.integers(0, n_markets, n_promos)],
+        'sku_id': skus[rng.integers(0, n_skus, n_promos)],
+        'week_start': weeks[start_idx],
+        'week_end': weeks[end_idx],
+        'promo_type': PROMO_TYPES[rng.integers(0, len(PROMO_TYPES), n_promos)]
+    })
+    return future_df, promos
+
+def run(sizes=((6, 100), (12, 500), (24, 1000), (48, 2000)), repeats=3):
+    """Time flag_promos for each (markets, skus) size"""
+    print(f"{'rows':>10} {'promos':>8} {'best_s':>8} {'rows/s':>12}")
+    for n_markets, n_skus in sizes:
+        future_df, promos = make_inputs(n_markets, n_skus)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            flag_promos(future_df, promos)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"{len(future_df):>10,} {len(promos):>8,} {best:>8.3f} {len(future_df) / best:>12,.0f}")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,64 @@
+"""Load-test the forecast service's micro-batching.
+
+Starts src.serving in-process on a free port against the stored models
+(run `python -m src.forecast` first) and fires concurrent /forecast
+requests at increasing concurrency. Run from the repository root:
+    python benchmarks/bench_serving.py
+
+Prints client-side p50/p99 latency, throughput and the mean number of
+requests the server coalesced into each batch.
+"""
+import sys
+import os
+import asyncio
+import json
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+from src.serving import start_service
+
+async def post(reader, writer, path, payload):
+    """Send one keep-alive request and return the decoded JSON response"""
+    body = json.dumps(payload).encode()
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: bench\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    headers = (await reader.readuntil(b'\r\n\r\n')).decode()
+    length = int(headers.lower().split('content-length:')[1].split('\r\n')[0])
+    return json.loads(await reader.readexactly(length))
+
+async def client(port, requests, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for payload in requests:
+        start = time.perf_counter()
+        await post(reader, writer, '/forecast', payload)
+        latencies.append((time.perf_counter() - start) * 1000)
+    writer.close()
+
+async def run(concurrency=(1, 8, 32, 128), requests_per_client=20):
+    """Time concurrent single-series requests with price overrides at each concurrency"""
+    server, service = await start_service(port=0, reload_interval=0)
+    port = server.sockets[0].getsockname()[1]
+    series = list(service['state'].series)
+    rng = np.random.default_rng(0)
+    print(f"{'clients':>8} {'requests':>9} {'p50_ms':>8} {'p99_ms':>8} {'req/s':>8} {'req/batch':>10}")
+    for n_clients in concurrency:
+        batches_before = service['metrics']['batches']
+        latencies = []
+        workloads = [[
+            {'market': market, 'sku_id': sku, 'weeks': 13, 'overrides': [{'price_change': float(change)}]}
+            for market, sku in (series[i] for i in rng.integers(0, len(series), requests_per_client))
+            for change in rng.uniform(-0.2, 0.2, 1)
+        ] for _ in range(n_clients)]
+        start = time.perf_counter()
+        await asyncio.gather(*(client(port, workload, latencies) for workload in workloads))
+        elapsed = time.perf_counter() - start
+        batches = service['metrics']['batches'] - batches_before
+        print(f"{n_clients:>8} {len(latencies):>9,} {np.percentile(latencies, 50):>8.1f} "
+              f"{np.percentile(latencies, 99):>8.1f} {len(latencies) / elapsed:>8.0f} "
+              f"{len(latencies) / max(batches, 1):>10.1f}")
+    server.close()
+    await server.wait_closed()
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,199 @@
+"""Benchmark suite for the pipeline functions on synthetic data.
+
+Times each pipeline step on synthetic inputs (see synthetic.py) at one or
+more sizes, asv-style: inputs are built in an untimed setup, the function
+is run `--repeat` times and the best time is kept. Run from the
+repository root:
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --save-baseline
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --check
+
+Baselines are stored per machine under benchmarks/baselines/ and keyed by
+benchmark and size. --check exits non-zero when a benchmark is slower than
+its baseline by more than --tolerance. Expensive steps have a size cap
+(e.g. training stops at 2k series); --no-caps lifts it. Inputs are held in
+memory: sizes near 1M series need a machine with tens of GB of RAM, or
+use synthetic.py to stream the tables to disk and run src.forecast on them.
+"""
+import sys
+import os
+import argparse
+import json
+import platform
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+from src.data_processing import load_typed_data, prepare_future_data, flag_promos, engineer_features, build_model_frames
+from src.modeling import train_models, make_predictions, FEATURES, CATEGORICAL
+from src.hierarchy import reconcile_forecasts
+from src.forecast_cube import build_forecast_cube
+from synthetic import make_tables, write_tables
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+TOLERANCE = 0.25
+PREDICT_TRAIN_ROWS = 200_000
+
+Benchmark = namedtuple('Benchmark', ['name', 'setup', 'run', 'max_series'])
+
+def _cached(inputs, key, build):
+    if key not in inputs:
+        inputs[key] = build(inputs)
+    return inputs[key]
+
+def _future(inputs):
+    panel, price_plan, promos, weather, calendar = inputs['tables']
+    return _cached(inputs, 'future', lambda _: prepare_future_data(calendar, price_plan, weather, promos))
+
+def _frames(inputs):
+    return _cached(inputs, 'frames', lambda i: build_model_frames(i['tables'][0], _future(i)))
+
+def _models(inputs):
+    # Prediction benchmarks use models fit on the latest rows so setup stays quick at any size
+    return _cached(inputs, 'models',
+                   lambda i: train_models(_frames(i)[0].iloc[-PREDICT_TRAIN_ROWS:], FEATURES, CATEGORICAL))
+
+def _predictions(inputs):
+    return _cached(inputs, 'predictions',
+                   lambda i: make_predictions(*_models(i), _frames(i)[1], FEATURES, CATEGORICAL))
+
+def _files(fmt):
+    def setup(inputs):
+        out_dir = os.path.join(inputs['tmp'], fmt)
+        write_tables(out_dir, inputs['series'], fmt, seed=inputs['seed'])
+        return (out_dir,), sum(len(table) for table in inputs['tables'])
+    return setup
+
+def _setup_prepare_future(inputs):
+    panel, price_plan, promos, weather, calendar = inputs['tables']
+    return (calendar, price_plan, weather, promos), len(price_plan)
+
+def _setup_flag_promos(inputs):
+    future_df = _future(inputs).drop(columns=['promo_flag', 'promo_count', 'promo_type'])
+    return (future_df, inputs['tables'][2]), len(future_df)
+
+def _setup_engineer_features(inputs):
+    all_df = pd.concat([inputs['tables'][0], _future(inputs)], ignore_index=True).sort_values('week_start')
+    return (all_df,), len(all_df)
+
+def _setup_model_frames(inputs):
+    return (inputs['tables'][0], _future(inputs)), len(inputs['tables'][0]) + len(_future(inputs))
+
+def _setup_train(inputs):
+    train_df = _frames(inputs)[0]
+    return (train_df, FEATURES, CATEGORICAL), len(train_df)
+
+def _setup_predict(inputs):
+    future_df = _frames(inputs)[1]
+    return (*_models(inputs), future_df, FEATURES, CATEGORICAL), len(future_df)
+
+def _setup_predictions(inputs):
+    return (_predictions(inputs),), len(_predictions(inputs))
+
+BENCHMARKS = [
+    Benchmark('load_typed_data[csv]', _files('csv'), load_typed_data, 1_000_000),
+    Benchmark('load_typed_data[parquet]', _files('parquet'), load_typed_data, 1_000_000),
+    Benchmark('prepare_future_data', _setup_prepare_future, prepare_future_data, 1_000_000),
+    Benchmark('flag_promos', _setup_flag_promos, flag_promos, 1_000_000),
+    Benchmark('engineer_features', _setup_engineer_features, engineer_features, 1_000_000),
+    Benchmark('build_model_frames', _setup_model_frames, build_model_frames, 1_000_000),
+    Benchmark('build_model_frames[lags]', _setup_model_frames,
+              lambda panel, future_df: build_model_frames(panel, future_df, lags=True), 1_000_000),
+    Benchmark('train_models', _setup_train, train_models, 2_000),
+    Benchmark('make_predictions', _setup_predict, make_predictions, 1_000_000),
+    Benchmark('reconcile_forecasts', _setup_predictions, reconcile_forecasts, 100_000),
+    Benchmark('build_forecast_cube', _setup_predictions, build_forecast_cube, 1_000_000),
+]
+
+def machine_id():
+    return f"{platform.system()}-{platform.machine()}-{os.cpu_count()}cpu"
+
+def baseline_path(machine=None):
+    return os.path.join(BASELINE_DIR, f"{machine or machine_id()}.json")
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)['results']
+
+def save_baseline(path, results):
+    """Merge results into the baseline file, replacing entries of the same benchmark and size"""
+    baseline = load_baseline(path)
+    baseline.update(results)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({
+            'machine': machine_id(),
+            'python': platform.python_version(),
+            'versions': {'numpy': np.__version__, 'pandas': pd.__version__},
+            'updated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'results': dict(sorted(baseline.items()))
+        }, f, indent=1)
+        f.write("\n")
+
+def run(sizes, names=None, repeat=3, caps=True, baseline=None, tolerance=TOLERANCE, seed=0):
+    """Time every selected benchmark at each size and return {'name@series': result}"""
+    baseline = baseline or {}
+    results = {}
+    print(f"{'benchmark':<26} {'series':>9} {'rows':>11} {'best_s':>9} {'rows/s':>12} {'baseline':>9} {'change':>8}")
+    for size in sizes:
+        benchmarks = [b for b in BENCHMARKS if (not names or b.name in names) and (not caps or size <= b.max_series)]
+        if not benchmarks:
+            continue
+        with tempfile.TemporaryDirectory(prefix='forecast_bench_') as tmp:
+            inputs = {'series': size, 'seed': seed, 'tmp': tmp, 'tables': make_tables(size, seed=seed)}
+            for bench in benchmarks:
+                args, rows = bench.setup(inputs)
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    bench.run(*args)
+                    timings.append(time.perf_counter() - start)
+                best = min(timings)
+                key = f"{bench.name}@{size}"
+                results[key] = {'best_s': round(best, 6), 'rows': int(rows), 'repeat': repeat}
+                reference = baseline.get(key, {}).get('best_s')
+                change = f"{best / reference - 1:+.0%}" if reference else ''
+                flag = ' !' if reference and best > reference * (1 + tolerance) else ''
+                print(f"{bench.name:<26} {size:>9,} {rows:>11,} {best:>9.3f} {rows / best:>12,.0f} "
+                      f"{reference or float('nan'):>9.3f} {change:>8}{flag}")
+    return results
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    """Keys of results slower than their baseline by more than `tolerance`"""
+    return [key for key, result in results.items()
+            if key in baseline and result['best_s'] > baseline[key]['best_s'] * (1 + tolerance)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline functions on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000],
+                        help="numbers of market x SKU series (up to 1,000,000)")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark (best is kept)")
+    parser.add_argument("--no-caps", action="store_true", help="run expensive benchmarks above their size cap")
+    parser.add_argument("--baseline", help="baseline file (default: benchmarks/baselines/<machine>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="record these results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit non-zero on regressions past --tolerance")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown vs baseline")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    path = args.baseline or baseline_path()
+    baseline = load_baseline(path)
+    results = run(args.sizes, args.only, args.repeat, not args.no_caps, baseline, args.tolerance, args.seed)
+    if args.save_baseline:
+        save_baseline(path, results)
+        print(f"Saved {len(results)} results to {path}")
+    slower = regressions(results, baseline, args.tolerance)
+    if slower:
+        print(f"{len(slower)} regression(s) past {args.tolerance:.0%}: {', '.join(slower)}")
+    return 1 if args.check and slower else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
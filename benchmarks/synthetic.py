@@ -0,0 +1,209 @@
+"""Synthetic input tables at configurable scale.
+
+Generates the five input tables (panel_train, price_plan_future,
+promos_future, weather_future, calendar_future) with the same columns,
+compact dtypes and date format as the files in data/, for anything from
+a thousand to a million (market, SKU) series:
+
+    python benchmarks/synthetic.py --series 100000 --out-dir /tmp/synthetic --format parquet
+
+Series are the product of markets and SKUs, so the requested count is
+rounded up to a full grid. Weekly demand is Poisson around a per-series
+level with yearly seasonality, price elasticity, promo and holiday lifts
+and a weather effect; a share of series are new and only have recent
+history (cold starts). Tables are generated in chunks of series so the
+panel can be streamed to disk without holding it in memory.
+"""
+import sys
+import os
+import argparse
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+from src.data_processing import SCHEMAS, DATE_FORMAT
+
+TABLES = ['panel_train', 'price_plan_future', 'promos_future', 'weather_future', 'calendar_future']
+COLUMNS = {
+    'panel_train': ['week_start', 'market', 'sku_id', 'units', 'price', 'promo_flag', 'holiday_flag', 'temp_c',
+                    'rain_mm'],
+    'price_plan_future': ['market', 'sku_id', 'week_start', 'planned_price'],
+    'promos_future': ['market', 'sku_id', 'week_start', 'week_end', 'promo_type'],
+    'weather_future': ['market', 'week_start', 'temp_c', 'rain_mm'],
+    'calendar_future': ['week_start', 'holiday_flag', 'fiscal_week']
+}
+START = '2023-01-02'
+N_WEEKS = 107
+HORIZON = 13
+CHUNK_SERIES = 50_000
+PROMO_TYPES = ['display', 'discount', 'bundle']
+PROMO_RATE = 0.08
+NEW_SERIES_SHARE = 0.05
+
+def grid_shape(n_series, n_markets=None):
+    """(markets, SKUs per market) covering at least n_series series"""
+    n_markets = n_markets or int(np.clip(round(np.sqrt(n_series) / 4), 1, 200))
+    return n_markets, -(-n_series // n_markets)
+
+def _calendar(n_weeks, horizon, seed):
+    """Weeks and holiday flags over history + horizon"""
+    rng = np.random.default_rng([seed, 0])
+    weeks = pd.date_range(START, periods=n_weeks + horizon, freq='W-MON')
+    holiday = (rng.random(len(weeks)) < 0.06).astype('int8')
+    return weeks, holiday
+
+def _weather(n_markets, n_total_weeks, seed):
+    """Seasonal (market x week) temperature and rain"""
+    rng = np.random.default_rng([seed, 1])
+    phase = rng.uniform(0, 2 * np.pi, n_markets)[:, None]
+    climate = rng.uniform(15, 30, n_markets)[:, None]
+    t = np.arange(n_total_weeks)[None, :]
+    temp = climate + 6 * np.sin(2 * np.pi * t / 52 + phase) + rng.normal(0, 1.5, (n_markets, n_total_weeks))
+    rain = rng.gamma(1.5, 4, (n_markets, n_total_weeks)) * (1 + np.cos(2 * np.pi * t / 52 + phase))
+    return temp.astype('float32'), rain.astype('float32')
+
+def _categorical(codes, categories):
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+def _typed(name, df):
+    """Columns in file order with the compact dtypes load_typed_data produces"""
+    return df[COLUMNS[name]].astype(SCHEMAS[name]['dtypes'], copy=False)
+
+def generate_tables(n_series, n_weeks=N_WEEKS, horizon=HORIZON, n_markets=None, seed=0,
+                    chunk_series=CHUNK_SERIES):
+    """Yield (table, typed chunk) pairs; panel, price plan and promos come in chunks of series"""
+    n_markets, n_skus = grid_shape(n_series, n_markets)
+    markets = [f'M{i:03d}' for i in range(n_markets)]
+    skus = [f'S{i:06d}' for i in range(n_skus)]
+    weeks, holiday = _calendar(n_weeks, horizon, seed)
+    temp, rain = _weather(n_markets, len(weeks), seed)
+    history, future = weeks[:n_weeks], weeks[n_weeks:]
+
+    yield 'calendar_future', _typed('calendar_future', pd.DataFrame({
+        'week_start': future,
+        'holiday_flag': holiday[n_weeks:],
+        'fiscal_week': np.arange(n_weeks + 1, n_weeks + horizon + 1, dtype='int16')
+    }))
+    market_codes = np.repeat(np.arange(n_markets), horizon)
+    yield 'weather_future', _typed('weather_future', pd.DataFrame({
+        'market': _categorical(market_codes, markets),
+        'week_start': np.tile(future, n_markets),
+        'temp_c': temp[:, n_weeks:].ravel(),
+        'rain_mm': rain[:, n_weeks:].ravel()
+    }))
+
+    total = n_markets * n_skus
+    season = 1 + 0.25 * np.sin(2 * np.pi * np.arange(len(weeks)) / 52)
+    for chunk, first in enumerate(range(0, total, chunk_series)):
+        rng = np.random.default_rng([seed, 2, chunk])
+        series = np.arange(first, min(first + chunk_series, total))
+        n = len(series)
+        market, sku = series // n_skus, series % n_skus
+        level = rng.lognormal(3, 0.7, n)
+        base_price = rng.uniform(2, 30, n)
+        elasticity = rng.uniform(-2, -0.5, n)
+        promo_lift = rng.uniform(1.1, 1.8, n)
+        first_week = np.where(rng.random(n) < NEW_SERIES_SHARE, rng.integers(n_weeks - 26, n_weeks - 2, n), 0)
+
+        # History: (series x week) grids, flattened week-major within the chunk
+        price = base_price[:, None] * rng.normal(1, 0.05, (n, n_weeks))
+        promo = rng.random((n, n_weeks)) < PROMO_RATE
+        price = np.where(promo, price * 0.9, price)
+        mean = (level[:, None] * season[None, :n_weeks] * (price / base_price[:, None]) ** elasticity[:, None]
+                * np.where(promo, promo_lift[:, None], 1) * (1 + 0.2 * holiday[None, :n_weeks])
+                * (1 - 0.01 * (temp[market, :n_weeks] - 22)))
+        units = rng.poisson(np.clip(mean, 0, None))
+        observed = np.arange(n_weeks)[None, :] >= first_week[:, None]
+        rows, cols = np.nonzero(observed.T)
+        yield 'panel_train', _typed('panel_train', pd.DataFrame({
+            'week_start': history[rows],
+            'market': _categorical(market[cols], markets),
+            'sku_id': _categorical(sku[cols], skus),
+            'units': units.T[rows, cols].astype('float32'),
+            'price': price.T[rows, cols].round(2).astype('float32'),
+            'promo_flag': promo.T[rows, cols].astype('int8'),
+            'holiday_flag': holiday[rows],
+            'temp_c': temp[market[cols], rows],
+            'rain_mm': rain[market[cols], rows]
+        }))
+
+        yield 'price_plan_future', _typed('price_plan_future', pd.DataFrame({
+            'market': _categorical(np.repeat(market, horizon), markets),
+            'sku_id': _categorical(np.repeat(sku, horizon), skus),
+            'week_start': np.tile(future, n),
+            'planned_price': (np.repeat(base_price, horizon) * rng.normal(1, 0.05, n * horizon))
+            .round(2).astype('float32')
+        }))
+
+        promoted = np.flatnonzero(rng.random(n) < PROMO_RATE * horizon / 4)
+        start = rng.integers(0, horizon, len(promoted))
+        end = np.minimum(start + rng.integers(0, 3, len(promoted)), horizon - 1)
+        yield 'promos_future', _typed('promos_future', pd.DataFrame({
+            'market': _categorical(market[promoted], markets),
+            'sku_id': _categorical(sku[promoted], skus),
+            'week_start': future[start],
+            'week_end': future[end],
+            'promo_type': _categorical(rng.integers(0, len(PROMO_TYPES), len(promoted)), PROMO_TYPES)
+        }))
+
+def make_tables(n_series, **kwargs):
+    """All five tables in memory as typed frames, in load_typed_data order"""
+    chunks = {name: [] for name in TABLES}
+    for name, chunk in generate_tables(n_series, **kwargs):
+        chunks[name].append(chunk)
+    return tuple(pd.concat(chunks[name], ignore_index=True) for name in TABLES)
+
+def _csv_chunk(chunk):
+    """Format date columns as the input files do (each distinct week formatted once)"""
+    chunk = chunk.copy()
+    for column in chunk.columns:
+        if pd.api.types.is_datetime64_any_dtype(chunk[column]):
+            codes, uniques = pd.factorize(chunk[column])
+            chunk[column] = np.asarray(uniques.strftime(DATE_FORMAT))[codes]
+    return chunk
+
+def write_tables(out_dir, n_series, fmt='csv', **kwargs):
+    """Stream the five tables to out_dir as <table>.csv or <table>.parquet and return their paths"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {name: os.path.join(out_dir, f"{name}.{fmt}") for name in TABLES}
+    for path in paths.values():
+        if os.path.exists(path):
+            os.remove(path)
+    writers = {}
+    try:
+        for name, chunk in generate_tables(n_series, **kwargs):
+            if fmt == 'csv':
+                _csv_chunk(chunk).to_csv(paths[name], mode='a', header=not os.path.exists(paths[name]), index=False)
+            else:
+                table = pa.Table.from_pandas(chunk.astype({c: str for c in chunk.select_dtypes('category')}),
+                                             preserve_index=False)
+                if name not in writers:
+                    writers[name] = pq.ParquetWriter(paths[name], table.schema)
+                writers[name].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic input tables")
+    parser.add_argument("--series", type=int, default=1000, help="number of market x SKU series (rounded up)")
+    parser.add_argument("--weeks", type=int, default=N_WEEKS, help="weeks of history")
+    parser.add_argument("--markets", type=int, help="number of markets (default grows with --series)")
+    parser.add_argument("--out-dir", required=True)
+    parser.add_argument("--format", choices=['csv', 'parquet'], default='csv')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    paths = write_tables(args.out_dir, args.series, args.format, n_weeks=args.weeks, n_markets=args.markets,
+                         seed=args.seed)
+    for name, path in paths.items():
+        print(f"{path}  {os.path.getsize(path) / 1e6:,.1f} MB")
+    print(f"Wrote {len(paths)} tables in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
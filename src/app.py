@@ -2,16 +2,32 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import streamlit as st
 import pandas as pd
+import streamlit as st
 from datetime import datetime
-from data_processing import load_data, parse_dates, prepare_future_data, engineer_features
-from modeling import train_models, make_predictions
-from visualization import (
+from src import data_processing
+from src.config import DATA_DIR, PLOTS_DIR, MODEL_DIR, FEATURE_DIR, PROFILE_DIR
+from src.feature_store import build_feature_frames
+from src.modeling import make_predictions, FEATURES, CATEGORICAL
+from src.model_store import train_or_load_models
+from src.cold_start import apply_cold_start, cached_cold_start_index
+from src.attribution import feature_contributions, driver_contributions
+from src.calibration import train_or_load_calibration, apply_calibration
+from src.hierarchy import training_residuals, reconcile_forecasts, forecast_aggregates
+from src.plot_export import export_figures_async
+from src.forecast_cube import build_forecast_cube, series_rows, shock_summary
+from src.scenarios import score_scenarios, scenario_summary
+from src.profiling import profiled_run, recent_runs, stage_table
+from src.visualization import (
     plot_forecast_interactive, plot_driver_attribution, 
-    plot_weather_impact, plot_shock_analysis, plot_uncertainty_width
+    weather_figure, shock_figure, uncertainty_figure, plot_scenario_uplift, plot_forecast_drivers,
+    plot_stage_timeline, plot_stage_trends
 )
 
+# Figures are rebuilt on every rerun; a rerun that ran nothing else was served from cache
+FIGURE_STAGES = {'plot_forecast_interactive', 'plot_driver_attribution', 'weather_figure', 'shock_figure',
+                 'uncertainty_figure', 'plot_scenario_uplift', 'plot_forecast_drivers'}
+
 st.set_page_config(
     page_title="Demand Forecasting Dashboard",
     page_icon="📊",
@@ -29,6 +45,59 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
+@st.cache_data
+def load_data():
+    """Load all datasets with compact dtypes and parsed dates"""
+    try:
+        return data_processing.load_typed_data(DATA_DIR)
+    except Exception as e:
+        st.error(f"Error loading data: {e}")
+        return None, None, None, None, None
+
+@st.cache_data
+def prepare_future_data(calendar_fut, price_plan_fut, weather_fut, promos_fut):
+    """Prepare future forecast dataframe"""
+    return data_processing.prepare_future_data(calendar_fut, price_plan_fut, weather_fut, promos_fut)
+
+@st.cache_resource
+def build_features(panel, future_df):
+    """Read the model frames from the feature store, updating changed partitions"""
+    return build_feature_frames(panel, future_df, FEATURES + ['week_start', 'units'], FEATURE_DIR)
+
+@st.cache_resource
+def train_models(train_df, features, categorical):
+    """Load stored mean and quantile models, training them on a cache miss"""
+    try:
+        return train_or_load_models(train_df, features, categorical, MODEL_DIR)
+    except ValueError as e:
+        st.error(str(e))
+        return None, None, None, None
+
+@st.cache_data(show_spinner=False)
+def model_residuals(version, _model, _train_df):
+    """In-sample residuals of the mean model, computed once per model version"""
+    return training_residuals(_model, _train_df, FEATURES, CATEGORICAL)
+
+@st.cache_resource
+def forecast_cube(version, cold_start, calibrate, _models, _train_df, future_df):
+    """Predict and reconcile once per model version and index the results for the views"""
+    model_mean, model_lower, model_upper = _models
+    predictions = make_predictions(model_mean, model_lower, model_upper, future_df, FEATURES, CATEGORICAL)
+    if calibrate:
+        calibration = train_or_load_calibration(_train_df, FEATURES, CATEGORICAL, version, MODEL_DIR)
+        predictions = apply_calibration(predictions, calibration)
+    if cold_start:
+        predictions = apply_cold_start(predictions, _train_df, index=cached_cold_start_index(_train_df, version))
+    residuals = model_residuals(version, model_mean, _train_df)
+    hierarchy = reconcile_forecasts(predictions, residuals, forecast_aggregates(_train_df, future_df))
+    return build_forecast_cube(predictions, version, hierarchy)
+
+@st.cache_data(show_spinner=False)
+def forecast_drivers(version, market, skus, _model, _rows):
+    """Driver contributions of the selected series, computed once per model version and selection"""
+    contributions = feature_contributions(_model, _rows, FEATURES, CATEGORICAL)
+    return _rows[['week_start', 'sku_id']].join(driver_contributions(contributions))
+
 def main():
     st.title("📊 Shock-Aware Demand Forecasting Dashboard")
     st.markdown("### 13-Week Sales Forecast with Uncertainty Quantification")
@@ -37,6 +106,10 @@ def main():
         st.header("⚙️ Configuration")
         if st.button("🔄 Load & Process Data"):
             st.session_state.data_loaded = True
+        cold_start = st.checkbox("Blend cold-start forecasts", value=True,
+                                 help="Borrow demand from similar established series for SKUs/markets with little history")
+        calibrate = st.checkbox("Calibrate 90% intervals", value=True,
+                                help="Conformal calibration on rolling backtest folds (fitted once per model version)")
         st.markdown("---")
         st.markdown("### About")
         st.info("""
@@ -52,7 +125,7 @@ def main():
         st.info("👈 Click 'Load & Process Data' in the sidebar to begin")
         with st.expander("📋 Expected Data Structure"):
             st.markdown("""
-            **Required CSV files in D:\\colddd\\data\\:**
+            **Required CSV files in the data directory (`FORECAST_DATA_DIR`):**
             - panel_train.csv: Historical sales data
             - price_plan_future.csv: Future pricing plans
             - promos_future.csv: Planned promotions
@@ -64,11 +137,8 @@ def main():
     with st.spinner("Loading data..."):
         panel, price_plan_fut, promos_fut, weather_fut, calendar_fut = load_data()
         if panel is None:
-            st.error("Failed to load data. Please ensure CSV files are in D:\\colddd\\data\\.")
+            st.error(f"Failed to load data. Please ensure CSV files are in {DATA_DIR}.")
             return
-        panel, price_plan_fut, promos_fut, weather_fut, calendar_fut = parse_dates(
-            panel, price_plan_fut, promos_fut, weather_fut, calendar_fut
-        )
     
     st.header("📈 Data Overview")
     col1, col2, col3, col4 = st.columns(4)
@@ -83,17 +153,17 @@ def main():
     
     with st.spinner("Preparing features..."):
         future_df = prepare_future_data(calendar_fut, price_plan_fut, weather_fut, promos_fut)
-        all_df = pd.concat([panel, future_df], ignore_index=True).sort_values('week_start')
-        all_df = engineer_features(all_df)
-        train_df = all_df[all_df['units'].notnull()].copy()
-        future_df = all_df[all_df['units'].isnull()].copy()
+        try:
+            train_df, future_df = build_features(panel, future_df)
+        except ValueError as e:
+            st.error(str(e))
+            return
     
-    features = ['market', 'sku_id', 'time_index', 'sin_week', 'cos_week', 
-                'price', 'promo_flag', 'holiday_flag', 'temp_c', 'rain_mm']
-    categorical = ['market', 'sku_id', 'promo_flag', 'holiday_flag']
+    features = FEATURES
+    categorical = CATEGORICAL
     
     with st.spinner("Training models (mean + quantile regression)..."):
-        model_mean, model_lower, model_upper = train_models(train_df, features, categorical)
+        model_mean, model_lower, model_upper, version = train_models(train_df, features, categorical)
         if model_mean is None:
             st.error("Model training failed. Check data types and try again.")
             return
@@ -101,17 +171,18 @@ def main():
     st.success("✅ Models trained successfully!")
     
     with st.spinner("Generating forecasts..."):
-        predictions = make_predictions(model_mean, model_lower, model_upper, future_df, features, categorical)
-        if predictions is None:
-            st.error("Prediction failed. Check data types and try again.")
+        try:
+            cube = forecast_cube(version, cold_start, calibrate, (model_mean, model_lower, model_upper), train_df, future_df)
+        except ValueError as e:
+            st.error(f"Prediction failed: {e}")
             return
     
     st.header("🎯 Forecast Explorer")
     col1, col2 = st.columns([1, 2])
     with col1:
-        selected_market = st.selectbox("Select Market", options=sorted(predictions['market'].unique()))
+        selected_market = st.selectbox("Select Market", options=cube.markets)
     with col2:
-        available_skus = sorted(predictions[predictions['market'] == selected_market]['sku_id'].unique())
+        available_skus = cube.skus[selected_market]
         selected_skus = st.multiselect("Select SKUs", options=available_skus, 
                                      default=available_skus[:3] if len(available_skus) >= 3 else available_skus)
     
@@ -119,50 +190,60 @@ def main():
         st.warning("Please select at least one SKU")
         return
     
+    selected_rows = series_rows(cube, selected_market, selected_skus)
+    
     st.subheader(f"📊 Forecast with 90% Prediction Intervals")
-    fig_forecast = plot_forecast_interactive(predictions, selected_skus, selected_market)
+    fig_forecast = plot_forecast_interactive(selected_rows, selected_skus, selected_market)
     st.plotly_chart(fig_forecast, use_container_width=True)
-    os.makedirs(r"D:\colddd\plots", exist_ok=True)
-    fig_forecast.write_html(r"D:\colddd\plots\forecast_plot.html")
     
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("🎯 Driver Attribution")
         fig_importance = plot_driver_attribution(model_mean, features)
         st.plotly_chart(fig_importance, use_container_width=True)
-        fig_importance.write_html(r"D:\colddd\plots\driver_attribution.html")
     
     with col2:
         st.subheader("⚡ Shock Impact Analysis")
-        fig_shock = plot_shock_analysis(predictions, selected_market, selected_skus)
+        fig_shock = shock_figure(shock_summary(cube, selected_market, selected_skus), selected_market)
         st.plotly_chart(fig_shock, use_container_width=True)
-        fig_shock.write_html(r"D:\colddd\plots\shock_analysis.html")
     
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("🌤️ Weather Impact")
-        fig_weather = plot_weather_impact(predictions, selected_market)
+        fig_weather = weather_figure(cube.weather[selected_market])
         st.plotly_chart(fig_weather, use_container_width=True)
-        fig_weather.write_html(r"D:\colddd\plots\weather_impact.html")
     
     with col2:
         st.subheader("📏 Uncertainty Analysis")
-        fig_uncertainty = plot_uncertainty_width(predictions, selected_market)
+        fig_uncertainty = uncertainty_figure(cube.weekly[selected_market], selected_market)
         st.plotly_chart(fig_uncertainty, use_container_width=True)
-        fig_uncertainty.write_html(r"D:\colddd\plots\uncertainty_analysis.html")
+    
+    st.subheader("🧩 Forecast Drivers")
+    with st.spinner("Computing SHAP attributions..."):
+        drivers = forecast_drivers(version, selected_market, tuple(selected_skus), model_mean, selected_rows)
+    fig_drivers = plot_forecast_drivers(drivers, selected_market)
+    st.plotly_chart(fig_drivers, use_container_width=True)
+    st.caption("Per-row TreeSHAP contributions of the mean model, grouped into drivers; "
+               "they sum to the model forecast before cold-start blending.")
+    
+    export_figures_async({
+        'forecast_plot': fig_forecast,
+        'driver_attribution': fig_importance,
+        'shock_analysis': fig_shock,
+        'weather_impact': fig_weather,
+        'uncertainty_analysis': fig_uncertainty,
+        'forecast_drivers': fig_drivers
+    }, PLOTS_DIR)
     
     st.header("📋 Detailed Forecast Table")
-    forecast_table = predictions[
-        (predictions['market'] == selected_market) &
-        (predictions['sku_id'].isin(selected_skus))
-    ][['week_start', 'sku_id', 'forecast', 'lower_90', 'upper_90', 
+    forecast_table = selected_rows[['week_start', 'sku_id', 'forecast', 'lower_90', 'upper_90', 
        'price', 'promo_flag', 'holiday_flag', 'temp_c', 'rain_mm']].copy()
     
     forecast_table['week_start'] = forecast_table['week_start'].dt.strftime('%Y-%m-%d')
     forecast_table = forecast_table.round(2)
     forecast_table = forecast_table.sort_values(['sku_id', 'week_start'])
-    os.makedirs(r"D:\colddd\data", exist_ok=True)
-    forecast_table.to_csv(r"D:\colddd\data\forecast.csv", index=False)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    forecast_table.to_csv(os.path.join(DATA_DIR, "forecast.csv"), index=False)
     
     st.dataframe(forecast_table, use_container_width=True, height=400)
     
@@ -174,20 +255,102 @@ def main():
         mime="text/csv"
     )
     
+    st.header("🧪 What-if Scenarios")
+    st.caption(f"Changes apply to the selected SKUs in {selected_market}; uplift is versus the model baseline.")
+    n_weeks = future_df['week_start'].nunique()
+    with st.form("scenario"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            weeks = st.slider("Forecast weeks", 1, n_weeks, (1, n_weeks))
+        with col2:
+            price_change = st.slider("Price change (%)", -50, 50, 0, step=5)
+        with col3:
+            promo = st.selectbox("Promo", ["No change", "Run promo", "Remove promo"])
+        with col4:
+            holiday = st.selectbox("Holiday", ["No change", "Holiday", "No holiday"])
+        run_scenario = st.form_submit_button("Run scenario")
+    
+    if run_scenario:
+        override = {'market': selected_market, 'sku_id': selected_skus,
+                    'weeks': list(range(weeks[0], weeks[1] + 1))}
+        if price_change:
+            override['price_change'] = price_change / 100
+        if promo != "No change":
+            override['promo_flag'] = int(promo == "Run promo")
+        if holiday != "No change":
+            override['holiday_flag'] = int(holiday == "Holiday")
+        scenario = {'name': f"{selected_market}: price {price_change:+d}%, {promo.lower()}, {holiday.lower()}",
+                    'overrides': [override]}
+        calibration = (train_or_load_calibration(train_df, FEATURES, CATEGORICAL, version, MODEL_DIR)
+                       if calibrate else None)
+        try:
+            scenario_results = score_scenarios(model_mean, model_lower, model_upper, future_df, [scenario],
+                                               features, categorical, calibration=calibration)
+        except ValueError as e:
+            st.error(f"Scenario failed: {e}")
+        else:
+            residuals = model_residuals(version, model_mean, train_df)
+            summary = scenario_summary(scenario_results, residuals).iloc[0]
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Scenario Units", f"{summary['forecast']:,.0f}", f"{summary['uplift']:+,.0f}")
+            with col2:
+                st.metric("Uplift", f"{summary['uplift_pct']:+.1%}")
+            with col3:
+                st.metric("Uplift 90% Range", f"{summary['uplift_lower_90']:+,.0f} to {summary['uplift_upper_90']:+,.0f}")
+            weekly = scenario_summary(scenario_results, residuals, by_week=True)
+            st.plotly_chart(plot_scenario_uplift(weekly, scenario['name']), use_container_width=True)
+    
     st.header("📊 Summary Statistics")
     col1, col2, col3, col4 = st.columns(4)
-    market_forecast = predictions[predictions['market'] == selected_market]
+    market_summary = cube.summary[selected_market]
     
     with col1:
-        st.metric("Total Forecasted Units", f"{market_forecast['forecast'].sum():,.0f}")
+        st.metric("Total Forecasted Units", f"{market_summary['total_forecast']:,.0f}")
     with col2:
-        st.metric("Avg Weekly Demand", f"{market_forecast['forecast'].mean():,.0f}")
+        st.metric("Avg Weekly Demand", f"{market_summary['avg_forecast']:,.0f}")
     with col3:
-        avg_uncertainty = (market_forecast['upper_90'] - market_forecast['lower_90']).mean()
-        st.metric("Avg Uncertainty Width", f"{avg_uncertainty:,.0f}")
+        st.metric("Avg Uncertainty Width", f"{market_summary['avg_uncertainty']:,.0f}")
     with col4:
-        promo_weeks = (market_forecast['promo_flag'] == 1).sum()
-        st.metric("Promo Weeks", f"{promo_weeks}")
+        st.metric("Promo Weeks", f"{market_summary['promo_weeks']}")
+    
+    show_pipeline_runs()
+
+def pipeline_ran(stages):
+    """Whether a rerun executed any pipeline stage rather than only rebuilding figures"""
+    return any(stage['name'] not in FIGURE_STAGES for stage in stages)
+
+def show_pipeline_runs():
+    """Stage timings of the last recorded dashboard and batch forecast runs"""
+    st.header("⏱️ Pipeline Runs")
+    runs = recent_runs(20, PROFILE_DIR)
+    if not runs:
+        st.info("No runs recorded yet.")
+        return
+    overview = pd.DataFrame([{
+        'run_id': run['run_id'],
+        'run': run['name'],
+        'started_at': run['started_at'],
+        'wall_s': run['wall_s'],
+        'peak_rss_mb': run['peak_rss_mb'],
+        'stages': len(run['stages']),
+        'failed': run['failed']
+    } for run in runs])
+    st.dataframe(overview, use_container_width=True, hide_index=True)
+    
+    selected = st.selectbox("Run", options=overview['run_id'],
+                            format_func=lambda run_id: f"{run_id} ({overview.set_index('run_id').loc[run_id, 'run']})")
+    table = stage_table(runs)
+    stages = table[table['run_id'] == selected]
+    if stages.empty:
+        st.info("No stages were recorded for this run.")
+    else:
+        st.plotly_chart(plot_stage_timeline(stages, selected), use_container_width=True)
+    if not table.empty:
+        st.plotly_chart(plot_stage_trends(table), use_container_width=True)
+    st.caption(f"Recorded in {PROFILE_DIR}/runs.jsonl; `python -m src.forecast --trace --profile` also writes "
+               "a Chrome trace and a cProfile dump per run.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiled_run('dashboard', PROFILE_DIR, record_if=pipeline_ran):
+        main()
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""Per-row forecast attributions from LightGBM's native TreeSHAP.
+
+feature_contributions calls Booster.predict(pred_contrib=True) in
+batches, which runs TreeSHAP in LightGBM's multithreaded C++ code instead
+of shap's Python explainer. Each row gets one SHAP value per feature plus
+the expected value ('bias'); they sum to the raw mean forecast. Values are
+grouped into driver columns (promo, price, weather, seasonality, ...) and
+cached as Parquet per model version and future rows:
+
+    <cache_dir>/contrib_<key>.parquet
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.config import ATTRIBUTION_DIR
+from src.data_processing import UNITS_LAG_FEATURES, PRICE_LAG_FEATURES
+from src.modeling import prepare_features
+from src.model_store import data_fingerprint
+from src.profiling import instrumented
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100_000
+DRIVER_GROUPS = {
+    'base': ['bias', 'market', 'sku_id'],
+    'promo': ['promo_flag'],
+    'price': ['price'] + PRICE_LAG_FEATURES,
+    'weather': ['temp_c', 'rain_mm'],
+    'seasonality': ['time_index', 'sin_week', 'cos_week', 'holiday_flag'],
+    'history': UNITS_LAG_FEATURES
+}
+DRIVER_COLUMNS = [f'driver_{group}' for group in list(DRIVER_GROUPS) + ['other']]
+
+@instrumented()
+def feature_contributions(model, df, features, categorical, batch_size=BATCH_SIZE, num_threads=None):
+    """SHAP contributions per row and feature (plus 'bias'), computed in batches"""
+    X = prepare_features(df, features, categorical)
+    kwargs = {'num_threads': num_threads} if num_threads else {}
+    batches = [
+        model.predict(X.iloc[start:start + batch_size], pred_contrib=True, **kwargs).astype(np.float32)
+        for start in range(0, len(X), batch_size)
+    ]
+    values = np.vstack(batches) if batches else np.empty((0, len(features) + 1), dtype=np.float32)
+    return pd.DataFrame(values, columns=model.feature_name() + ['bias'], index=df.index)
+
+def driver_contributions(contributions, groups=DRIVER_GROUPS):
+    """Sum feature contributions into driver_<group> columns; unmapped features go to driver_other"""
+    columns = list(contributions.columns)
+    membership = np.zeros((len(columns), len(groups) + 1), dtype=np.float32)
+    group_of = {feature: i for i, members in enumerate(groups.values()) for feature in members}
+    for row, column in enumerate(columns):
+        membership[row, group_of.get(column, len(groups))] = 1
+    drivers = contributions.values @ membership
+    return pd.DataFrame(drivers, columns=[f'driver_{group}' for group in list(groups) + ['other']],
+                        index=contributions.index)
+
+def cached_contributions(model, version, df, features, categorical, cache_dir=ATTRIBUTION_DIR,
+                         batch_size=BATCH_SIZE, num_threads=None):
+    """feature_contributions cached on disk by model version and the rows' features"""
+    key = data_fingerprint(df, features, categorical, {'model_version': version}, target='week_start')
+    path = os.path.join(cache_dir, f"contrib_{key}.parquet")
+    if os.path.exists(path):
+        return pd.read_parquet(path).set_axis(df.index)
+    contributions = feature_contributions(model, df, features, categorical, batch_size, num_threads)
+    os.makedirs(cache_dir, exist_ok=True)
+    contributions.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    logger.info("Cached attributions for %d rows to %s", len(df), path)
+    return contributions
+
+def add_drivers(predictions, model, version, features, categorical, cache_dir=ATTRIBUTION_DIR):
+    """Add driver_<group> columns (summing to the raw mean forecast) to predictions"""
+    contributions = cached_contributions(model, version, predictions, features, categorical, cache_dir)
+    return predictions.join(driver_contributions(contributions))
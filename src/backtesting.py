@@ -0,0 +1,167 @@
+"""Rolling-origin backtesting for the forecasting models.
+
+Each fold trains on the weeks before an origin and forecasts the next
+`horizon` weeks. Folds run in parallel worker processes and their
+predictions are cached on disk, keyed by a fingerprint of the rows the
+fold can see, so adding a new origin (or a new week of data) only runs
+the folds that changed. With `quantiles`, folds are trained like
+train_or_load_quantile_models versions (early-stopped mean and quantile
+models, trained in parallel within each fold) instead of with
+train_models.
+
+    python -m src.backtesting --n-origins 5 --horizon 13
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.config import DATA_DIR, OUTPUT_DIR, BACKTEST_DIR
+from src.data_processing import load_typed_data, prepare_future_data, build_model_frames, LAG_FEATURES
+from src.modeling import (
+    train_models, train_quantile_models, make_predictions, make_recursive_predictions, thread_budget,
+    quantile_column, FEATURES, CATEGORICAL, LOWER_ALPHA, UPPER_ALPHA, HOLDOUT_WEEKS, EARLY_STOPPING_ROUNDS
+)
+from src.model_store import data_fingerprint, training_config
+
+logger = logging.getLogger(__name__)
+
+RESULT_COLUMNS = ['market', 'sku_id', 'week_start', 'origin', 'step', 'units', 'forecast', 'lower_90', 'upper_90']
+
+def rolling_origins(train_df, n_origins=4, horizon=13, step=4):
+    """Return up to `n_origins` origin weeks, oldest first, each leaving a full horizon of actuals"""
+    weeks = np.sort(train_df['week_start'].unique())
+    last = len(weeks) - horizon
+    positions = [last - i * step for i in range(n_origins)]
+    return [pd.Timestamp(weeks[p]) for p in sorted(positions) if p > 0]
+
+def _fold_rows(train_df, origin, horizon):
+    """Rows visible to a fold: everything before the end of its test window"""
+    weeks = np.sort(train_df['week_start'].unique())
+    end = np.searchsorted(weeks, np.datetime64(origin)) + horizon
+    return train_df[train_df['week_start'] < weeks[end]] if end < len(weeks) else train_df
+
+def run_fold(fold_df, origin, features, categorical, recursive=False, num_threads=None, quantiles=None,
+             n_jobs=None):
+    """Train on weeks before `origin` and forecast the remaining weeks of fold_df"""
+    is_test = fold_df['week_start'] >= origin
+    fit_df, test_df = fold_df[~is_test], fold_df[is_test]
+    if quantiles:
+        model_mean, quantile_models = train_quantile_models(fit_df, features, categorical, sorted(quantiles),
+                                                            n_jobs=n_jobs)
+        model_lower = model_upper = None
+    else:
+        model_mean, model_lower, model_upper = train_models(fit_df, features, categorical, num_threads=num_threads)
+        quantile_models = None
+    if recursive:
+        predictions = make_recursive_predictions(model_mean, model_lower, model_upper, fit_df,
+                                                 test_df.drop(columns='units'), features, categorical,
+                                                 quantile_models=quantile_models)
+        predictions['units'] = test_df['units']
+    else:
+        predictions = make_predictions(model_mean, model_lower, model_upper, test_df, features, categorical,
+                                       quantile_models=quantile_models)
+    predictions['origin'] = pd.Timestamp(origin)
+    predictions['step'] = pd.factorize(predictions['week_start'], sort=True)[0] + 1
+    return predictions[RESULT_COLUMNS]
+
+def _fold_path(origin, key, cache_dir):
+    return os.path.join(cache_dir, f"fold_{pd.Timestamp(origin):%Y%m%d}_{key}.parquet")
+
+def run_backtest(train_df, features=FEATURES, categorical=CATEGORICAL, n_origins=4, horizon=13, step=4,
+                 recursive=False, cache_dir=BACKTEST_DIR, n_jobs=None, quantiles=None):
+    """Run (or load cached) rolling-origin folds and return their stacked predictions"""
+    config = dict(training_config(), horizon=horizon, recursive=recursive)
+    if quantiles:
+        config.update(quantiles=sorted(quantiles), holdout_weeks=HOLDOUT_WEEKS,
+                      early_stopping_rounds=EARLY_STOPPING_ROUNDS)
+    folds = {}
+    for origin in rolling_origins(train_df, n_origins, horizon, step):
+        fold_df = _fold_rows(train_df, origin, horizon)
+        key = data_fingerprint(fold_df, features, categorical, dict(config, origin=str(origin)))
+        folds[origin] = (fold_df, _fold_path(origin, key, cache_dir))
+
+    missing = {origin: fold for origin, fold in folds.items() if not os.path.exists(fold[1])}
+    logger.info("Backtest: %d folds, %d cached, %d to run", len(folds), len(folds) - len(missing), len(missing))
+    if missing and quantiles:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Quantile folds already train their models in parallel worker processes
+        for origin, (fold_df, path) in missing.items():
+            run_fold(fold_df, origin, features, categorical, recursive, quantiles=quantiles,
+                     n_jobs=n_jobs).to_parquet(path, index=False)
+    elif missing:
+        os.makedirs(cache_dir, exist_ok=True)
+        n_workers, n_threads = thread_budget(len(missing), n_jobs)
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {
+                origin: pool.submit(run_fold, fold_df, origin, features, categorical, recursive, n_threads)
+                for origin, (fold_df, _) in missing.items()
+            }
+            for origin, future in futures.items():
+                future.result().to_parquet(missing[origin][1], index=False)
+
+    if not folds:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat([pd.read_parquet(path) for _, path in folds.values()], ignore_index=True)
+
+def pinball_loss(actual, predicted, alpha):
+    """Quantile (pinball) loss per row"""
+    diff = actual - predicted
+    return np.maximum(alpha * diff, (alpha - 1) * diff)
+
+def backtest_metrics(results, by=None):
+    """WAPE, bias, pinball loss of the 90% bounds and interval coverage, overall or per `by` group"""
+    df = results.assign(
+        abs_error=(results['forecast'] - results['units']).abs(),
+        error=results['forecast'] - results['units'],
+        abs_actual=results['units'].abs(),
+        pinball_lower=pinball_loss(results['units'], results['lower_90'], LOWER_ALPHA),
+        pinball_upper=pinball_loss(results['units'], results['upper_90'], UPPER_ALPHA),
+        covered=results['units'].between(results['lower_90'], results['upper_90']).astype(float)
+    )
+    grouped = df.groupby(by or (lambda _: 'all'), observed=True)
+    sums = grouped[['abs_error', 'error', 'abs_actual', 'units']].sum()
+    means = grouped[['pinball_lower', 'pinball_upper', 'covered']].mean()
+    return pd.DataFrame({
+        'wape': sums['abs_error'] / sums['abs_actual'],
+        'bias': sums['error'] / sums['units'],
+        f'pinball_{quantile_column(LOWER_ALPHA)}': means['pinball_lower'],
+        f'pinball_{quantile_column(UPPER_ALPHA)}': means['pinball_upper'],
+        'coverage_90': means['covered'],
+        'n': grouped.size()
+    })
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the forecasting models")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--cache-dir", default=BACKTEST_DIR, help="per-fold prediction cache")
+    parser.add_argument("--n-origins", type=int, default=4)
+    parser.add_argument("--horizon", type=int, default=13)
+    parser.add_argument("--step", type=int, default=4, help="weeks between consecutive origins")
+    parser.add_argument("--recursive", action="store_true", help="use lag features with recursive forecasting")
+    parser.add_argument("--n-jobs", type=int, default=None, help="parallel fold workers (default: all cores)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    panel, price_plan_fut, promos_fut, weather_fut, calendar_fut = load_typed_data(args.data_dir)
+    future_df = prepare_future_data(calendar_fut, price_plan_fut, weather_fut, promos_fut)
+    train_df, _ = build_model_frames(panel, future_df, lags=args.recursive)
+    features = FEATURES + LAG_FEATURES if args.recursive else FEATURES
+
+    results = run_backtest(train_df, features, CATEGORICAL, args.n_origins, args.horizon, args.step,
+                           args.recursive, args.cache_dir, args.n_jobs)
+    print(backtest_metrics(results).round(3).to_string())
+    print(backtest_metrics(results, ['market']).round(3).to_string())
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, "backtest_metrics.csv")
+    backtest_metrics(results, ['market', 'sku_id']).round(4).to_csv(path)
+    logger.info("Wrote per market/SKU metrics to %s", path)
+
+if __name__ == "__main__":
+    main()
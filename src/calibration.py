@@ -0,0 +1,133 @@
+"""Conformal calibration of the 90% prediction intervals.
+
+The q05/q95 boosters are not guaranteed to cover 90% of outcomes, and
+their outputs can cross the mean forecast. This module applies
+conformalized quantile regression (CQR): on held-out weeks it scores how
+far actuals fall outside the raw interval, separately below the lower
+and above the upper bound, and takes the finite-sample conformal
+quantile of those scores per segment (e.g. per market). At prediction
+time the bounds are shifted by the segment's offsets and the quantile
+columns are sorted so that they no longer cross.
+
+Held-out predictions come from the rolling-origin backtest folds, which
+are cached on disk, so calibrating does not retrain the production
+boosters. Conformal coverage only holds for models trained the way the
+folds were, so folds follow the version's training path (train_models,
+or the quantile models with `quantiles`). The calibration is stored with
+the model version in the model store.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.backtesting import run_backtest
+from src.config import MODEL_DIR, BACKTEST_DIR
+from src.model_store import save_artifact, load_artifact
+from src.modeling import quantile_column, quantile_columns, LOWER_ALPHA, UPPER_ALPHA
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT = "calibration"
+SEGMENT_KEYS = ['market']
+MIN_SEGMENT_ROWS = 30
+CALIBRATION_ORIGINS = 4
+CALIBRATION_HORIZON = 13
+
+def segment_labels(df, by):
+    """One string label per row for the segment columns `by` ('' when by is empty)"""
+    if not by:
+        return pd.Series('', index=df.index)
+    labels = df[by[0]].astype(str)
+    for column in by[1:]:
+        labels = labels + '|' + df[column].astype(str)
+    return labels
+
+def conformal_quantiles(scores, labels, level):
+    """Finite-sample conformal quantile of `scores` per label
+
+    The k-th smallest score with k = ceil((n + 1) * level), capped at n.
+    Returns a Series indexed by label.
+    """
+    codes, uniques = pd.factorize(labels)
+    order = np.lexsort((scores, codes))
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    k = np.minimum(np.ceil((counts + 1) * level).astype(int), counts) - 1
+    return pd.Series(np.asarray(scores)[order][starts + k], index=uniques)
+
+def fit_calibration(results, by=SEGMENT_KEYS, min_rows=MIN_SEGMENT_ROWS):
+    """Lower/upper CQR offsets per segment from held-out predictions with actuals
+
+    `results` needs units, lower_90 and upper_90 plus the `by` columns
+    (e.g. run_backtest output). Segments with fewer than `min_rows`
+    held-out rows use the global offsets.
+    """
+    results = results[results['units'].notnull()]
+    if results.empty:
+        raise ValueError("No held-out rows with actuals to calibrate on")
+    lower_scores = (results['lower_90'] - results['units']).values
+    upper_scores = (results['units'] - results['upper_90']).values
+    level = 1 - (1 - (UPPER_ALPHA - LOWER_ALPHA)) / 2
+    labels = segment_labels(results, by)
+    everything = pd.Series('', index=results.index)
+
+    counts = labels.value_counts()
+    kept = counts[counts >= min_rows].index
+    lower, upper = conformal_quantiles(lower_scores, labels, level), conformal_quantiles(upper_scores, labels, level)
+    return {
+        'by': list(by),
+        'level': level,
+        'n_rows': len(results),
+        'global': {
+            'lower': float(conformal_quantiles(lower_scores, everything, level).iloc[0]),
+            'upper': float(conformal_quantiles(upper_scores, everything, level).iloc[0])
+        },
+        'segments': {
+            label: {'lower': float(lower[label]), 'upper': float(upper[label]), 'n_rows': int(counts[label])}
+            for label in kept
+        }
+    }
+
+def sort_quantiles(predictions):
+    """Rearrange the bound and quantile columns so they are non-decreasing and bracket the forecast"""
+    columns = ['lower_90'] + list(quantile_columns(predictions).values()) + ['upper_90']
+    values = np.sort(predictions[columns].values, axis=1)
+    values[:, 0] = np.minimum(values[:, 0], predictions['forecast'].values)
+    values[:, -1] = np.maximum(values[:, -1], predictions['forecast'].values)
+    predictions[columns] = np.clip(values, 0, None)
+    return predictions
+
+def apply_calibration(predictions, calibration):
+    """Shift the 90% bounds by their segment's conformal offsets and sort the quantiles"""
+    predictions = predictions.copy()
+    labels = segment_labels(predictions, calibration['by'])
+    segments = calibration['segments']
+    lower = labels.map({label: s['lower'] for label, s in segments.items()}).fillna(calibration['global']['lower'])
+    upper = labels.map({label: s['upper'] for label, s in segments.items()}).fillna(calibration['global']['upper'])
+    predictions['lower_90'] = predictions['lower_90'] - lower.values
+    predictions['upper_90'] = predictions['upper_90'] + upper.values
+    # The q05/q95 columns are the same quantiles as the bounds
+    for column, bound in [(quantile_column(LOWER_ALPHA), 'lower_90'), (quantile_column(UPPER_ALPHA), 'upper_90')]:
+        if column in predictions:
+            predictions[column] = predictions[bound]
+    return sort_quantiles(predictions)
+
+def train_or_load_calibration(train_df, features, categorical, version, store_dir=MODEL_DIR,
+                              cache_dir=BACKTEST_DIR, by=SEGMENT_KEYS, recursive=False, recalibrate=False,
+                              n_jobs=None, quantiles=None):
+    """Load the calibration stored with a model version, fitting it from backtest folds on a miss
+
+    Pass the version's `quantiles` for models from train_or_load_quantile_models,
+    so the folds are trained the same way.
+    """
+    calibration = None if recalibrate else load_artifact(version, ARTIFACT, store_dir)
+    if calibration is None or calibration.get('by') != list(by):
+        results = run_backtest(train_df, features, categorical, n_origins=CALIBRATION_ORIGINS,
+                               horizon=CALIBRATION_HORIZON, recursive=recursive, cache_dir=cache_dir,
+                               n_jobs=n_jobs, quantiles=quantiles)
+        calibration = fit_calibration(results, by)
+        save_artifact(version, ARTIFACT, calibration, store_dir)
+        logger.info("Calibrated intervals on %d held-out rows (global offsets %.2f/%.2f)",
+                    calibration['n_rows'], calibration['global']['lower'], calibration['global']['upper'])
+    return calibration
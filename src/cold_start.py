@@ -0,0 +1,216 @@
+"""Cold-start forecasts for new or short-history SKU/market series.
+
+A new sku_id or market is an unseen category to the LightGBM models, so
+their forecasts are unreliable. This module builds a nearest-neighbour
+index over profile vectors of established series (price level and
+volatility, promo intensity, weather, and the demand level of the same SKU
+and market elsewhere) together with each series' demand curve by week of
+life. A cold series borrows the weighted curve of its k nearest neighbours,
+and the borrowed forecast is blended out as the series gathers history,
+including over the forecast horizon.
+
+Building the index scans the whole training panel, so it is cached on
+disk per model version and later lookups only query the stored profiles:
+
+    <cache_dir>/cold_start_<version>/established.parquet   profiles and curves
+    <cache_dir>/cold_start_<version>/history.parquet       weeks of history per series
+    <cache_dir>/cold_start_<version>/levels.json           SKU/market/overall demand levels
+"""
+import json
+import os
+import shutil
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from src.config import COLD_START_DIR
+from src.data_processing import series_grid, to_grid
+from src.modeling import quantile_columns, LOWER_ALPHA, UPPER_ALPHA
+
+CURVE_WEEKS = 26
+ESTABLISHED_WEEKS = 26
+RAMP_WEEKS = 13
+N_NEIGHBORS = 5
+# Approximate search: neighbours are within (1 + eps) of the true k-th distance
+NEIGHBOR_EPS = 0.5
+PROFILE_COLUMNS = ['log_price', 'price_cv', 'promo_share', 'temp_c', 'rain_mm', 'sku_level', 'market_level']
+
+ColdStartIndex = namedtuple('ColdStartIndex', ['tree', 'keys', 'curves', 'center', 'scale', 'levels', 'history',
+                                               'profiles'])
+
+def demand_levels(train_df):
+    """Log mean weekly units per SKU, per market and overall, used to profile new series"""
+    log_units = np.log1p(train_df['units'].astype(float))
+    return {
+        'sku': log_units.groupby(train_df['sku_id'].astype(str)).mean(),
+        'market': log_units.groupby(train_df['market'].astype(str)).mean(),
+        'overall': log_units.mean()
+    }
+
+def series_profiles(df, levels, attributes=None):
+    """One profile vector per (market, sku_id) series from its rows' price, promo and weather
+
+    `attributes` optionally adds numeric SKU attribute columns (indexed by sku_id).
+    """
+    grouped = df.groupby([df['market'].astype(str), df['sku_id'].astype(str)])
+    price = grouped['price']
+    profiles = pd.DataFrame({
+        'log_price': np.log(price.mean()),
+        'price_cv': (price.std() / price.mean()).fillna(0),
+        'promo_share': grouped['promo_flag'].mean(),
+        'temp_c': grouped['temp_c'].mean(),
+        'rain_mm': grouped['rain_mm'].mean()
+    })
+    markets = profiles.index.get_level_values(0)
+    skus = profiles.index.get_level_values(1)
+    # Unknown SKUs/markets fall back to the overall demand level
+    profiles['sku_level'] = levels['sku'].reindex(skus).fillna(levels['overall']).values
+    profiles['market_level'] = levels['market'].reindex(markets).fillna(levels['overall']).values
+    if attributes is not None:
+        attrs = attributes.reindex(skus)
+        profiles = pd.concat([profiles, attrs.set_axis(profiles.index).fillna(attributes.mean())], axis=1)
+    return profiles.fillna(0)
+
+def history_weeks(train_df):
+    """Weeks of observed units per (market, sku_id) series"""
+    observed = train_df[train_df['units'].notnull()]
+    return observed.groupby([observed['market'].astype(str), observed['sku_id'].astype(str)]).size()
+
+def demand_curves(train_df, curve_weeks=CURVE_WEEKS):
+    """Units by week of life (from each series' first observed week), forward-filled past its history"""
+    observed = train_df[train_df['units'].notnull()]
+    series_codes, week_codes, n_series, n_weeks = series_grid(observed)
+    grid = to_grid(observed['units'].values, series_codes, week_codes, (n_series, n_weeks))
+    first_week = np.full(n_series, n_weeks)
+    np.minimum.at(first_week, series_codes, week_codes)
+
+    columns = first_week[:, None] + np.arange(curve_weeks)[None, :]
+    in_range = columns < n_weeks
+    curves = np.where(in_range, grid[np.arange(n_series)[:, None], np.minimum(columns, n_weeks - 1)], np.nan)
+    # Forward-fill gaps and the weeks beyond each series' history along the curve
+    last_valid = np.where(~np.isnan(curves), np.arange(curve_weeks), 0)
+    np.maximum.accumulate(last_valid, axis=1, out=last_valid)
+    curves = curves[np.arange(n_series)[:, None], last_valid]
+
+    first_rows = np.unique(series_codes, return_index=True)[1]
+    keys = pd.MultiIndex.from_arrays([observed['market'].astype(str).values[first_rows],
+                                      observed['sku_id'].astype(str).values[first_rows]])
+    return pd.DataFrame(curves, index=keys)
+
+def build_cold_start_index(train_df, attributes=None, established_weeks=ESTABLISHED_WEEKS,
+                           curve_weeks=CURVE_WEEKS):
+    """Index the profiles and demand curves of series with at least `established_weeks` of history"""
+    levels = demand_levels(train_df)
+    history = history_weeks(train_df)
+    established = history[history >= established_weeks].index
+    profiles = series_profiles(train_df, levels, attributes).reindex(established)
+    curves = demand_curves(train_df, curve_weeks).reindex(established)
+    return _make_index(profiles, curves.values, levels, history, established_weeks)
+
+def _make_index(profiles, curves, levels, history, established_weeks=ESTABLISHED_WEEKS):
+    """Standardize the established profiles and build their KD-tree"""
+    if profiles.empty:
+        raise ValueError(f"No series with at least {established_weeks} weeks of history to borrow from")
+    center = profiles.mean()
+    scale = profiles.std().replace(0, 1).fillna(1)
+    tree = cKDTree(((profiles - center) / scale).values)
+    return ColdStartIndex(tree, profiles.index, curves, center, scale, levels, history, profiles)
+
+def save_cold_start_index(index, path):
+    """Write an index's profiles, curves, history and demand levels to a directory"""
+    tmp_path = path.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    columns = [f'curve_{i:02d}' for i in range(index.curves.shape[1])]
+    curves = pd.DataFrame(index.curves, index=index.keys, columns=columns)
+    index.profiles.join(curves).rename_axis(['market', 'sku_id']).reset_index().to_parquet(
+        os.path.join(tmp_path, "established.parquet"), index=False)
+    index.history.rename('weeks').rename_axis(['market', 'sku_id']).reset_index().to_parquet(
+        os.path.join(tmp_path, "history.parquet"), index=False)
+    with open(os.path.join(tmp_path, "levels.json"), "w") as f:
+        json.dump({'sku': index.levels['sku'].to_dict(), 'market': index.levels['market'].to_dict(),
+                   'overall': float(index.levels['overall'])}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+def load_cold_start_index(path):
+    """Rebuild a saved index (only its KD-tree is recomputed), or None if it is missing"""
+    if not os.path.exists(os.path.join(path, "levels.json")):
+        return None
+    established = pd.read_parquet(os.path.join(path, "established.parquet")).set_index(['market', 'sku_id'])
+    curve_columns = [c for c in established.columns if c.startswith('curve_')]
+    history = pd.read_parquet(os.path.join(path, "history.parquet")).set_index(['market', 'sku_id'])['weeks']
+    with open(os.path.join(path, "levels.json")) as f:
+        levels = json.load(f)
+    levels = {'sku': pd.Series(levels['sku'], dtype=float), 'market': pd.Series(levels['market'], dtype=float),
+              'overall': levels['overall']}
+    return _make_index(established.drop(columns=curve_columns), established[curve_columns].values, levels,
+                       history.rename_axis([None, None]))
+
+def cached_cold_start_index(train_df, version, cache_dir=COLD_START_DIR):
+    """The cold-start index of a model version, built from train_df and saved on a cache miss"""
+    path = os.path.join(cache_dir, f"cold_start_{version}")
+    index = load_cold_start_index(path)
+    if index is None:
+        index = build_cold_start_index(train_df)
+        os.makedirs(cache_dir, exist_ok=True)
+        save_cold_start_index(index, path)
+    return index
+
+def borrow_curves(index, profiles, weeks_of_life, k=N_NEIGHBORS, eps=NEIGHBOR_EPS,
+                  quantiles=(LOWER_ALPHA, UPPER_ALPHA)):
+    """Borrowed demand for each query row from the k nearest established series
+
+    `profiles` holds one profile (series_profiles columns) per row and `weeks_of_life`
+    the row's 1-based week since launch. Returns (mean, quantile values):
+    the inverse-distance weighted neighbour curve and a (rows x quantiles)
+    array of the neighbours' `quantiles`.
+    """
+    k = min(k, index.tree.n)
+    query = ((profiles[index.center.index] - index.center) / index.scale).values
+    distances, neighbors = index.tree.query(query, k=k, eps=eps, workers=-1)
+    distances, neighbors = distances.reshape(len(query), k), neighbors.reshape(len(query), k)
+
+    position = np.clip(np.asarray(weeks_of_life).astype(int) - 1, 0, index.curves.shape[1] - 1)
+    values = index.curves[neighbors, position[:, None]]
+    weights = 1.0 / (distances + 1e-6)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return (weights * values).sum(axis=1), np.quantile(values, quantiles, axis=1).T
+
+def apply_cold_start(predictions, train_df, index=None, attributes=None, k=N_NEIGHBORS, ramp_weeks=RAMP_WEEKS):
+    """Blend borrowed neighbour demand into forecasts of series with under `ramp_weeks` of history
+
+    The model's weight grows linearly with the series' weeks of life at each
+    forecast week (0 in a brand-new series' first week, 1 from `ramp_weeks`
+    on). The forecast, the 90% bounds and any quantile columns are blended.
+    Adds a cold_start_weight column holding the borrowed share. Pass a
+    prebuilt `index` (e.g. cached_cold_start_index) to avoid rescanning
+    train_df.
+    """
+    if index is None:
+        index = build_cold_start_index(train_df, attributes)
+    predictions = predictions.copy()
+    keys = pd.MultiIndex.from_arrays([predictions['market'].astype(str), predictions['sku_id'].astype(str)])
+    history = index.history.reindex(keys).fillna(0).values
+    step = predictions.groupby([keys.get_level_values(0), keys.get_level_values(1)])['week_start'].rank(method='dense')
+    weeks_of_life = history + step.values
+    predictions['cold_start_weight'] = np.clip(1 - (weeks_of_life - 1) / ramp_weeks, 0, 1)
+    cold = predictions['cold_start_weight'].values > 0
+    if not cold.any():
+        return predictions
+
+    cold_rows = predictions[cold]
+    profiles = series_profiles(cold_rows, index.levels, attributes)
+    row_profiles = profiles.reindex(keys[cold])
+    columns = {LOWER_ALPHA: 'lower_90', UPPER_ALPHA: 'upper_90'}
+    columns = list(columns.items()) + list(quantile_columns(predictions).items())
+    mean, borrowed_quantiles = borrow_curves(index, row_profiles, weeks_of_life[cold], k,
+                                             quantiles=[q for q, _ in columns])
+
+    borrowed = predictions.loc[cold, 'cold_start_weight'].values
+    blends = [('forecast', mean)] + [(column, borrowed_quantiles[:, i]) for i, (_, column) in enumerate(columns)]
+    for column, values in blends:
+        predictions.loc[cold, column] = (1 - borrowed) * predictions.loc[cold, column].values + borrowed * values
+    return predictions
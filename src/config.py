@@ -0,0 +1,15 @@
+import os
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Directories can be overridden per deployment through environment variables
+DATA_DIR = os.environ.get('FORECAST_DATA_DIR', os.path.join(PROJECT_ROOT, 'data'))
+OUTPUT_DIR = os.environ.get('FORECAST_OUTPUT_DIR', os.path.join(PROJECT_ROOT, 'outputs'))
+PLOTS_DIR = os.environ.get('FORECAST_PLOTS_DIR', os.path.join(PROJECT_ROOT, 'plots'))
+MODEL_DIR = os.environ.get('FORECAST_MODEL_DIR', os.path.join(OUTPUT_DIR, 'models'))
+FEATURE_DIR = os.environ.get('FORECAST_FEATURE_DIR', os.path.join(OUTPUT_DIR, 'features'))
+BACKTEST_DIR = os.environ.get('FORECAST_BACKTEST_DIR', os.path.join(OUTPUT_DIR, 'backtests'))
+ATTRIBUTION_DIR = os.environ.get('FORECAST_ATTRIBUTION_DIR', os.path.join(OUTPUT_DIR, 'attributions'))
+PROFILE_DIR = os.environ.get('FORECAST_PROFILE_DIR', os.path.join(OUTPUT_DIR, 'profiles'))
+SAMPLE_PATH_DIR = os.environ.get('FORECAST_SAMPLE_PATH_DIR', os.path.join(OUTPUT_DIR, 'sample_paths'))
+COLD_START_DIR = os.environ.get('FORECAST_COLD_START_DIR', os.path.join(OUTPUT_DIR, 'cold_start'))
@@ -1,56 +1,181 @@
 import pandas as pd
 import numpy as np
-import streamlit as st
 import os
+from numpy.lib.stride_tricks import sliding_window_view
+from pandas.api.types import union_categoricals
+from src.config import DATA_DIR
+from src.profiling import instrumented
 
-@st.cache_data
-def load_data():
+DATE_FORMAT = '%d-%m-%Y'
+
+# Compact dtypes per input table; date columns are parsed while reading
+SCHEMAS = {
+    'panel_train': {
+        'dtypes': {'market': 'category', 'sku_id': 'category', 'units': 'float32', 'price': 'float32',
+                   'promo_flag': 'int8', 'holiday_flag': 'int8', 'temp_c': 'float32', 'rain_mm': 'float32'},
+        'dates': ['week_start']
+    },
+    'price_plan_future': {
+        'dtypes': {'market': 'category', 'sku_id': 'category', 'planned_price': 'float32'},
+        'dates': ['week_start']
+    },
+    'promos_future': {
+        'dtypes': {'market': 'category', 'sku_id': 'category', 'promo_type': 'category'},
+        'dates': ['week_start', 'week_end']
+    },
+    'weather_future': {
+        'dtypes': {'market': 'category', 'temp_c': 'float32', 'rain_mm': 'float32'},
+        'dates': ['week_start']
+    },
+    'calendar_future': {
+        'dtypes': {'holiday_flag': 'int8', 'fiscal_week': 'int16'},
+        'dates': ['week_start']
+    }
+}
+TABLE_FORMATS = ['parquet', 'feather', 'csv']
+
+UNITS_LAGS = [1, 2, 3, 4, 8, 12]
+PRICE_LAGS = [1, 2, 4]
+ROLLING_WINDOWS = [4, 8, 12]
+ROLLING_STATS = ['mean', 'std', 'max', 'min']
+UNITS_LAG_FEATURES = (
+    [f'units_lag_{k}' for k in UNITS_LAGS] +
+    [f'units_roll_{stat}_{w}' for w in ROLLING_WINDOWS for stat in ROLLING_STATS]
+)
+PRICE_LAG_FEATURES = [f'price_lag_{k}' for k in PRICE_LAGS] + ['price_change', 'price_pct_change']
+LAG_FEATURES = UNITS_LAG_FEATURES + PRICE_LAG_FEATURES
+# Weeks of history a units lag feature looks back
+MAX_LOOKBACK = max(UNITS_LAGS + ROLLING_WINDOWS)
+
+@instrumented()
+def load_data(data_dir=DATA_DIR):
     """Load all datasets"""
-    try:
-        data_dir = r"D:\colddd\data"
-        panel = pd.read_csv(os.path.join(data_dir, "panel_train.csv"))
-        price_plan_fut = pd.read_csv(os.path.join(data_dir, "price_plan_future.csv"))
-        promos_fut = pd.read_csv(os.path.join(data_dir, "promos_future.csv"))
-        weather_fut = pd.read_csv(os.path.join(data_dir, "weather_future.csv"))
-        calendar_fut = pd.read_csv(os.path.join(data_dir, "calendar_future.csv"))
-        return panel, price_plan_fut, promos_fut, weather_fut, calendar_fut
-    except Exception as e:
-        st.error(f"Error loading data: {e}")
-        return None, None, None, None, None
-
-@st.cache_data
+    panel = pd.read_csv(os.path.join(data_dir, "panel_train.csv"))
+    price_plan_fut = pd.read_csv(os.path.join(data_dir, "price_plan_future.csv"))
+    promos_fut = pd.read_csv(os.path.join(data_dir, "promos_future.csv"))
+    weather_fut = pd.read_csv(os.path.join(data_dir, "weather_future.csv"))
+    calendar_fut = pd.read_csv(os.path.join(data_dir, "calendar_future.csv"))
+    return panel, price_plan_fut, promos_fut, weather_fut, calendar_fut
+
+def find_table(data_dir, name):
+    """Return the path of a table, preferring Parquet, then Feather, then CSV"""
+    for fmt in TABLE_FORMATS:
+        path = os.path.join(data_dir, f"{name}.{fmt}")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {name}.parquet/.feather/.csv found in {data_dir}")
+
+def _apply_schema(df, schema):
+    """Cast a frame to the schema's compact dtypes and parse its date columns"""
+    for col in schema['dates']:
+        if col in df and isinstance(df[col].dtype, pd.CategoricalDtype):
+            # Weekly dates repeat heavily: parse each distinct string once; missing dates (code -1) stay NaT
+            dates = pd.to_datetime(df[col].cat.categories, format=DATE_FORMAT)
+            df[col] = dates.take(df[col].cat.codes.values, allow_fill=True, fill_value=pd.NaT)
+        elif col in df:
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT)
+    dtypes = {col: dtype for col, dtype in schema['dtypes'].items() if col in df}
+    return df.astype(dtypes, copy=False)
+
+def iter_table(path, schema, columns=None, chunksize=100_000):
+    """Stream a CSV table as typed chunks of at most `chunksize` rows"""
+    csv_dtypes = dict(schema['dtypes'], **{col: 'category' for col in schema['dates']})
+    csv_dtypes = {col: dtype for col, dtype in csv_dtypes.items() if columns is None or col in columns}
+    for chunk in pd.read_csv(path, usecols=columns, dtype=csv_dtypes, chunksize=chunksize):
+        yield _apply_schema(chunk, schema)
+
+def _concat_chunks(chunks):
+    """Concatenate typed chunks, unioning category levels so columns stay categorical"""
+    if len(chunks) == 1:
+        return chunks[0]
+    for col in chunks[0].select_dtypes('category').columns:
+        categories = union_categoricals([c[col] for c in chunks]).categories
+        for c in chunks:
+            c[col] = c[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+def read_table(path, schema, columns=None, chunksize=100_000):
+    """Read one table with compact dtypes, pruning to `columns` when given"""
+    if path.endswith('.parquet'):
+        return _apply_schema(pd.read_parquet(path, columns=columns), schema)
+    if path.endswith('.feather'):
+        return _apply_schema(pd.read_feather(path, columns=columns), schema)
+    return _concat_chunks(list(iter_table(path, schema, columns, chunksize)))
+
+@instrumented()
+def load_typed_data(data_dir=DATA_DIR, columns=None, chunksize=100_000):
+    """Load all datasets with compact dtypes and parsed dates in a single pass
+
+    Replaces load_data + parse_dates. Each table may be stored as Parquet,
+    Feather or CSV; CSVs are read in chunks of `chunksize` rows to bound peak
+    memory. `columns` optionally maps table name to the columns to read.
+    """
+    columns = columns or {}
+    return tuple(
+        read_table(find_table(data_dir, name), SCHEMAS[name], columns.get(name), chunksize)
+        for name in ['panel_train', 'price_plan_future', 'promos_future', 'weather_future', 'calendar_future']
+    )
+
+@instrumented()
 def parse_dates(panel, price_plan_fut, promos_fut, weather_fut, calendar_fut):
     """Parse date columns"""
-    date_format = '%d-%m-%Y'
-    panel['week_start'] = pd.to_datetime(panel['week_start'], format=date_format)
-    price_plan_fut['week_start'] = pd.to_datetime(price_plan_fut['week_start'], format=date_format)
-    calendar_fut['week_start'] = pd.to_datetime(calendar_fut['week_start'], format=date_format)
-    weather_fut['week_start'] = pd.to_datetime(weather_fut['week_start'], format=date_format)
-    promos_fut['week_start'] = pd.to_datetime(promos_fut['week_start'], format=date_format)
-    promos_fut['week_end'] = pd.to_datetime(promos_fut['week_end'], format=date_format)
+    panel['week_start'] = pd.to_datetime(panel['week_start'], format=DATE_FORMAT)
+    price_plan_fut['week_start'] = pd.to_datetime(price_plan_fut['week_start'], format=DATE_FORMAT)
+    calendar_fut['week_start'] = pd.to_datetime(calendar_fut['week_start'], format=DATE_FORMAT)
+    weather_fut['week_start'] = pd.to_datetime(weather_fut['week_start'], format=DATE_FORMAT)
+    promos_fut['week_start'] = pd.to_datetime(promos_fut['week_start'], format=DATE_FORMAT)
+    promos_fut['week_end'] = pd.to_datetime(promos_fut['week_end'], format=DATE_FORMAT)
     return panel, price_plan_fut, promos_fut, weather_fut, calendar_fut
 
-def has_promo(row, promos):
-    """Check if SKU-Market has promo in given week"""
-    matching = promos[
-        (promos['market'] == row['market']) & 
-        (promos['sku_id'] == row['sku_id']) &
-        (promos['week_start'] <= row['week_start']) & 
-        (promos['week_end'] >= row['week_start'])
-    ]
-    return 1 if not matching.empty else 0
-
-@st.cache_data
+def flag_promos(future_df, promos):
+    """Flag promo weeks with a vectorized interval join on (market, sku_id)
+
+    Each promo is expanded to the forecast weeks its [week_start, week_end]
+    range covers (located with searchsorted over the sorted weeks), then
+    hash-joined back onto future_df. Cost is linear in rows + promo-weeks.
+    Adds promo_flag, promo_count (overlapping promos) and promo_type (type of
+    the most recently started active promo).
+    """
+    keys = ['market', 'sku_id', 'week_start']
+    weeks = np.sort(future_df['week_start'].unique())
+    lo = np.searchsorted(weeks, promos['week_start'].values, side='left')
+    hi = np.searchsorted(weeks, promos['week_end'].values, side='right')
+    n_weeks = np.clip(hi - lo, 0, None)
+    
+    promo_idx = np.repeat(np.arange(len(promos)), n_weeks)
+    # Position of each expanded row within its promo: 0, 1, ..., n_weeks - 1
+    offsets = np.arange(len(promo_idx)) - np.repeat(np.cumsum(n_weeks) - n_weeks, n_weeks)
+    
+    expanded = pd.DataFrame({
+        'market': promos['market'].values[promo_idx],
+        'sku_id': promos['sku_id'].values[promo_idx],
+        'week_start': weeks[lo[promo_idx] + offsets],
+        'promo_start': promos['week_start'].values[promo_idx],
+        'promo_type': promos['promo_type'].values[promo_idx]
+    }).sort_values('promo_start', kind='stable')
+    
+    active = expanded.groupby(keys, sort=False, observed=True).agg(
+        promo_count=('promo_type', 'size'),
+        promo_type=('promo_type', 'last')
+    ).reset_index()
+    
+    future_df = future_df.drop(columns=['promo_flag', 'promo_count', 'promo_type'], errors='ignore')
+    future_df = future_df.merge(active, on=keys, how='left')
+    future_df['promo_count'] = future_df['promo_count'].fillna(0).astype(int)
+    future_df['promo_flag'] = (future_df['promo_count'] > 0).astype(int)
+    return future_df
+
+@instrumented()
 def prepare_future_data(calendar_fut, price_plan_fut, weather_fut, promos_fut):
     """Prepare future forecast dataframe"""
     weeks = calendar_fut['week_start'].unique()
     markets = price_plan_fut['market'].unique()
     skus = price_plan_fut['sku_id'].unique()
     
-    future_df = pd.DataFrame(
-        [(w, m, s) for w in weeks for m in markets for s in skus], 
-        columns=['week_start', 'market', 'sku_id']
-    )
+    future_df = pd.MultiIndex.from_product(
+        [weeks, markets, skus], 
+        names=['week_start', 'market', 'sku_id']
+    ).to_frame(index=False)
     
     future_df = future_df.merge(
         price_plan_fut, 
@@ -70,24 +195,129 @@ def prepare_future_data(calendar_fut, price_plan_fut, weather_fut, promos_fut):
         how='left'
     )
     
-    future_df['promo_flag'] = future_df.apply(
-        lambda row: has_promo(row, promos_fut), 
-        axis=1
-    )
+    future_df = flag_promos(future_df, promos_fut)
     
     return future_df
 
-def engineer_features(all_df):
-    """Create time-based features"""
+@instrumented()
+def engineer_features(all_df, time_origin=None):
+    """Create time-based features
+
+    By default time_index ranks the weeks present in all_df. With `time_origin`
+    it counts weeks since that date instead, so features can be built for any
+    subset of rows (e.g. one partition) independently.
+    """
     if all_df['week_start'].isnull().any():
-        st.error("Missing values detected in week_start column")
-        return all_df
+        raise ValueError("Missing values detected in week_start column")
     
-    unique_weeks = sorted(all_df['week_start'].unique())
-    all_df['time_index'] = all_df['week_start'].map({w: i for i, w in enumerate(unique_weeks)}).astype(float)
+    if time_origin is None:
+        unique_weeks = sorted(all_df['week_start'].unique())
+        all_df['time_index'] = all_df['week_start'].map({w: i for i, w in enumerate(unique_weeks)}).astype(float)
+    else:
+        all_df['time_index'] = ((all_df['week_start'] - pd.Timestamp(time_origin)) / pd.Timedelta(weeks=1)).astype(float)
     all_df['week_of_year'] = all_df['week_start'].dt.isocalendar().week.astype(float)
     all_df['sin_week'] = np.sin(2 * np.pi * all_df['week_of_year'].fillna(0) / 52).astype(float)
     all_df['cos_week'] = np.cos(2 * np.pi * all_df['week_of_year'].fillna(0) / 52).astype(float)
     all_df['month'] = all_df['week_start'].dt.month.astype(float)
     all_df['quarter'] = all_df['week_start'].dt.quarter.astype(float)
-    return all_df
\ No newline at end of file
+    return all_df
+
+def series_grid(df):
+    """Map rows onto a dense (series x week) grid
+
+    Returns (series_codes, week_codes, n_series, n_weeks); series are
+    (market, sku_id) pairs and weeks are the sorted distinct week_start values.
+    """
+    series_codes = df.groupby(['market', 'sku_id'], observed=True, sort=False).ngroup().values
+    week_codes, weeks = pd.factorize(df['week_start'], sort=True)
+    return series_codes, week_codes, series_codes.max() + 1 if len(df) else 0, len(weeks)
+
+def to_grid(values, series_codes, week_codes, shape):
+    """Scatter row values into a (series x week) float matrix, NaN where absent"""
+    grid = np.full(shape, np.nan)
+    grid[series_codes, week_codes] = values
+    return grid
+
+def shift_grid(grid, k):
+    """Shift a (series x week) matrix k weeks forward along each series"""
+    shifted = np.full(grid.shape, np.nan)
+    if k < grid.shape[1]:
+        shifted[:, k:] = grid[:, :grid.shape[1] - k]
+    return shifted
+
+def rolling_stats(grid, window):
+    """NaN-aware mean/std/max/min over the `window` weeks ending at each column
+
+    Sums use cumulative sums and extremes reduce a strided window view, so
+    the cost is O(series x weeks x window) with no Python loop over series.
+    """
+    n_series, n_weeks = grid.shape
+    valid = ~np.isnan(grid)
+    filled = np.where(valid, grid, 0.0)
+    hi = np.arange(1, n_weeks + 1)
+    lo = np.maximum(hi - window, 0)
+    
+    def window_sum(values):
+        cumulative = np.concatenate([np.zeros((n_series, 1)), np.cumsum(values, axis=1)], axis=1)
+        return cumulative[:, hi] - cumulative[:, lo]
+    
+    count = window_sum(valid.astype(float))
+    total = window_sum(filled)
+    total_sq = window_sum(filled ** 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+        var = np.where(count > 1, (total_sq - total * mean) / (count - 1), np.nan)
+    
+    padded = np.concatenate([np.full((n_series, window - 1), np.nan), grid], axis=1)
+    windows = sliding_window_view(padded, window, axis=1)
+    return {
+        'mean': mean,
+        'std': np.sqrt(np.clip(var, 0, None)),
+        'max': np.fmax.reduce(windows, axis=2),
+        'min': np.fmin.reduce(windows, axis=2)
+    }
+
+def units_lag_grids(units_grid):
+    """Units lag and rolling features as (series x week) matrices
+
+    Rolling stats cover the weeks before each column, so no feature sees the
+    week it describes.
+    """
+    features = {f'units_lag_{k}': shift_grid(units_grid, k) for k in UNITS_LAGS}
+    previous = features['units_lag_1']
+    for w in ROLLING_WINDOWS:
+        for stat, values in rolling_stats(previous, w).items():
+            features[f'units_roll_{stat}_{w}'] = values
+    return features
+
+def add_lag_features(df):
+    """Add per-series units/price lag and rolling features to a history + horizon frame
+
+    Units features for rows without units (the forecast horizon) only see
+    actual history; make_recursive_predictions refills them step by step.
+    """
+    df = df.copy()
+    series_codes, week_codes, n_series, n_weeks = series_grid(df)
+    shape = (n_series, n_weeks)
+    
+    units_grid = to_grid(df['units'].values, series_codes, week_codes, shape)
+    for name, grid in units_lag_grids(units_grid).items():
+        df[name] = grid[series_codes, week_codes]
+    
+    price_grid = to_grid(df['price'].values, series_codes, week_codes, shape)
+    for k in PRICE_LAGS:
+        df[f'price_lag_{k}'] = shift_grid(price_grid, k)[series_codes, week_codes]
+    df['price_change'] = df['price'] - df['price_lag_1']
+    df['price_pct_change'] = df['price_change'] / df['price_lag_1']
+    return df
+
+@instrumented()
+def build_model_frames(panel, future_df, lags=False):
+    """Engineer features over history + horizon and split into train/future frames"""
+    all_df = pd.concat([panel, future_df], ignore_index=True).sort_values('week_start')
+    all_df = engineer_features(all_df)
+    if lags:
+        all_df = add_lag_features(all_df)
+    train_df = all_df[all_df['units'].notnull()].copy()
+    future_df = all_df[all_df['units'].isnull()].copy()
+    return train_df, future_df
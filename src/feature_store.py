@@ -0,0 +1,159 @@
+"""Partitioned Parquet store for engineered feature frames.
+
+Each table ('train', 'future') is stored as one Parquet file per
+(market, week) partition:
+
+    <store_dir>/<table>/manifest.json
+    <store_dir>/<table>/market=<market>/week=<YYYY-MM-DD>/part-0.parquet
+
+The manifest records a digest of the source rows behind every partition.
+On update only partitions whose source rows changed are re-engineered and
+rewritten, so a new week of sales appends a handful of partitions instead
+of rebuilding the whole history. Reads are column-pruned and can be
+restricted to markets/weeks without touching the other files.
+"""
+import json
+import os
+import shutil
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.config import FEATURE_DIR
+from src.data_processing import engineer_features
+from src.profiling import instrumented
+
+# Bump when engineer_features changes so stored partitions are rebuilt
+FEATURE_VERSION = 1
+MANIFEST = "manifest.json"
+PARTITION_KEYS = ['market', 'week_start']
+SORT_KEYS = ['week_start', 'market', 'sku_id']
+
+def _partition_key(market, week):
+    return f"{market}|{pd.Timestamp(week):%Y-%m-%d}"
+
+def _partition_path(market, week):
+    return os.path.join(f"market={quote(str(market), safe='')}", f"week={pd.Timestamp(week):%Y-%m-%d}",
+                        "part-0.parquet")
+
+def partition_digests(source_df):
+    """Digest the source rows of each (market, week) partition
+
+    Row hashes are combined with order-independent sum and xor, so the
+    digest only changes when a partition's rows change.
+    """
+    if source_df.empty:
+        return {}
+    row_hashes = pd.util.hash_pandas_object(source_df, index=False).values
+    codes = source_df.groupby(PARTITION_KEYS, observed=True, sort=False).ngroup().values
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sums = np.add.reduceat(row_hashes[order], starts)
+    xors = np.bitwise_xor.reduceat(row_hashes[order], starts)
+    first_rows = source_df.iloc[order[starts]]
+    return {
+        _partition_key(market, week): f"{total:016x}{xor:016x}-{count}"
+        for market, week, total, xor, count in zip(
+            first_rows['market'], first_rows['week_start'], sums, xors, counts
+        )
+    }
+
+def _read_manifest(table_dir):
+    path = os.path.join(table_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _write_manifest(table_dir, manifest):
+    path = os.path.join(table_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def update_features(source_df, table, time_origin, store_dir=FEATURE_DIR):
+    """Engineer and write features for partitions whose source rows changed
+
+    Returns counts of written, removed and unchanged partitions.
+    """
+    table_dir = os.path.join(store_dir, table)
+    time_origin = f"{pd.Timestamp(time_origin):%Y-%m-%d}"
+    manifest = _read_manifest(table_dir)
+    if (manifest is None or manifest['feature_version'] != FEATURE_VERSION
+            or manifest['time_origin'] != time_origin):
+        # Features are stale everywhere: rebuild the table from scratch
+        shutil.rmtree(table_dir, ignore_errors=True)
+        manifest = {'feature_version': FEATURE_VERSION, 'time_origin': time_origin, 'partitions': {}}
+    stored = manifest['partitions']
+
+    digests = partition_digests(source_df)
+    changed = {key for key, digest in digests.items() if stored.get(key, {}).get('digest') != digest}
+    removed = set(stored) - set(digests)
+
+    for key in removed:
+        shutil.rmtree(os.path.dirname(os.path.join(table_dir, stored.pop(key)['path'])), ignore_errors=True)
+
+    if changed:
+        row_keys = source_df['market'].astype(str) + '|' + source_df['week_start'].dt.strftime('%Y-%m-%d')
+        features_df = engineer_features(source_df[row_keys.isin(changed).values].copy(), time_origin)
+        features_df = features_df.sort_values(PARTITION_KEYS, kind='stable')
+        bounds = features_df.groupby(PARTITION_KEYS, observed=True, sort=False).size()
+        # Convert to Arrow once and write zero-copy slices per partition
+        arrow_table = pa.Table.from_pandas(features_df, preserve_index=False)
+        offset = 0
+        for (market, week), n_rows in bounds.items():
+            key = _partition_key(market, week)
+            path = _partition_path(market, week)
+            os.makedirs(os.path.dirname(os.path.join(table_dir, path)), exist_ok=True)
+            pq.write_table(arrow_table.slice(offset, n_rows), os.path.join(table_dir, path))
+            stored[key] = {'digest': digests[key], 'path': path}
+            offset += n_rows
+
+    os.makedirs(table_dir, exist_ok=True)
+    _write_manifest(table_dir, manifest)
+    return {'written': len(changed), 'removed': len(removed), 'unchanged': len(digests) - len(changed)}
+
+def read_features(table, columns=None, markets=None, weeks=None, store_dir=FEATURE_DIR):
+    """Read stored features, pruned to `columns` and optionally to markets/weeks
+
+    Partitions are selected from the manifest, so unselected files are never
+    opened. Requested columns the table does not have (e.g. 'units' in the
+    future table) are skipped.
+    """
+    table_dir = os.path.join(store_dir, table)
+    manifest = _read_manifest(table_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No feature table '{table}' in {store_dir}")
+    markets = None if markets is None else {str(m) for m in markets}
+    weeks = None if weeks is None else {f"{pd.Timestamp(w):%Y-%m-%d}" for w in weeks}
+    paths = []
+    for key, entry in manifest['partitions'].items():
+        market, week = key.rsplit('|', 1)
+        if (markets is None or market in markets) and (weeks is None or week in weeks):
+            paths.append(os.path.join(table_dir, entry['path']))
+    if not paths:
+        return pd.DataFrame(columns=columns)
+    dataset = ds.dataset(paths, format='parquet')
+    if columns is not None:
+        columns = [col for col in columns if col in dataset.schema.names]
+    df = dataset.to_table(columns=columns).to_pandas()
+    sort_keys = [col for col in SORT_KEYS if col in df]
+    return df.sort_values(sort_keys, kind='stable').reset_index(drop=True) if sort_keys else df
+
+@instrumented()
+def build_feature_frames(panel, future_df, columns=None, store_dir=FEATURE_DIR):
+    """Store-backed counterpart of build_model_frames
+
+    Updates the 'train' and 'future' tables incrementally and returns
+    column-pruned (train_df, future_df) frames read back from the store.
+    """
+    time_origin = min(panel['week_start'].min(), future_df['week_start'].min())
+    update_features(panel, 'train', time_origin, store_dir)
+    update_features(future_df, 'future', time_origin, store_dir)
+    return (read_features('train', columns, store_dir=store_dir),
+            read_features('future', columns, store_dir=store_dir))
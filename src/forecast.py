@@ -0,0 +1,206 @@
+"""Headless batch forecasting entry point.
+
+Runs the same data_processing/modeling pipeline as the dashboard without
+importing Streamlit, e.g. from a nightly cron job:
+
+    python -m src.forecast --data-dir data --output-dir outputs
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from src.config import DATA_DIR, OUTPUT_DIR, MODEL_DIR, FEATURE_DIR, PROFILE_DIR, SAMPLE_PATH_DIR
+from src.data_processing import load_typed_data, prepare_future_data, build_model_frames, LAG_FEATURES
+from src.feature_store import build_feature_frames
+from src.modeling import make_predictions, make_recursive_predictions, quantile_column, FEATURES, CATEGORICAL, LOWER_ALPHA, UPPER_ALPHA
+from src.cold_start import apply_cold_start, cached_cold_start_index
+from src.attribution import add_drivers, DRIVER_COLUMNS
+from src.hierarchy import training_residuals, reconcile_forecasts, forecast_aggregates
+from src.sample_paths import write_sample_paths
+from src.calibration import train_or_load_calibration, apply_calibration
+from src.model_store import train_or_load_models, train_or_load_quantile_models
+from src.incremental import update_or_retrain_models
+from src.profiling import profiled_run, instrumented
+from src.sharding import train_or_load_sharded_models, make_sharded_predictions, sharded_version
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_COLUMNS = ['week_start', 'market', 'sku_id', 'forecast', 'lower_90', 'upper_90']
+
+def run_forecast(data_dir=DATA_DIR, model_dir=MODEL_DIR, retrain=False, quantiles=None,
+                 features=FEATURES, categorical=CATEGORICAL, chunksize=100_000, feature_dir=FEATURE_DIR,
+                 recursive=False, cold_start=False, calibrate=False, shard_by=None, update=False, attributions=False,
+                 sample_paths=0, sample_dir=SAMPLE_PATH_DIR, hierarchy_file=None):
+    """Run the full pipeline and return predictions for every market and SKU
+
+    With `quantiles`, the mean and quantile models are trained in parallel
+    and one extra column per quantile is returned. With `recursive`, the
+    models also use units/price lag features and the horizon is forecast
+    week by week from earlier predictions. With `cold_start`, series with
+    little history are blended with demand borrowed from similar series.
+    With `calibrate`, the 90% bounds are conformally calibrated on backtest
+    folds trained like the models (stored with the model version) and the
+    quantiles sorted; it cannot be combined with `update` or `shard_by`.
+    With `shard_by` (e.g. 'market'), one model set is trained per value of
+    that column and rows are predicted by their shard's models, with the
+    global models as fallback for sparse shards (refitted only when the
+    sparse shards' rows change). With `update`, the newest
+    stored models are continued on weeks added since they were trained,
+    retraining fully only when their error on those weeks drifts. With
+    `attributions`, driver_* columns hold the mean model's TreeSHAP
+    contributions grouped by driver (cached per model version). With
+    `sample_paths` N, N joint 13-week demand paths per series are drawn
+    from the final forecast quantiles and the training residuals and
+    written to a memory-mapped store under `sample_dir`/<version>. With
+    `hierarchy_file`, coherent market, total and series forecasts (MinT
+    against an independent aggregate model) are written to that CSV.
+    """
+    if shard_by and (quantiles or recursive):
+        raise ValueError("Sharded models cannot be combined with quantiles or recursive forecasting")
+    if update and (quantiles or shard_by):
+        raise ValueError("Incremental updates cannot be combined with quantiles or sharded models")
+    if attributions and shard_by:
+        raise ValueError("Attributions are not available for sharded models")
+    if calibrate and (update or shard_by):
+        raise ValueError("Calibration is only available for fully trained global models (not with incremental "
+                         "updates or sharded models)")
+    if sample_paths and shard_by:
+        raise ValueError("Sample paths are not available for sharded models")
+    if hierarchy_file and shard_by:
+        raise ValueError("Hierarchy reconciliation is not available for sharded models")
+    start = time.perf_counter()
+    panel, price_plan_fut, promos_fut, weather_fut, calendar_fut = load_typed_data(data_dir, chunksize=chunksize)
+    future_df = prepare_future_data(calendar_fut, price_plan_fut, weather_fut, promos_fut)
+    if recursive:
+        # Lag features span partitions, so they are built in memory rather than in the feature store
+        features = features + LAG_FEATURES
+        train_df, future_df = build_model_frames(panel, future_df, lags=True)
+    else:
+        train_df, future_df = build_feature_frames(panel, future_df, features + ['week_start', 'units'], feature_dir)
+    logger.info("Prepared %d training rows and %d future rows in %.1fs",
+                len(train_df), len(future_df), time.perf_counter() - start)
+    
+    if shard_by:
+        sharded = train_or_load_sharded_models(train_df, features, categorical, shard_by, model_dir, retrain=retrain)
+        version = sharded_version(sharded)
+    elif quantiles:
+        model_mean, quantile_models, version = train_or_load_quantile_models(
+            train_df, features, categorical, set(quantiles) | {LOWER_ALPHA, UPPER_ALPHA}, model_dir, retrain=retrain
+        )
+        model_lower = model_upper = None
+    elif update and not retrain:
+        model_mean, model_lower, model_upper, version = update_or_retrain_models(
+            train_df, features, categorical, model_dir
+        )
+        quantile_models = None
+    else:
+        model_mean, model_lower, model_upper, version = train_or_load_models(
+            train_df, features, categorical, model_dir, retrain=retrain
+        )
+        quantile_models = None
+    logger.info("Models ready (version %s) after %.1fs", version, time.perf_counter() - start)
+    
+    if shard_by:
+        predictions = make_sharded_predictions(sharded, future_df, features, categorical)
+    elif recursive:
+        predictions = make_recursive_predictions(model_mean, model_lower, model_upper, train_df, future_df,
+                                                 features, categorical, quantile_models=quantile_models)
+    else:
+        predictions = make_predictions(model_mean, model_lower, model_upper, future_df, features, categorical,
+                                       quantile_models=quantile_models)
+    if calibrate:
+        calibration = train_or_load_calibration(
+            train_df, features, categorical, version, model_dir, recursive=recursive,
+            quantiles=set(quantiles) | {LOWER_ALPHA, UPPER_ALPHA} if quantiles else None
+        )
+        predictions = apply_calibration(predictions, calibration)
+    if attributions:
+        predictions = add_drivers(predictions, model_mean, version, features, categorical)
+    if cold_start:
+        predictions = apply_cold_start(predictions, train_df, index=cached_cold_start_index(train_df, version))
+    if sample_paths or hierarchy_file:
+        residuals = training_residuals(model_mean, train_df, features, categorical)
+    if sample_paths:
+        write_sample_paths(predictions, os.path.join(sample_dir, version), residuals, n_samples=sample_paths,
+                           metadata={'model_version': version})
+    if hierarchy_file:
+        hierarchy = reconcile_forecasts(predictions, residuals, forecast_aggregates(train_df, future_df))
+        write_hierarchy(hierarchy, hierarchy_file)
+    return predictions
+
+@instrumented()
+def write_forecast(predictions, output_dir=OUTPUT_DIR, filename="forecast_all_markets.csv", quantiles=None):
+    """Write all-market predictions to CSV and return the file path"""
+    columns = OUTPUT_COLUMNS + [quantile_column(q) for q in sorted(quantiles or [])]
+    columns += [col for col in DRIVER_COLUMNS if col in predictions]
+    output = predictions[columns].sort_values(['market', 'sku_id', 'week_start'])
+    output['week_start'] = output['week_start'].dt.strftime('%Y-%m-%d')
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, filename)
+    output.to_csv(path, index=False)
+    return path
+
+def write_hierarchy(hierarchy, path):
+    """Write reconciled forecasts of every hierarchy node to CSV"""
+    output = hierarchy.assign(week_start=hierarchy['week_start'].dt.strftime('%Y-%m-%d'))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    output.to_csv(path, index=False)
+    return path
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch 13-week demand forecast for all markets and SKUs")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory containing the input CSV files")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="directory to write the forecast CSV to")
+    parser.add_argument("--output-file", default="forecast_all_markets.csv", help="forecast CSV file name")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="model store directory")
+    parser.add_argument("--retrain", action="store_true", help="ignore stored models and retrain")
+    parser.add_argument("--update", action="store_true",
+                        help="continue the stored models on new weeks instead of retraining (full retrain on drift)")
+    parser.add_argument("--feature-dir", default=FEATURE_DIR, help="feature store directory")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="rows per chunk when reading CSV inputs")
+    parser.add_argument("--recursive", action="store_true",
+                        help="use lag features and forecast the horizon recursively week by week")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="blend forecasts of short-history series with demand borrowed from similar series")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="conformally calibrate the 90%% intervals on rolling backtest folds")
+    parser.add_argument("--shard-by", metavar="COLUMN",
+                        help="train one model set per value of COLUMN (e.g. market), with a global fallback")
+    parser.add_argument("--attributions", action="store_true",
+                        help="add per-row TreeSHAP driver columns (promo, price, weather, seasonality, ...)")
+    parser.add_argument("--quantiles", type=float, nargs="+",
+                        help="train these quantiles in parallel and add a column per quantile (e.g. 0.05 0.1 0.5 0.9 0.95)")
+    parser.add_argument("--sample-paths", type=int, default=0, metavar="N",
+                        help="also write N joint sample paths per series to a memory-mapped float32 store")
+    parser.add_argument("--sample-dir", default=SAMPLE_PATH_DIR, help="sample path store directory")
+    parser.add_argument("--hierarchy", action="store_true",
+                        help="also write coherent market/total/series forecasts to forecast_hierarchy.csv")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help="directory for run timings, traces and profiles")
+    parser.add_argument("--trace", action="store_true", help="also write the run's stages as a Chrome trace")
+    parser.add_argument("--profile", action="store_true", help="also write a cProfile dump of the run")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    with profiled_run('forecast', args.profile_dir, trace=args.trace, profile=args.profile):
+        try:
+            predictions = run_forecast(args.data_dir, args.model_dir, args.retrain, args.quantiles,
+                                       chunksize=args.chunksize, feature_dir=args.feature_dir,
+                                       recursive=args.recursive, cold_start=args.cold_start,
+                                       calibrate=args.calibrate, shard_by=args.shard_by, update=args.update,
+                                       attributions=args.attributions, sample_paths=args.sample_paths,
+                                       sample_dir=args.sample_dir,
+                                       hierarchy_file=os.path.join(args.output_dir, "forecast_hierarchy.csv")
+                                       if args.hierarchy else None)
+        except (OSError, ValueError) as e:
+            logger.error("Forecast run failed: %s", e)
+            return 1
+        path = write_forecast(predictions, args.output_dir, args.output_file, args.quantiles)
+    logger.info("Wrote %d forecast rows to %s", len(predictions), path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Precomputed forecast cube for the dashboard views.
+
+Predictions are sorted by (market, sku_id, week_start) once, and the row
+range of every market and every (market, sku_id) series is recorded, so
+a view takes a contiguous slice instead of masking the full frame. The
+per-market aggregates behind the summary plots (weekly means and CI
+widths, shock statistics per series, weather pivots and summary metrics)
+are materialized at build time. When reconciled hierarchy forecasts are
+given, the weekly view shows the coherent market total and its
+sample-based interval instead of averaged SKU bounds. Build one cube per
+model version and reuse it across reruns.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from src.profiling import instrumented
+from src.visualization import weather_pivot, shock_types, weekly_uncertainty
+
+SORT_KEYS = ['market', 'sku_id', 'week_start']
+
+ForecastCube = namedtuple('ForecastCube', [
+    'version', 'rows', 'markets', 'skus', 'market_slices', 'series_slices',
+    'weekly', 'shocks', 'weather', 'summary'
+])
+
+def _run_bounds(codes):
+    """Start/stop positions of the runs of equal values in a sorted code array"""
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=int)
+    stops = np.r_[starts[1:], len(codes)].astype(int)
+    return starts, stops
+
+def _series_shock_stats(market_data):
+    """Count, sum and sum of squares of the forecast per (sku_id, shock type)"""
+    forecast = market_data['forecast'].astype(float)
+    stats = pd.DataFrame({'count': 1, 'total': forecast, 'total_sq': forecast ** 2})
+    keys = [market_data['sku_id'].astype(str).rename('sku_id'), shock_types(market_data).rename('shock_type')]
+    return stats.groupby(keys).sum().sort_index()
+
+def _hierarchy_weekly(hierarchy, market):
+    """Weekly market-total forecast, bounds and CI width from reconcile_forecasts rows"""
+    weekly = hierarchy[(hierarchy['level'] == 'market') & (hierarchy['market'] == market)]
+    weekly = weekly[['week_start', 'forecast', 'upper_90', 'lower_90']].sort_values('week_start')
+    return weekly.assign(uncertainty_width=weekly['upper_90'] - weekly['lower_90']).reset_index(drop=True)
+
+@instrumented()
+def build_forecast_cube(predictions, version=None, hierarchy=None):
+    """Sort and index predictions and materialize the per-market view aggregates"""
+    rows = predictions.sort_values(SORT_KEYS, kind='stable').reset_index(drop=True)
+    markets = rows['market'].astype(str).values
+    skus = rows['sku_id'].astype(str).values
+
+    market_starts, market_stops = _run_bounds(pd.factorize(markets)[0])
+    market_slices = {markets[a]: (a, b) for a, b in zip(market_starts, market_stops)}
+    series_codes = rows.groupby(SORT_KEYS[:2], observed=True, sort=False).ngroup().values
+    series_starts, series_stops = _run_bounds(series_codes)
+    series_slices = {(markets[a], skus[a]): (a, b) for a, b in zip(series_starts, series_stops)}
+
+    market_skus = {market: [] for market in market_slices}
+    for market, sku in series_slices:
+        market_skus[market].append(sku)
+
+    weekly, shocks, weather, summary = {}, {}, {}, {}
+    for market, (a, b) in market_slices.items():
+        market_data = rows.iloc[a:b]
+        weekly[market] = (weekly_uncertainty(market_data) if hierarchy is None
+                          else _hierarchy_weekly(hierarchy, market))
+        shocks[market] = _series_shock_stats(market_data)
+        weather[market] = weather_pivot(market_data)
+        summary[market] = {
+            'total_forecast': market_data['forecast'].sum(),
+            'avg_forecast': market_data['forecast'].mean(),
+            'avg_uncertainty': (market_data['upper_90'] - market_data['lower_90']).mean(),
+            'promo_weeks': int((market_data['promo_flag'] == 1).sum())
+        }
+
+    return ForecastCube(version, rows, sorted(market_slices), market_skus, market_slices, series_slices,
+                        weekly, shocks, weather, summary)
+
+def market_rows(cube, market):
+    """All prediction rows of a market"""
+    a, b = cube.market_slices.get(str(market), (0, 0))
+    return cube.rows.iloc[a:b]
+
+def series_rows(cube, market, skus):
+    """Prediction rows of the selected SKUs in a market, in (sku_id, week_start) order"""
+    market = str(market)
+    bounds = [cube.series_slices[(market, str(sku))] for sku in skus if (market, str(sku)) in cube.series_slices]
+    if not bounds:
+        return cube.rows.iloc[0:0]
+    positions = np.concatenate([np.arange(a, b) for a, b in sorted(bounds)])
+    return cube.rows.iloc[positions]
+
+def shock_summary(cube, market, skus):
+    """Mean, std and count of the forecast per shock type over the selected SKUs
+
+    Combined from the stored per-series count, sum and sum of squares.
+    """
+    stats = cube.shocks[str(market)]
+    skus = [str(sku) for sku in skus if str(sku) in stats.index.levels[0]]
+    stats = stats.loc[skus].groupby(level='shock_type').sum()
+    mean = stats['total'] / stats['count']
+    variance = (stats['total_sq'] - stats['count'] * mean ** 2) / (stats['count'] - 1)
+    return pd.DataFrame({
+        'mean': mean,
+        'std': np.sqrt(variance.clip(lower=0)).where(stats['count'] > 1),
+        'count': stats['count']
+    })
@@ -0,0 +1,232 @@
+"""Hierarchical reconciliation of forecasts across SKU x market, market and total.
+
+The hierarchy has one total node, one node per market and one bottom node
+per (market, sku_id) series. It is described by a sparse aggregation
+matrix C (aggregate nodes x bottom series); the summing matrix is
+S = [C; I].
+
+Mean forecasts are reconciled with MinT using a diagonal weight matrix W
+(OLS: identity, 'wls_struct': number of series under each node,
+'mint_diag': residual variance per node). The projection is computed in
+its constraint form, which only solves a sparse system of size
+(aggregate nodes x aggregate nodes), so it scales to 100k+ bottom series
+without forming dense (bottom x bottom) matrices.
+
+The base forecasts of the market and total nodes come from a separate
+aggregate model (forecast_aggregates), trained on node-level weekly
+averages, so they carry information the bottom model does not and MinT
+has something to reconcile. Without them the base aggregates are the sums
+of the bottom forecasts, which are already coherent, and the mean step is
+plain bottom-up.
+
+Quantiles cannot be summed, so aggregate intervals come from sample
+paths: bottom-level samples are drawn from each series' forecast
+quantiles, with cross-series dependence taken from an empirical copula of
+training residuals, centred on the reconciled means and aggregated
+through C.
+"""
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+from src.data_processing import to_grid
+from src.modeling import prepare_features, quantile_columns, PARAMS, LOWER_ALPHA, UPPER_ALPHA
+from src.profiling import instrumented
+
+LEVELS = ['total', 'market', 'series']
+TOTAL = 'Total'
+METHODS = ['ols', 'wls_struct', 'mint_diag']
+N_SAMPLES = 200
+NODE_COLUMNS = ['level', 'market', 'sku_id']
+AGGREGATE_MEANS = ['time_index', 'sin_week', 'cos_week', 'price', 'promo_flag', 'holiday_flag', 'temp_c', 'rain_mm']
+AGGREGATE_FEATURES = ['market'] + AGGREGATE_MEANS
+AGGREGATE_ROUNDS = 200
+
+def bottom_series(df):
+    """Distinct (market, sku_id) bottom series of a frame, sorted"""
+    keys = df[['market', 'sku_id']].astype(str).drop_duplicates()
+    return keys.sort_values(['market', 'sku_id']).reset_index(drop=True)
+
+def aggregation_matrix(bottom):
+    """Sparse C (total + market rows x bottom series) and the aggregate nodes it sums to"""
+    market_codes, markets = pd.factorize(bottom['market'], sort=True)
+    n_bottom = len(bottom)
+    C = sparse.vstack([
+        sparse.csr_matrix(np.ones((1, n_bottom))),
+        sparse.csr_matrix((np.ones(n_bottom), (market_codes, np.arange(n_bottom))), shape=(len(markets), n_bottom))
+    ]).tocsr()
+    nodes = pd.DataFrame({
+        'level': ['total'] + ['market'] * len(markets),
+        'market': [TOTAL] + list(markets),
+        'sku_id': [TOTAL] * (len(markets) + 1)
+    })
+    return C, nodes
+
+def summing_matrix(bottom):
+    """Sparse summing matrix S = [C; I] and its (level, market, sku_id) nodes"""
+    C, nodes = aggregation_matrix(bottom)
+    bottom_nodes = bottom.assign(level='series')[NODE_COLUMNS]
+    S = sparse.vstack([C, sparse.identity(len(bottom), format='csr')]).tocsr()
+    return S, pd.concat([nodes, bottom_nodes], ignore_index=True)
+
+def _grid(df, bottom, column, weeks):
+    """(bottom series x weeks) matrix of a column, NaN where a row is absent"""
+    rows = bottom.reset_index().merge(df[['market', 'sku_id', 'week_start', column]].astype(
+        {'market': str, 'sku_id': str}), on=['market', 'sku_id'])
+    week_codes = np.searchsorted(weeks, rows['week_start'].values)
+    return to_grid(rows[column].values, rows['index'].values, week_codes, (len(bottom), len(weeks)))
+
+def reconcile(base_aggregate, base_bottom, C, method='wls_struct', variances=None):
+    """MinT-reconcile base forecasts (nodes x weeks arrays) and return (aggregate, bottom)
+
+    `variances` (aggregate nodes then bottom series) is required for
+    'mint_diag'. The result satisfies aggregate == C @ bottom exactly.
+    """
+    n_aggregate, n_bottom = C.shape
+    if method == 'ols':
+        weights = np.ones(n_aggregate + n_bottom)
+    elif method == 'wls_struct':
+        weights = np.concatenate([np.asarray(C.sum(axis=1)).ravel(), np.ones(n_bottom)])
+    elif method == 'mint_diag':
+        if variances is None:
+            raise ValueError("method 'mint_diag' needs per-node residual variances")
+        weights = np.maximum(np.asarray(variances, dtype=float), 1e-9)
+    else:
+        raise ValueError(f"Unknown reconciliation method: {method}. Use one of {METHODS}")
+    w_aggregate, w_bottom = weights[:n_aggregate], weights[n_aggregate:]
+
+    # Project onto the coherent subspace: solve (W_a + C W_b C') lam = base_a - C base_b
+    system = (sparse.diags(w_aggregate) + C @ sparse.diags(w_bottom) @ C.T).tocsc()
+    lam = splu(system).solve(np.asarray(base_aggregate - C @ base_bottom, dtype=float))
+    return base_aggregate - w_aggregate[:, None] * lam, base_bottom + w_bottom[:, None] * (C.T @ lam)
+
+def aggregate_rows(df):
+    """One row per market and total node and week: mean features (and units) over its bottom rows and their count"""
+    means = AGGREGATE_MEANS + (['units'] if 'units' in df else [])
+    df = df[['market', 'week_start'] + means].astype({col: float for col in means}).assign(
+        market=df['market'].astype(str))
+    aggregations = dict(n_series=('week_start', 'size'), **{col: (col, 'mean') for col in means})
+    by_market = df.groupby(['market', 'week_start']).agg(**aggregations).reset_index().assign(level='market')
+    total = df.groupby('week_start').agg(**aggregations).reset_index().assign(level='total', market=TOTAL)
+    return pd.concat([by_market, total], ignore_index=True)
+
+def train_aggregate_model(train_df, num_boost_round=AGGREGATE_ROUNDS):
+    """Mean model of units per series at market and total level, independent of the bottom model"""
+    rows = aggregate_rows(train_df[train_df['units'].notnull()])
+    X = prepare_features(rows, AGGREGATE_FEATURES, ['market'])
+    data = lgb.Dataset(X, label=rows['units'], categorical_feature=['market'])
+    return lgb.train(PARAMS, data, num_boost_round=num_boost_round)
+
+@instrumented()
+def forecast_aggregates(train_df, future_df):
+    """Base forecasts (level, market, week_start, forecast) of the market and total nodes
+
+    The aggregate model's units per series are scaled by the number of
+    bottom rows each node has in the future week.
+    """
+    model = train_aggregate_model(train_df)
+    rows = aggregate_rows(future_df)
+    per_series = np.maximum(model.predict(prepare_features(rows, AGGREGATE_FEATURES, ['market'])), 0)
+    return rows[['level', 'market', 'week_start']].assign(forecast=per_series * rows['n_series'].values)
+
+def training_residuals(model_mean, train_df, features, categorical):
+    """In-sample residuals (units - mean forecast) of the training rows"""
+    observed = train_df[train_df['units'].notnull()]
+    residual = observed['units'].values - model_mean.predict(prepare_features(observed, features, categorical))
+    return observed[['market', 'sku_id', 'week_start']].assign(residual=residual)
+
+def residual_copula(residuals, bottom):
+    """Per-series percentile ranks of training residuals (bottom series x history weeks)
+
+    Column j holds the joint position of every series in history week j,
+    so sampling whole columns keeps the cross-series dependence.
+    """
+    weeks = np.sort(residuals['week_start'].unique())
+    grid = _grid(residuals, bottom, 'residual', weeks)
+    ranks = pd.DataFrame(grid).rank(axis=1, pct=False).values
+    counts = np.sum(~np.isnan(grid), axis=1, keepdims=True)
+    return ranks / (counts + 1)
+
+def quantile_points(predictions):
+    """Sorted (probabilities, value columns) describing each row's forecast distribution
+
+    The points are the 90% bounds and any quantile model columns; the mean
+    `forecast` column is not a quantile and is not used.
+    """
+    points = {LOWER_ALPHA: 'lower_90', UPPER_ALPHA: 'upper_90'}
+    points.update(quantile_columns(predictions))
+    probs = sorted(points)
+    return np.array(probs), [points[p] for p in probs]
+
+def inverse_cdf(values, probs, u):
+    """Piecewise-linear quantile function through (probs, values), linear beyond the ends
+
+    `values` is (n x K) with K probability points and `u` is (n x samples).
+    """
+    values = np.sort(values, axis=1)
+    hi = np.clip(np.searchsorted(probs, u), 1, len(probs) - 1)
+    lo = hi - 1
+    rows = np.arange(len(values))[:, None]
+    slope = (values[rows, hi] - values[rows, lo]) / (probs[hi] - probs[lo])
+    return np.maximum(values[rows, lo] + slope * (u - probs[lo]), 0)
+
+@instrumented()
+def reconcile_forecasts(predictions, residuals=None, aggregate_forecasts=None, method='wls_struct',
+                        n_samples=N_SAMPLES, seed=0):
+    """Coherent forecasts and sample-based 90% intervals for every node of the hierarchy
+
+    `aggregate_forecasts` (e.g. from forecast_aggregates) supplies
+    independent base forecasts for aggregate nodes (level, market,
+    week_start, forecast); missing nodes default to the sum of their
+    bottom forecasts, so without it the means are plain bottom-up sums
+    and are returned unchanged. `residuals` (from
+    training_residuals) provides the copula for the sample paths and the
+    variances for 'mint_diag'; without it series are sampled independently.
+    Returns one row per (node, week) with level, market, sku_id, week_start,
+    forecast, lower_90 and upper_90.
+    """
+    bottom = bottom_series(predictions)
+    C, aggregate_nodes = aggregation_matrix(bottom)
+    weeks = np.sort(predictions['week_start'].unique())
+    base_bottom = np.nan_to_num(_grid(predictions, bottom, 'forecast', weeks))
+    base_aggregate = C @ base_bottom
+    if aggregate_forecasts is not None:
+        given = aggregate_nodes.reset_index().merge(aggregate_forecasts.astype({'market': str}),
+                                                    on=['level', 'market'])
+        base_aggregate[given['index'].values, np.searchsorted(weeks, given['week_start'].values)] = given['forecast']
+
+    variances, copula = None, None
+    if residuals is not None:
+        residual_grid = np.nan_to_num(_grid(residuals, bottom, 'residual', np.sort(residuals['week_start'].unique())))
+        variances = np.concatenate([(C @ residual_grid).var(axis=1), residual_grid.var(axis=1)])
+        copula = residual_copula(residuals, bottom)
+    reconciled_aggregate, reconciled_bottom = reconcile(base_aggregate, base_bottom, C, method, variances)
+
+    rng = np.random.default_rng(seed)
+    probs, columns = quantile_points(predictions)
+    bottom_grids = [np.nan_to_num(_grid(predictions, bottom, col, weeks)) for col in columns]
+    draws = rng.integers(copula.shape[1], size=n_samples) if copula is not None else None
+    bounds = np.empty((C.shape[0] + len(bottom), len(weeks), 2))
+    # One horizon week at a time keeps memory at (bottom series x samples)
+    for t in range(len(weeks)):
+        values = np.column_stack([grid[:, t] for grid in bottom_grids])
+        u = rng.uniform(size=(len(bottom), n_samples))
+        if copula is not None:
+            u = np.where(np.isnan(copula[:, draws]), u, copula[:, draws])
+        samples = inverse_cdf(values, probs, u)
+        # Centre each series' samples on its reconciled mean so node samples average to the node forecast
+        samples = np.maximum(samples + (reconciled_bottom[:, t] - samples.mean(axis=1))[:, None], 0)
+        node_samples = np.vstack([C @ samples, samples])
+        bounds[:, t] = np.quantile(node_samples, [LOWER_ALPHA, UPPER_ALPHA], axis=1).T
+
+    nodes = pd.concat([aggregate_nodes, bottom.assign(level='series')[NODE_COLUMNS]], ignore_index=True)
+    forecast = np.vstack([reconciled_aggregate, reconciled_bottom])
+    n_nodes = len(nodes)
+    result = nodes.loc[np.repeat(np.arange(n_nodes), len(weeks))].reset_index(drop=True)
+    result['week_start'] = np.tile(weeks, n_nodes)
+    result['forecast'] = forecast.ravel()
+    result['lower_90'] = np.minimum(bounds[:, :, 0].ravel(), result['forecast'])
+    result['upper_90'] = np.maximum(bounds[:, :, 1].ravel(), result['forecast'])
+    return result
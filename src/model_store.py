@@ -0,0 +1,238 @@
+"""On-disk model registry for the LightGBM boosters.
+
+Each version lives in its own directory under the store, named after a
+fingerprint of the training data, feature list, categorical list and
+training params:
+
+    <store_dir>/<version>/manifest.json
+    <store_dir>/<version>/model_mean.txt
+    <store_dir>/<version>/model_lower.txt
+    <store_dir>/<version>/model_upper.txt
+    <store_dir>/<version>/<artifact>.json     (e.g. interval calibration)
+
+Models are saved in LightGBM's native text format, so a warm start only
+has to parse the model files instead of retraining.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+import lightgbm as lgb
+import pandas as pd
+
+from src.config import MODEL_DIR
+from src.modeling import (
+    train_models, train_quantile_models, quantile_column,
+    PARAMS, NUM_BOOST_ROUND, LOWER_ALPHA, UPPER_ALPHA, HOLDOUT_WEEKS, EARLY_STOPPING_ROUNDS
+)
+from src.profiling import instrumented
+
+MANIFEST = "manifest.json"
+MODEL_NAMES = ['model_mean', 'model_lower', 'model_upper']
+
+def training_config():
+    """Params that determine the trained models, as stored in the manifest"""
+    return {
+        'params': PARAMS,
+        'num_boost_round': NUM_BOOST_ROUND,
+        'lower_alpha': LOWER_ALPHA,
+        'upper_alpha': UPPER_ALPHA
+    }
+
+def data_fingerprint(train_df, features, categorical, params, target='units'):
+    """Hash the training rows, feature/categorical lists and params into a version id"""
+    digest = hashlib.sha256()
+    columns = list(dict.fromkeys(list(features) + [target]))
+    row_hashes = pd.util.hash_pandas_object(train_df[columns], index=False)
+    digest.update(row_hashes.values.tobytes())
+    digest.update(json.dumps({
+        'columns': columns,
+        'features': list(features),
+        'categorical': list(categorical),
+        'params': params
+    }, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
+
+def _version_dir(version, store_dir):
+    return os.path.join(store_dir, version)
+
+def read_manifest(version, store_dir=MODEL_DIR):
+    """Return the manifest dict of a stored version, or None if it does not exist"""
+    path = os.path.join(_version_dir(version, store_dir), MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _write_manifest(manifest, store_dir):
+    path = os.path.join(_version_dir(manifest['version'], store_dir), MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(path + ".tmp", path)
+
+def save_models(models, version, features, categorical, params, store_dir=MODEL_DIR, metadata=None):
+    """Save a dict of named boosters as a new version and return its manifest
+
+    Files are written to a temporary directory first and moved into place,
+    so readers never see a half-written version.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    previous = read_manifest(version, store_dir)
+    manifest = {
+        'version': version,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'features': list(features),
+        'categorical': list(categorical),
+        'params': params,
+        'models': list(models),
+        'pinned': bool(previous and previous.get('pinned'))
+    }
+    manifest.update(metadata or {})
+
+    staging = tempfile.mkdtemp(prefix=f".{version}-", dir=store_dir)
+    try:
+        for name, booster in models.items():
+            booster.save_model(os.path.join(staging, f"{name}.txt"))
+        with open(os.path.join(staging, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        target = _version_dir(version, store_dir)
+        if previous is not None:
+            shutil.rmtree(target)
+        os.replace(staging, target)
+    finally:
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+    return manifest
+
+def save_artifact(version, name, payload, store_dir=MODEL_DIR):
+    """Store a JSON-serializable artifact (e.g. a calibration) with an existing version"""
+    manifest = read_manifest(version, store_dir)
+    if manifest is None:
+        raise KeyError(f"Unknown model version: {version}")
+    path = os.path.join(_version_dir(version, store_dir), f"{name}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(payload, f, indent=2, default=str)
+    os.replace(path + ".tmp", path)
+    manifest['artifacts'] = sorted(set(manifest.get('artifacts', [])) | {name})
+    _write_manifest(manifest, store_dir)
+
+def load_artifact(version, name, store_dir=MODEL_DIR):
+    """Load a stored artifact of a version, or None if it is missing"""
+    path = os.path.join(_version_dir(version, store_dir), f"{name}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def load_models(version, store_dir=MODEL_DIR, names=None):
+    """Load the named boosters of a stored version, or None if it is missing"""
+    manifest = read_manifest(version, store_dir)
+    if manifest is None:
+        return None
+    version_dir = _version_dir(version, store_dir)
+    return {
+        name: lgb.Booster(model_file=os.path.join(version_dir, f"{name}.txt"))
+        for name in (names or manifest['models'])
+    }
+
+def list_versions(store_dir=MODEL_DIR):
+    """Return manifests of all stored versions, newest first"""
+    if not os.path.isdir(store_dir):
+        return []
+    manifests = [
+        read_manifest(entry, store_dir) for entry in os.listdir(store_dir)
+        if not entry.startswith('.')
+    ]
+    manifests = [m for m in manifests if m is not None]
+    return sorted(manifests, key=lambda m: m['created_at'], reverse=True)
+
+def latest_version(store_dir=MODEL_DIR):
+    """Return the newest stored version id, or None if the store is empty"""
+    versions = list_versions(store_dir)
+    return versions[0]['version'] if versions else None
+
+def pin_version(version, pinned=True, store_dir=MODEL_DIR):
+    """Protect (or unprotect) a version from eviction"""
+    manifest = read_manifest(version, store_dir)
+    if manifest is None:
+        raise KeyError(f"Unknown model version: {version}")
+    manifest['pinned'] = pinned
+    _write_manifest(manifest, store_dir)
+    return manifest
+
+def evict_versions(keep=3, store_dir=MODEL_DIR):
+    """Delete all but the newest `keep` unpinned versions and return the evicted ids"""
+    unpinned = [m for m in list_versions(store_dir) if not m.get('pinned')]
+    evicted = [m['version'] for m in unpinned[keep:]]
+    for version in evicted:
+        shutil.rmtree(_version_dir(version, store_dir))
+    return evicted
+
+@instrumented()
+def train_or_load_models(train_df, features, categorical, store_dir=MODEL_DIR, retrain=False):
+    """Load the stored models for this training data, training and saving them on a miss
+
+    Returns (model_mean, model_lower, model_upper, version).
+    """
+    config = training_config()
+    version = data_fingerprint(train_df, features, categorical, config)
+    models = None if retrain else load_models(version, store_dir, names=MODEL_NAMES)
+    if models is None:
+        model_mean, model_lower, model_upper = train_models(train_df, features, categorical)
+        models = dict(zip(MODEL_NAMES, (model_mean, model_lower, model_upper)))
+        save_models(models, version, features, categorical, config, store_dir,
+                    metadata={'n_rows': len(train_df), 'last_week': train_df['week_start'].max()})
+    return models['model_mean'], models['model_lower'], models['model_upper'], version
+
+@instrumented()
+def train_or_load_quantile_models(train_df, features, categorical, quantiles, store_dir=MODEL_DIR,
+                                  retrain=False, n_jobs=None):
+    """Quantile-set counterpart of train_or_load_models using train_quantile_models
+
+    Returns (model_mean, {quantile: booster}, version).
+    """
+    quantiles = sorted(quantiles)
+    config = dict(training_config(), quantiles=quantiles, holdout_weeks=HOLDOUT_WEEKS,
+                  early_stopping_rounds=EARLY_STOPPING_ROUNDS)
+    version = data_fingerprint(train_df, features, categorical, config)
+    names = {f"model_{quantile_column(q)}": q for q in quantiles}
+    models = None if retrain else load_models(version, store_dir, names=['model_mean'] + list(names))
+    if models is None:
+        model_mean, quantile_models = train_quantile_models(train_df, features, categorical, quantiles,
+                                                            n_jobs=n_jobs)
+        models = {'model_mean': model_mean}
+        models.update({name: quantile_models[q] for name, q in names.items()})
+        save_models(models, version, features, categorical, config, store_dir,
+                    metadata={'n_rows': len(train_df), 'quantiles': quantiles})
+    return models['model_mean'], {q: models[name] for name, q in names.items()}, version
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and manage stored model versions")
+    parser.add_argument("--store-dir", default=MODEL_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list stored versions, newest first")
+    pin = commands.add_parser("pin", help="protect a version from eviction")
+    pin.add_argument("version")
+    unpin = commands.add_parser("unpin", help="allow a pinned version to be evicted")
+    unpin.add_argument("version")
+    evict = commands.add_parser("evict", help="delete old unpinned versions")
+    evict.add_argument("--keep", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for m in list_versions(args.store_dir):
+            flag = "pinned" if m.get('pinned') else ""
+            shard = f"  {m['shard_by']}={m['shard']}" if 'shard' in m else ""
+            print(f"{m['version']}  {m['created_at']}  rows={m.get('n_rows', '?')}{shard}  {flag}")
+    elif args.command in ("pin", "unpin"):
+        pin_version(args.version, args.command == "pin", args.store_dir)
+    elif args.command == "evict":
+        for version in evict_versions(args.keep, args.store_dir):
+            print(f"evicted {version}")
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,249 @@
 import lightgbm as lgb
-import streamlit as st
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from src.data_processing import (
+    series_grid, to_grid, units_lag_grids, LAG_FEATURES, UNITS_LAG_FEATURES, MAX_LOOKBACK
+)
+from src.profiling import stage, record_stage, instrumented
 
-@st.cache_resource
-def train_models(train_df, features, categorical):
-    """Train mean and quantile models"""
-    X_train = train_df[features].copy()
-    y_train = train_df['units']
+FEATURES = ['market', 'sku_id', 'time_index', 'sin_week', 'cos_week', 
+            'price', 'promo_flag', 'holiday_flag', 'temp_c', 'rain_mm']
+CATEGORICAL = ['market', 'sku_id', 'promo_flag', 'holiday_flag']
+LAG_MODEL_FEATURES = FEATURES + LAG_FEATURES
+
+PARAMS = {
+    'objective': 'regression',
+    'metric': 'rmse',
+    'learning_rate': 0.1,
+    'num_leaves': 31,
+    'verbose': -1,
+    'random_state': 42
+}
+NUM_BOOST_ROUND = 500
+LOWER_ALPHA = 0.05
+UPPER_ALPHA = 0.95
+QUANTILES = (0.05, 0.1, 0.5, 0.9, 0.95)
+HOLDOUT_WEEKS = 8
+EARLY_STOPPING_ROUNDS = 50
+
+def prepare_features(df, features, categorical):
+    """Select model features, validate dtypes and cast categoricals"""
+    X = df[features].copy()
     
     # Verify data types for LightGBM
-    for col in X_train.columns:
-        if col not in categorical and X_train[col].dtype not in [int, float, bool]:
-            st.error(f"Invalid data type for feature {col}: {X_train[col].dtype}. Must be int, float, or bool.")
-            return None, None, None
+    for col in X.columns:
+        if col not in categorical and not is_numeric_dtype(X[col]):
+            raise ValueError(f"Invalid data type for feature {col}: {X[col].dtype}. Must be int, float, or bool.")
     
     for cat in categorical:
-        X_train[cat] = X_train[cat].astype('category')
+        X[cat] = X[cat].astype('category')
+    return X
+
+@instrumented()
+def train_models(train_df, features, categorical, num_threads=None):
+    """Train mean and quantile models
+
+    `num_threads` caps LightGBM's threads, e.g. when several trainings share a machine.
+    """
+    X_train = prepare_features(train_df, features, categorical)
+    y_train = train_df['units']
     
     train_data = lgb.Dataset(X_train, label=y_train, categorical_feature=categorical, free_raw_data=False)
     
-    params = {
-        'objective': 'regression',
-        'metric': 'rmse',
-        'learning_rate': 0.1,
-        'num_leaves': 31,
-        'verbose': -1,
-        'random_state': 42
-    }
+    params = PARAMS.copy()
+    if num_threads:
+        params['num_threads'] = num_threads
     
-    model_mean = lgb.train(params, train_data, num_boost_round=500)
+    with stage('train:model_mean', rows=len(train_df)):
+        model_mean = lgb.train(params, train_data, num_boost_round=NUM_BOOST_ROUND)
     
     params_lower = params.copy()
     params_lower['objective'] = 'quantile'
-    params_lower['alpha'] = 0.05
-    model_lower = lgb.train(params_lower, train_data, num_boost_round=500)
+    params_lower['alpha'] = LOWER_ALPHA
+    with stage('train:model_lower', rows=len(train_df)):
+        model_lower = lgb.train(params_lower, train_data, num_boost_round=NUM_BOOST_ROUND)
     
     params_upper = params.copy()
     params_upper['objective'] = 'quantile'
-    params_upper['alpha'] = 0.95
-    model_upper = lgb.train(params_upper, train_data, num_boost_round=500)
+    params_upper['alpha'] = UPPER_ALPHA
+    with stage('train:model_upper', rows=len(train_df)):
+        model_upper = lgb.train(params_upper, train_data, num_boost_round=NUM_BOOST_ROUND)
     
     return model_mean, model_lower, model_upper
 
-def make_predictions(model_mean, model_lower, model_upper, future_df, features, categorical):
-    """Generate predictions with uncertainty intervals"""
-    if model_mean is None or model_lower is None or model_upper is None:
-        st.error("Cannot make predictions: Models not trained successfully.")
-        return None
+def quantile_column(q):
+    """Prediction column name for a quantile, e.g. 0.05 -> 'q05', 0.975 -> 'q97.5'"""
+    return 'q' + format(q * 100, 'g').zfill(2)
+
+def quantile_columns(df):
+    """{quantile: column} of a frame's quantile prediction columns (named by quantile_column), sorted"""
+    columns = {}
+    for column in df.columns:
+        try:
+            q = float(column[1:]) / 100 if isinstance(column, str) and column.startswith('q') else None
+        except ValueError:
+            continue
+        if q is not None and 0 < q < 1 and quantile_column(q) == column:
+            columns[q] = column
+    return dict(sorted(columns.items()))
+
+def time_holdout_split(train_df, holdout_weeks=HOLDOUT_WEEKS):
+    """Split training rows into fit and holdout sets on the last `holdout_weeks` weeks"""
+    weeks = train_df['week_start'].drop_duplicates().sort_values()
+    if holdout_weeks <= 0 or len(weeks) <= holdout_weeks:
+        return train_df, train_df.iloc[:0]
+    cutoff = weeks.iloc[-holdout_weeks]
+    is_holdout = train_df['week_start'] >= cutoff
+    return train_df[~is_holdout], train_df[is_holdout]
+
+def thread_budget(n_tasks, n_jobs=None):
+    """Split the available cores across parallel jobs: returns (n_workers, threads_per_worker)"""
+    n_cores = os.cpu_count() or 1
+    n_workers = max(1, min(n_jobs or n_cores, n_tasks, n_cores))
+    return n_workers, max(1, n_cores // n_workers)
+
+def _fit_from_binary(params, full_path, fit_path, valid_path, num_boost_round,
+                     early_stopping_rounds, pandas_categorical):
+    """Worker: train one booster on pre-binned Datasets and return (model string, seconds)
+
+    With a holdout the booster is early-stopped on (fit, valid) and then refit
+    on the full Dataset for the best number of rounds.
+    """
+    start = time.perf_counter()
+    if valid_path is not None:
+        fit_set = lgb.Dataset(fit_path)
+        valid_set = lgb.Dataset(valid_path, reference=fit_set)
+        booster = lgb.train(params, fit_set, num_boost_round=num_boost_round, valid_sets=[valid_set],
+                            callbacks=[lgb.early_stopping(early_stopping_rounds, verbose=False)])
+        num_boost_round = booster.best_iteration or num_boost_round
+    booster = lgb.train(params, lgb.Dataset(full_path), num_boost_round=num_boost_round)
+    booster.pandas_categorical = pandas_categorical
+    return booster.model_to_string(), time.perf_counter() - start
+
+def train_quantile_models(train_df, features, categorical, quantiles=QUANTILES,
+                          holdout_weeks=HOLDOUT_WEEKS, early_stopping_rounds=EARLY_STOPPING_ROUNDS,
+                          num_boost_round=NUM_BOOST_ROUND, n_jobs=None):
+    """Train the mean model and any list of quantile models in parallel
+
+    The features are binned into a LightGBM Dataset once and saved in binary
+    form; each worker process loads the binned data instead of re-binning.
+    Cores are split between workers via num_threads so the jobs do not
+    oversubscribe the machine. The number of rounds for each model is chosen
+    by early stopping on the last `holdout_weeks` weeks.
     
-    X_future = future_df[features].copy()
+    Returns (model_mean, {quantile: booster}).
+    """
+    fit_df, valid_df = time_holdout_split(train_df, holdout_weeks)
+    X_train = prepare_features(train_df, features, categorical)
+    full_set = lgb.Dataset(X_train, label=train_df['units'], categorical_feature=categorical,
+                           params={'verbose': -1}, free_raw_data=False).construct()
     
-    # Verify data types for LightGBM
-    for col in X_future.columns:
-        if col not in categorical and X_future[col].dtype not in [int, float, bool]:
-            st.error(f"Invalid data type for feature {col}: {X_future[col].dtype}. Must be int, float, or bool.")
-            return None
+    jobs = {'mean': dict(PARAMS)}
+    for q in quantiles:
+        jobs[q] = dict(PARAMS, objective='quantile', metric='quantile', alpha=q)
+    n_workers, n_threads = thread_budget(len(jobs), n_jobs)
     
-    for cat in categorical:
-        X_future[cat] = X_future[cat].astype('category')
+    with tempfile.TemporaryDirectory(prefix='lgb_bins_') as tmp:
+        full_path = os.path.join(tmp, 'full.bin')
+        full_set.save_binary(full_path)
+        fit_path = valid_path = None
+        if len(valid_df):
+            fit_path = os.path.join(tmp, 'fit.bin')
+            valid_path = os.path.join(tmp, 'valid.bin')
+            lgb.Dataset(prepare_features(fit_df, features, categorical), label=fit_df['units'],
+                        reference=full_set).save_binary(fit_path)
+            lgb.Dataset(prepare_features(valid_df, features, categorical), label=valid_df['units'],
+                        reference=full_set).save_binary(valid_path)
+        
+        # spawn, not fork: the parent has already started OpenMP threads while binning
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {
+                key: pool.submit(_fit_from_binary, dict(params, num_threads=n_threads), full_path, fit_path,
+                                 valid_path, num_boost_round, early_stopping_rounds, full_set.pandas_categorical)
+                for key, params in jobs.items()
+            }
+            models = {}
+            for key, future in futures.items():
+                model_str, seconds = future.result()
+                models[key] = lgb.Booster(model_str=model_str)
+                record_stage(f"train:model_{'mean' if key == 'mean' else quantile_column(key)}", seconds,
+                             rows=len(train_df))
+    
+    model_mean = models.pop('mean')
+    return model_mean, models
+
+@instrumented()
+def make_predictions(model_mean, model_lower, model_upper, future_df, features, categorical,
+                     quantile_models=None):
+    """Generate predictions with uncertainty intervals
+
+    `quantile_models` ({quantile: booster}, as returned by train_quantile_models)
+    adds one column per quantile and supplies the 90% bounds when
+    model_lower/model_upper are not given.
+    """
+    quantile_models = quantile_models or {}
+    if model_lower is None:
+        model_lower = quantile_models.get(LOWER_ALPHA)
+    if model_upper is None:
+        model_upper = quantile_models.get(UPPER_ALPHA)
+    if model_mean is None or model_lower is None or model_upper is None:
+        raise ValueError("Cannot make predictions: Models not trained successfully.")
+    
+    X_future = prepare_features(future_df, features, categorical)
     
     predictions = future_df.copy()
-    predictions['forecast'] = model_mean.predict(X_future)
-    predictions['lower_90'] = model_lower.predict(X_future)
-    predictions['upper_90'] = model_upper.predict(X_future)
+    with stage('predict:model_mean', rows=len(X_future)):
+        predictions['forecast'] = model_mean.predict(X_future)
+    with stage('predict:model_lower', rows=len(X_future)):
+        predictions['lower_90'] = model_lower.predict(X_future)
+    with stage('predict:model_upper', rows=len(X_future)):
+        predictions['upper_90'] = model_upper.predict(X_future)
     
     predictions['forecast'] = predictions['forecast'].clip(lower=0)
     predictions['lower_90'] = predictions['lower_90'].clip(lower=0)
     predictions['upper_90'] = predictions['upper_90'].clip(lower=0)
     
-    return predictions
\ No newline at end of file
+    for q in sorted(quantile_models):
+        with stage(f'predict:model_{quantile_column(q)}', rows=len(X_future)):
+            predictions[quantile_column(q)] = quantile_models[q].predict(X_future).clip(min=0)
+    
+    return predictions
+
+@instrumented()
+def make_recursive_predictions(model_mean, model_lower, model_upper, train_df, future_df, features, categorical,
+                               quantile_models=None):
+    """Forecast the horizon week by week, feeding predictions back into the units lags
+
+    All series are predicted together at each step, so the loop runs once
+    per horizon week (13) rather than once per series. Each step rebuilds the
+    units lag/rolling features of that week from the last MAX_LOOKBACK weeks of
+    actuals and earlier predictions, then calls make_predictions.
+    """
+    history = train_df[['market', 'sku_id', 'week_start', 'units']]
+    horizon = future_df[['market', 'sku_id', 'week_start']]
+    keys = pd.concat([history, horizon], ignore_index=True)
+    series_codes, week_codes, n_series, n_weeks = series_grid(keys)
+    units_grid = to_grid(keys['units'].values, series_codes, week_codes, (n_series, n_weeks))
+    
+    future_series = series_codes[len(history):]
+    future_weeks = week_codes[len(history):]
+    steps = []
+    for week in np.unique(future_weeks):
+        rows = np.flatnonzero(future_weeks == week)
+        step_df = future_df.iloc[rows].copy()
+        lookback = units_lag_grids(units_grid[:, max(0, week - MAX_LOOKBACK):week + 1])
+        for name in UNITS_LAG_FEATURES:
+            step_df[name] = lookback[name][future_series[rows], -1]
+        
+        step_pred = make_predictions(model_mean, model_lower, model_upper, step_df, features, categorical,
+                                     quantile_models=quantile_models)
+        units_grid[future_series[rows], week] = step_pred['forecast'].values
+        steps.append(step_pred)
+    
+    return pd.concat(steps).loc[future_df.index]
@@ -0,0 +1,105 @@
+"""Lightweight export of the dashboard figures to the plots directory.
+
+plotly.js is written once as a shared, versioned asset next to the
+figures, and every figure's HTML references it instead of embedding the
+~3.6 MB bundle:
+
+    <plots_dir>/plotly-<version>.min.js
+    <plots_dir>/<name>.html
+    <plots_dir>/<name>.json
+    <plots_dir>/manifest.json
+
+The manifest records a content hash per figure and format, so an
+unchanged figure is never rewritten. Exports run on a single background
+thread, off the Streamlit request thread.
+"""
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import plotly
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+
+from src.config import PLOTS_DIR
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+FORMATS = ('html',)
+PLOTLY_ASSET = f"plotly-{plotly.__version__}.min.js"
+
+# One worker keeps writes to the same files ordered
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plot-export")
+
+def _write_atomic(path, data):
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(path + ".tmp", mode, **({} if mode == "wb" else {'encoding': 'utf-8'})) as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+def _read_manifest(plots_dir):
+    path = os.path.join(plots_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def ensure_plotly_asset(plots_dir=PLOTS_DIR):
+    """Write the shared plotly.js bundle once and return its file name"""
+    path = os.path.join(plots_dir, PLOTLY_ASSET)
+    if not os.path.exists(path):
+        os.makedirs(plots_dir, exist_ok=True)
+        _write_atomic(path, get_plotlyjs())
+    return PLOTLY_ASSET
+
+def figure_digest(fig_json):
+    """Content hash of a serialized figure"""
+    return hashlib.sha256(fig_json.encode()).hexdigest()[:16]
+
+def _render(fig, fig_json, fmt):
+    if fmt == 'json':
+        return fig_json
+    if fmt == 'html':
+        return pio.to_html(fig, include_plotlyjs=PLOTLY_ASSET, full_html=True)
+    # Static formats need the optional kaleido package
+    return pio.to_image(fig, format=fmt)
+
+def export_figures(figures, plots_dir=PLOTS_DIR, formats=FORMATS):
+    """Write each named figure in `formats` ('html', 'json', or static 'png'/'svg'/'pdf')
+
+    Files whose figure content is unchanged since the last export are
+    skipped. Returns the list of paths written.
+    """
+    os.makedirs(plots_dir, exist_ok=True)
+    if 'html' in formats:
+        ensure_plotly_asset(plots_dir)
+    manifest = _read_manifest(plots_dir)
+    written = []
+    for name, fig in figures.items():
+        fig_json = pio.to_json(fig, validate=False)
+        digest = figure_digest(fig_json)
+        for fmt in formats:
+            filename = f"{name}.{fmt}"
+            path = os.path.join(plots_dir, filename)
+            if manifest.get(filename) == digest and os.path.exists(path):
+                continue
+            _write_atomic(path, _render(fig, fig_json, fmt))
+            manifest[filename] = digest
+            written.append(path)
+    if written:
+        _write_atomic(os.path.join(plots_dir, MANIFEST), json.dumps(manifest, indent=2))
+    return written
+
+def _export_logged(figures, plots_dir, formats):
+    try:
+        return export_figures(figures, plots_dir, formats)
+    except Exception:
+        logger.exception("Plot export to %s failed", plots_dir)
+        raise
+
+def export_figures_async(figures, plots_dir=PLOTS_DIR, formats=FORMATS):
+    """Queue export_figures on the background export thread and return its Future"""
+    return _executor.submit(_export_logged, dict(figures), plots_dir, tuple(formats))
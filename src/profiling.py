@@ -0,0 +1,295 @@
+"""Stage timing and memory instrumentation for pipeline runs.
+
+A run groups the stages executed inside `profiled_run(...)`. Each stage
+records its wall time, its own peak RSS (sampled in the background while
+the stage runs) and how far that peak rose above the RSS at its start, and
+the rows it produced (or consumed), from which rows/second is derived:
+
+    with profiled_run('forecast', trace=True, profile=True):
+        panel = load_data(...)              # functions decorated with @instrumented
+        with stage('train:model_mean', rows=len(train_df)):
+            ...
+
+Finished runs are appended as one JSON object per line to
+
+    <profile_dir>/runs.jsonl
+
+(trimmed to the newest KEEP_RUNS runs once it outgrows MAX_LOG_BYTES)
+and optionally written as a Chrome trace (trace_<run_id>.json, open in
+chrome://tracing or ui.perfetto.dev) and a cProfile dump
+(profile_<run_id>.prof, e.g. for snakeviz). Outside a run, stages cost a
+context-variable lookup and record nothing.
+"""
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from src.config import PROFILE_DIR
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+RUNS_FILE = "runs.jsonl"
+MAX_LOG_BYTES = 5 << 20
+KEEP_RUNS = 500
+RSS_SAMPLE_INTERVAL = 0.01
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_current_run = contextvars.ContextVar('current_run', default=None)
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far in MB, or None if unavailable"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return round(peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024, 1)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1 << 20), 1)
+    except (ImportError, AttributeError):
+        return None
+
+def current_rss_mb():
+    """Current resident set size of this process in MB, or None if unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * _PAGE_SIZE / (1 << 20), 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / (1 << 20), 1)
+    except ImportError:
+        return None
+
+def _sample_rss(run, stop):
+    """Raise the peak of the run and of every open stage to the sampled RSS until `stop` is set"""
+    while not stop.wait(RSS_SAMPLE_INTERVAL):
+        rss = current_rss_mb()
+        with run['lock']:
+            for key, peak in run['peaks'].items():
+                if rss > peak:
+                    run['peaks'][key] = rss
+
+def _raise_peak(run, key, rss):
+    """Pop the sampled peak registered under `key`, raised to `rss`"""
+    with run['lock']:
+        return max(run['peaks'].pop(key), rss)
+
+def count_rows(value):
+    """Total rows of a DataFrame/Series, or of the frames in a tuple/list (None if there are none)"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        counts = [len(v) for v in value if isinstance(v, (pd.DataFrame, pd.Series))]
+        return sum(counts) if counts else None
+    return None
+
+@contextmanager
+def stage(name, rows=None):
+    """Time a pipeline stage of the current run
+
+    Yields the stage's event dict; set event['rows'] inside the block if
+    the row count is only known at the end.
+    """
+    run = _current_run.get()
+    if run is None:
+        yield {}
+        return
+    event = {'name': name, 'rows': rows, 'depth': run['depth'], 'thread': threading.get_ident()}
+    run['depth'] += 1
+    rss_before = current_rss_mb() if run['sampler'] is not None else None
+    if rss_before is not None:
+        with run['lock']:
+            run['peaks'][id(event)] = rss_before
+    else:
+        # Without a current RSS, fall back to how far the stage raised the process peak
+        rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield event
+    finally:
+        wall = time.perf_counter() - start
+        run['depth'] -= 1
+        if run['sampler'] is not None:
+            peak = _raise_peak(run, id(event), current_rss_mb())
+        else:
+            peak = peak_rss_mb()
+        event.update(
+            start_s=round(start - run['start'], 6),
+            wall_s=round(wall, 6),
+            peak_rss_mb=peak,
+            rss_growth_mb=None if peak is None else round(peak - rss_before, 3),
+            rows_per_s=round(event['rows'] / wall, 1) if event['rows'] and wall > 0 else None
+        )
+        run['stages'].append(event)
+
+def record_stage(name, wall_s, rows=None):
+    """Record a stage timed elsewhere (e.g. in a worker process) as ending now"""
+    run = _current_run.get()
+    if run is None:
+        return
+    end = time.perf_counter() - run['start']
+    run['stages'].append({
+        'name': name, 'rows': rows, 'depth': run['depth'], 'thread': 0,
+        'start_s': round(max(end - wall_s, 0), 6), 'wall_s': round(wall_s, 6),
+        'peak_rss_mb': None, 'rss_growth_mb': None,
+        'rows_per_s': round(rows / wall_s, 1) if rows and wall_s > 0 else None
+    })
+
+def instrumented(name=None):
+    """Decorator recording each call as a stage, with the rows of its result (or first frame argument)"""
+    def decorate(func):
+        stage_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_run.get() is None:
+                return func(*args, **kwargs)
+            with stage(stage_name) as event:
+                result = func(*args, **kwargs)
+                rows = count_rows(result)
+                if rows is None:
+                    rows = next((len(a) for a in args if isinstance(a, pd.DataFrame)), None)
+                event['rows'] = rows
+            return result
+        return wrapper
+    return decorate
+
+def write_trace(run, path):
+    """Write a run's stages as Chrome trace events"""
+    pid = os.getpid()
+    events = [
+        {
+            'name': s['name'], 'ph': 'X', 'pid': pid, 'tid': s['thread'],
+            'ts': s['start_s'] * 1e6, 'dur': s['wall_s'] * 1e6,
+            'args': {k: s[k] for k in ('rows', 'rows_per_s', 'peak_rss_mb', 'rss_growth_mb')}
+        }
+        for s in run['stages']
+    ]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'run_id': run['run_id']}}, f)
+
+def append_run(record, profile_dir=PROFILE_DIR):
+    """Append a run record to runs.jsonl, keeping the newest KEEP_RUNS once it exceeds MAX_LOG_BYTES"""
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, RUNS_FILE)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+    if os.path.getsize(path) > MAX_LOG_BYTES:
+        with open(path) as f:
+            kept = deque(f, maxlen=KEEP_RUNS)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.writelines(kept)
+        os.replace(tmp_path, path)
+
+@contextmanager
+def profiled_run(name, profile_dir=PROFILE_DIR, trace=False, profile=False, record_if=None):
+    """Collect the stages executed inside the block into one run record
+
+    Appends the record to runs.jsonl; `trace` also writes a Chrome trace
+    and `profile` a cProfile dump of the whole block. If `record_if` is
+    given, a run that did not fail is only written if record_if(stages)
+    is true (e.g. to skip dashboard reruns served entirely from cache).
+    """
+    rss = current_rss_mb()
+    run = {
+        'run_id': f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}",
+        'name': name,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'start': time.perf_counter(),
+        'depth': 0,
+        'stages': [],
+        'lock': threading.Lock(),
+        'peaks': {'run': rss},
+        'sampler': None
+    }
+    stop = threading.Event()
+    if rss is not None:
+        run['sampler'] = threading.Thread(target=_sample_rss, args=(run, stop), daemon=True)
+        run['sampler'].start()
+    token = _current_run.set(run)
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    failed = True
+    try:
+        yield run
+        failed = False
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _current_run.reset(token)
+        if run['sampler'] is not None:
+            stop.set()
+            run['sampler'].join()
+            peak = _raise_peak(run, 'run', current_rss_mb())
+        else:
+            peak = peak_rss_mb()
+        stages = sorted(
+            [{k: v for k, v in s.items() if k != 'thread'} for s in run['stages']],
+            key=lambda s: s['start_s']
+        )
+        record = {
+            'run_id': run['run_id'],
+            'name': name,
+            'started_at': run['started_at'],
+            'failed': failed,
+            'wall_s': round(time.perf_counter() - run['start'], 6),
+            'peak_rss_mb': peak,
+            'stages': stages
+        }
+        if failed or record_if is None or record_if(stages):
+            save_run(run, record, profile_dir, trace, profiler)
+        else:
+            logger.debug("Run %s (%s) not recorded", run['run_id'], name)
+
+def save_run(run, record, profile_dir=PROFILE_DIR, trace=False, profiler=None):
+    """Append a finished run's record and write its trace and profile dump"""
+    append_run(record, profile_dir)
+    if trace:
+        write_trace(run, os.path.join(profile_dir, f"trace_{run['run_id']}.json"))
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(profile_dir, f"profile_{run['run_id']}.prof"))
+    slowest = sorted((s for s in record['stages'] if s['depth'] == 0), key=lambda s: -s['wall_s'])[:3]
+    logger.info("Run %s (%s) took %.2fs, peak RSS %s MB; slowest stages: %s", run['run_id'], record['name'],
+                record['wall_s'], record['peak_rss_mb'],
+                ", ".join(f"{s['name']} {s['wall_s']:.2f}s" for s in slowest))
+
+def recent_runs(n=20, profile_dir=PROFILE_DIR, name=None):
+    """The last `n` run records (optionally only runs called `name`), newest first"""
+    path = os.path.join(profile_dir, RUNS_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        if name is None:
+            runs = [json.loads(line) for line in deque(f, maxlen=n) if line.strip()]
+        else:
+            runs = [r for r in map(json.loads, filter(str.strip, f)) if r['name'] == name][-n:]
+    return runs[::-1]
+
+def stage_table(runs):
+    """One row per (run, stage) for tabulating or plotting run records"""
+    rows = [
+        dict(stage, run_id=run['run_id'], run=run['name'], started_at=run['started_at'])
+        for run in runs for stage in run['stages']
+    ]
+    return pd.DataFrame(rows, columns=['run_id', 'run', 'started_at', 'name', 'depth', 'start_s', 'wall_s',
+                                       'rows', 'rows_per_s', 'peak_rss_mb', 'rss_growth_mb'])
@@ -0,0 +1,192 @@
+"""Joint sample paths of weekly demand over the forecast horizon.
+
+Inventory simulations need whole 13-week trajectories, not marginal
+quantiles. Each series' weekly marginal comes from its forecast quantiles
+(lower_90/upper_90 plus any qNN columns from the quantile
+models), and paths are drawn through it with uniforms that carry the
+dependence of the training residuals: every sample picks a block of
+consecutive history weeks and reads each series' residual percentile rank
+over that block, so the same draw keeps both week-to-week and
+cross-series dependence (an empirical copula of residual trajectories).
+Series without residuals for the whole block fall back to a Gaussian
+AR(1) copula with the pooled lag-1 residual autocorrelation.
+
+Paths are stored compactly for consumers that only read slices:
+
+    <path_dir>/paths.npy        float32 (series x horizon x samples), memory-mappable
+    <path_dir>/series.parquet   row i of paths.npy: market, sku_id (dictionary-encoded)
+    <path_dir>/meta.json        weeks, samples, seed, dependence settings, metadata
+
+and are generated and written one chunk of series at a time, so memory
+stays bounded at any number of series.
+"""
+import json
+import logging
+import os
+import shutil
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+from src.config import SAMPLE_PATH_DIR
+from src.hierarchy import bottom_series, quantile_points, inverse_cdf
+from src.profiling import instrumented
+
+logger = logging.getLogger(__name__)
+
+N_PATHS = 200
+CHUNK_SERIES = 2_000
+MAX_RHO = 0.95
+PATHS_FILE = "paths.npy"
+SERIES_FILE = "series.parquet"
+META_FILE = "meta.json"
+
+SamplePaths = namedtuple('SamplePaths', ['paths', 'series', 'weeks', 'meta'])
+
+def series_codes(df, bottom):
+    """Position of each row's (market, sku_id) in `bottom`, -1 if absent"""
+    index = pd.MultiIndex.from_frame(bottom[['market', 'sku_id']])
+    return index.get_indexer(pd.MultiIndex.from_arrays([df['market'].astype(str), df['sku_id'].astype(str)]))
+
+def lag1_autocorrelation(residuals):
+    """Pooled lag-1 autocorrelation of residuals within series, clipped to [0, MAX_RHO]"""
+    ordered = residuals.sort_values(['market', 'sku_id', 'week_start'])
+    r = ordered['residual'].values
+    same = ((ordered['market'].values[1:] == ordered['market'].values[:-1])
+            & (ordered['sku_id'].values[1:] == ordered['sku_id'].values[:-1]))
+    if same.sum() < 2:
+        return 0.0
+    rho = np.corrcoef(r[1:][same], r[:-1][same])[0, 1]
+    return float(np.clip(np.nan_to_num(rho), 0, MAX_RHO))
+
+def ar1_uniforms(rng, shape, rho):
+    """(series x horizon x samples) uniforms of a Gaussian AR(1) process over the horizon"""
+    n_series, horizon, n_samples = shape
+    z = np.empty(shape)
+    z[:, 0] = rng.standard_normal((n_series, n_samples))
+    for t in range(1, horizon):
+        z[:, t] = rho * z[:, t - 1] + np.sqrt(1 - rho ** 2) * rng.standard_normal((n_series, n_samples))
+    return ndtr(z)
+
+def block_uniforms(ranks, starts, horizon):
+    """(series x horizon x samples) residual ranks over the history block starting at each sample's week"""
+    return ranks[:, starts[None, :] + np.arange(horizon)[:, None]]
+
+def _residual_ranks(residuals, codes, lo, hi, history_weeks):
+    """Per-series percentile ranks of residuals for bottom series [lo, hi) x history weeks (NaN if absent)"""
+    grid = np.full((hi - lo, len(history_weeks)), np.nan)
+    start, end = np.searchsorted(codes, [lo, hi])
+    rows = residuals.iloc[start:end]
+    grid[codes[start:end] - lo, np.searchsorted(history_weeks, rows['week_start'].values)] = rows['residual'].values
+    ranks = pd.DataFrame(grid).rank(axis=1).values
+    return ranks / (np.sum(~np.isnan(grid), axis=1, keepdims=True) + 1)
+
+def _forecast_grids(predictions, bottom, weeks, columns):
+    """(series x horizon x points) forecast quantile values, NaN where a row is absent"""
+    grid = np.full((len(bottom), len(weeks), len(columns)), np.nan, dtype=np.float32)
+    codes = series_codes(predictions, bottom)
+    grid[codes, np.searchsorted(weeks, predictions['week_start'].values)] = predictions[columns].values
+    return grid
+
+def path_uniforms(bottom, horizon, residuals=None, n_samples=N_PATHS, seed=0, chunk_series=CHUNK_SERIES):
+    """Yield (series slice, (series x horizon x samples) joint uniforms) for chunks of `bottom` series"""
+    rng = np.random.default_rng(seed)
+
+    rho, history_weeks, codes, starts = 0.0, None, None, None
+    if residuals is not None and len(residuals):
+        residuals = residuals.assign(code=series_codes(residuals, bottom))
+        residuals = residuals[residuals['code'] >= 0].sort_values('code', kind='stable')
+        codes = residuals['code'].values
+        rho = lag1_autocorrelation(residuals)
+        history_weeks = np.sort(residuals['week_start'].unique())
+        if len(history_weeks) >= horizon:
+            # One history block per sample, shared by all series
+            starts = rng.integers(len(history_weeks) - horizon + 1, size=n_samples)
+
+    for lo in range(0, len(bottom), chunk_series):
+        hi = min(lo + chunk_series, len(bottom))
+        u = ar1_uniforms(rng, (hi - lo, horizon, n_samples), rho)
+        if starts is not None:
+            ranks = block_uniforms(_residual_ranks(residuals, codes, lo, hi, history_weeks), starts, horizon)
+            # Keep a sample's block only if the series has residuals for all of its weeks
+            complete = ~np.isnan(ranks).any(axis=1, keepdims=True)
+            u = np.where(complete, ranks, u)
+        yield slice(lo, hi), u
+
+def generate_paths(predictions, residuals=None, n_samples=N_PATHS, seed=0, chunk_series=CHUNK_SERIES):
+    """Yield (series slice, float32 paths chunk) covering the series of path_layout(predictions)"""
+    bottom, weeks = path_layout(predictions)
+    probs, columns = quantile_points(predictions)
+    values = _forecast_grids(predictions, bottom, weeks, columns)
+    for rows, u in path_uniforms(bottom, len(weeks), residuals, n_samples, seed, chunk_series):
+        chunk = np.empty(u.shape, dtype=np.float32)
+        for t in range(len(weeks)):
+            chunk[:, t] = inverse_cdf(values[rows, t], probs, u[:, t])
+        yield rows, chunk
+
+def path_layout(predictions):
+    """Sorted bottom series and horizon weeks that index the path array"""
+    return bottom_series(predictions), np.sort(predictions['week_start'].unique())
+
+@instrumented()
+def sample_paths(predictions, residuals=None, n_samples=N_PATHS, seed=0):
+    """In-memory (series x horizon x samples) float32 paths, with the series index and weeks"""
+    bottom, weeks = path_layout(predictions)
+    paths = np.empty((len(bottom), len(weeks), n_samples), dtype=np.float32)
+    for rows, chunk in generate_paths(predictions, residuals, n_samples, seed):
+        paths[rows] = chunk
+    return paths, bottom, weeks
+
+@instrumented()
+def write_sample_paths(predictions, path_dir=SAMPLE_PATH_DIR, residuals=None, n_samples=N_PATHS, seed=0,
+                       metadata=None, chunk_series=CHUNK_SERIES):
+    """Generate paths chunk by chunk into a memory-mapped .npy store and return the store directory"""
+    bottom, weeks = path_layout(predictions)
+    tmp_dir = path_dir.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    paths = np.lib.format.open_memmap(os.path.join(tmp_dir, PATHS_FILE), mode='w+', dtype=np.float32,
+                                      shape=(len(bottom), len(weeks), n_samples))
+    for rows, chunk in generate_paths(predictions, residuals, n_samples, seed, chunk_series):
+        paths[rows] = chunk
+    paths.flush()
+    del paths
+
+    bottom.astype('category').to_parquet(os.path.join(tmp_dir, SERIES_FILE), index=False)
+    probs, _ = quantile_points(predictions)
+    meta = dict(metadata or {}, **{
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'shape': [len(bottom), len(weeks), n_samples],
+        'dtype': 'float32',
+        'weeks': [str(pd.Timestamp(w).date()) for w in weeks],
+        'seed': seed,
+        'quantile_points': [float(p) for p in probs],
+        'dependence': 'residual block copula' if residuals is not None else 'independent'
+    })
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(path_dir, ignore_errors=True)
+    os.replace(tmp_dir, path_dir)
+    logger.info("Wrote %d x %d x %d sample paths to %s", len(bottom), len(weeks), n_samples, path_dir)
+    return path_dir
+
+def open_sample_paths(path_dir=SAMPLE_PATH_DIR):
+    """Open a path store without loading it: paths are a read-only memory map"""
+    with open(os.path.join(path_dir, META_FILE)) as f:
+        meta = json.load(f)
+    paths = np.load(os.path.join(path_dir, PATHS_FILE), mmap_mode='r')
+    series = pd.read_parquet(os.path.join(path_dir, SERIES_FILE))
+    return SamplePaths(paths, series, pd.to_datetime(meta['weeks']), meta)
+
+def select_paths(store, market=None, sku_ids=None):
+    """(series index rows, paths) for one market and/or SKUs, reading only those rows from disk"""
+    mask = np.ones(len(store.series), dtype=bool)
+    if market is not None:
+        mask &= (store.series['market'] == str(market)).values
+    if sku_ids is not None:
+        mask &= store.series['sku_id'].isin([str(s) for s in np.atleast_1d(sku_ids)]).values
+    positions = np.flatnonzero(mask)
+    return store.series.iloc[positions].reset_index(drop=True), np.asarray(store.paths[positions])
@@ -0,0 +1,241 @@
+"""What-if scenarios scored against the trained boosters.
+
+A scenario is a dict with a name and a list of overrides:
+
+    {'name': 'Delhi -10%', 'overrides': [{'market': 'Delhi', 'price_change': -0.10}]}
+    {'name': 'Promo wk 5-7', 'overrides': [{'sku_id': ['S001', 'S002'], 'weeks': [5, 6, 7], 'promo_flag': 1}]}
+
+Overrides select future rows by `market`, `sku_id` (a value or a list;
+omitted means all), `weeks` (1-based horizon weeks) and/or `start`/`end`
+dates, and set `price`, scale it with `price_change` (a fraction), or set
+`promo_flag`/`holiday_flag`. Overrides apply in order.
+
+Only rows an override touches are rebuilt. The affected baseline rows and
+the modified rows of every scenario are stacked, rows with identical
+features are scored once, and everything goes through a single
+make_predictions call, so hundreds of scenarios cost one predict per
+booster.
+
+Row bounds cannot be summed into a bound for a total, so total uplift
+intervals (per scenario, or per scenario and week) come from joint
+samples: every row's uplift is drawn at a shared noise rank for its
+scenario and baseline outcomes, with ranks correlated across series and
+weeks through the sample-path copula of training residuals, and the
+sampled row uplifts are summed.
+"""
+import numpy as np
+import pandas as pd
+
+from src.calibration import apply_calibration
+from src.data_processing import LAG_FEATURES
+from src.hierarchy import bottom_series, quantile_points, inverse_cdf
+from src.modeling import make_predictions, quantile_columns, LOWER_ALPHA, UPPER_ALPHA
+from src.profiling import instrumented
+from src.sample_paths import path_uniforms, series_codes, N_PATHS
+
+FILTER_KEYS = ['market', 'sku_id', 'weeks', 'start', 'end']
+CHANGE_KEYS = ['price', 'price_change', 'promo_flag', 'holiday_flag']
+RESULT_COLUMNS = [
+    'scenario', 'market', 'sku_id', 'week_start', 'price', 'promo_flag', 'holiday_flag',
+    'baseline', 'baseline_lower_90', 'baseline_upper_90', 'forecast', 'lower_90', 'upper_90',
+    'uplift', 'uplift_lower_90', 'uplift_upper_90'
+]
+
+def _selected(values, selection):
+    if selection is None:
+        return np.ones(len(values), dtype=bool)
+    if isinstance(selection, str) or np.isscalar(selection):
+        selection = [selection]
+    return np.isin(values, [str(s) for s in selection])
+
+def _selection(value, key):
+    values = [value] if isinstance(value, str) or np.isscalar(value) else value
+    if not isinstance(values, (list, tuple)) or not all(isinstance(v, (str, int)) for v in values):
+        raise ValueError(f"Override '{key}' must be a value or a list of values")
+    return [str(v) for v in values]
+
+def validate_override(override):
+    """Check an override's keys and types and return a copy with its values cast
+
+    Raises ValueError for unknown keys and for values that cannot be cast
+    (e.g. a non-numeric price), so bad input is rejected before scoring.
+    """
+    if not isinstance(override, dict):
+        raise ValueError("Each scenario override must be an object")
+    unknown = set(override) - set(FILTER_KEYS) - set(CHANGE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown scenario override keys: {sorted(unknown)}")
+    checked = {}
+    try:
+        for key, value in override.items():
+            if value is None:
+                # No filter means all rows; a change without a value changes nothing
+                if key in FILTER_KEYS:
+                    checked[key] = None
+            elif key in ('market', 'sku_id'):
+                checked[key] = _selection(value, key)
+            elif key == 'weeks':
+                checked[key] = [int(w) for w in ([value] if np.isscalar(value) else value)]
+            elif key in ('start', 'end'):
+                checked[key] = pd.Timestamp(value)
+            elif key in ('promo_flag', 'holiday_flag'):
+                checked[key] = int(value)
+                if checked[key] not in (0, 1):
+                    raise ValueError
+            else:
+                checked[key] = float(value)
+                if not np.isfinite(checked[key]):
+                    raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for scenario override '{key}': {value!r}") from None
+    if checked.get('price') is not None and checked['price'] <= 0:
+        raise ValueError("Scenario override 'price' must be positive")
+    if checked.get('price_change') is not None and checked['price_change'] <= -1:
+        raise ValueError("Scenario override 'price_change' must be above -1")
+    return checked
+
+def override_mask(keys, override):
+    """Boolean mask of the rows an override applies to
+
+    `keys` holds the 'market', 'sku_id', 'week_start' and 'week' (1-based
+    horizon week) arrays of the future rows.
+    """
+    unknown = set(override) - set(FILTER_KEYS) - set(CHANGE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown scenario override keys: {sorted(unknown)}")
+    mask = _selected(keys['market'], override.get('market')) & _selected(keys['sku_id'], override.get('sku_id'))
+    if override.get('weeks') is not None:
+        mask &= np.isin(keys['week'], override['weeks'])
+    if override.get('start') is not None:
+        mask &= keys['week_start'] >= np.datetime64(pd.Timestamp(override['start']))
+    if override.get('end') is not None:
+        mask &= keys['week_start'] <= np.datetime64(pd.Timestamp(override['end']))
+    return mask
+
+def apply_override(rows, override, mask):
+    """Apply an override's changes to the masked rows in place"""
+    if 'price' in override:
+        rows.loc[mask, 'price'] = override['price']
+    if 'price_change' in override:
+        rows.loc[mask, 'price'] = rows.loc[mask, 'price'] * (1 + override['price_change'])
+    for column in ['promo_flag', 'holiday_flag']:
+        if column in override:
+            rows.loc[mask, column] = int(override[column])
+
+def scenario_rows(future_df, scenarios):
+    """Stack the modified rows of every scenario with 'scenario' and 'row' (position in future_df) columns"""
+    keys = {
+        'market': future_df['market'].astype(str).values,
+        'sku_id': future_df['sku_id'].astype(str).values,
+        'week_start': future_df['week_start'].values,
+        'week': pd.factorize(future_df['week_start'], sort=True)[0] + 1
+    }
+    frames = []
+    for i, scenario in enumerate(scenarios):
+        overrides = [validate_override(override) for override in scenario['overrides']]
+        masks = [override_mask(keys, override) for override in overrides]
+        positions = np.flatnonzero(np.logical_or.reduce(masks)) if masks else np.array([], dtype=int)
+        rows = future_df.iloc[positions].copy()
+        for override, mask in zip(overrides, masks):
+            apply_override(rows, override, mask[positions])
+        frames.append(rows.assign(scenario=scenario.get('name', f'scenario_{i}'), row=positions))
+    if not frames:
+        return future_df.iloc[0:0].assign(scenario=[], row=[])
+    return pd.concat(frames, ignore_index=True)
+
+@instrumented()
+def score_scenarios(model_mean, model_lower, model_upper, future_df, scenarios, features, categorical,
+                    quantile_models=None, calibration=None):
+    """Forecast every scenario and its uplift over the baseline for the rows it changes
+
+    Row uplift intervals are the differences of the scenario and baseline
+    bounds, i.e. they assume both outcomes share the same noise rank,
+    widened to include the mean uplift. A stored `calibration` of the
+    models' version is applied to scenario and baseline rows alike.
+    """
+    if set(features) & set(LAG_FEATURES):
+        raise ValueError("Scenarios support the non-recursive feature set only (lag features depend on "
+                         "forecast units)")
+    rows = scenario_rows(future_df, scenarios)
+    if rows.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    affected = np.unique(rows['row'])
+    stacked = pd.concat([future_df.iloc[affected], rows[future_df.columns]], ignore_index=True)
+    # Score each distinct feature row once (e.g. scenarios sharing a promo week)
+    unique, inverse = np.unique(pd.util.hash_pandas_object(stacked[features], index=False).values,
+                                return_inverse=True)
+    first = np.full(len(unique), len(stacked))
+    np.minimum.at(first, inverse, np.arange(len(stacked)))
+    predicted = make_predictions(model_mean, model_lower, model_upper, stacked.iloc[first], features, categorical,
+                                 quantile_models=quantile_models)
+    if calibration is not None:
+        predicted = apply_calibration(predicted, calibration)
+    predicted = predicted.iloc[inverse]
+    baseline = predicted.iloc[np.searchsorted(affected, rows['row'].values)]
+    scored = predicted.iloc[len(affected):]
+
+    results = rows[['scenario', 'market', 'sku_id', 'week_start', 'price', 'promo_flag', 'holiday_flag']].copy()
+    results['baseline'] = baseline['forecast'].values
+    bounds = ['lower_90', 'upper_90'] + list(quantile_columns(predicted).values())
+    for column in bounds:
+        results[f'baseline_{column}'] = baseline[column].values
+    results['forecast'] = scored['forecast'].values
+    for column in bounds:
+        results[column] = scored[column].values
+    results['uplift'] = results['forecast'] - results['baseline']
+    lower_shift = results['lower_90'].values - baseline['lower_90'].values
+    upper_shift = results['upper_90'].values - baseline['upper_90'].values
+    results['uplift_lower_90'] = np.minimum.reduce([lower_shift, upper_shift, results['uplift'].values])
+    results['uplift_upper_90'] = np.maximum.reduce([lower_shift, upper_shift, results['uplift'].values])
+    quantiles = bounds[2:]
+    return results[RESULT_COLUMNS + [f'baseline_{column}' for column in quantiles] + quantiles]
+
+def uplift_samples(results, residuals=None, n_samples=N_PATHS, seed=0):
+    """Joint samples of the summed uplift per scenario and week
+
+    Returns (scenarios, weeks, samples) with samples shaped
+    (scenarios x weeks x n_samples). `residuals` (training_residuals)
+    supplies the dependence across series and weeks; without it rows are
+    drawn independently.
+    """
+    scenario_codes, scenarios = pd.factorize(results['scenario'])
+    weeks = np.sort(results['week_start'].unique())
+    week_codes = np.searchsorted(weeks, results['week_start'].values)
+    bottom = bottom_series(results)
+    codes = series_codes(results, bottom)
+    probs, columns = quantile_points(results)
+    scenario_values = results[columns].values
+    baseline_values = results[[f'baseline_{column}' for column in columns]].values
+
+    totals = np.zeros((len(scenarios), len(weeks), n_samples))
+    order = np.argsort(codes, kind='stable')
+    for series, u in path_uniforms(bottom, len(weeks), residuals, n_samples, seed):
+        start, end = np.searchsorted(codes[order], [series.start, series.stop])
+        rows = order[start:end]
+        u_rows = u[codes[rows] - series.start, week_codes[rows]]
+        uplift = inverse_cdf(scenario_values[rows], probs, u_rows) - inverse_cdf(baseline_values[rows], probs, u_rows)
+        np.add.at(totals, (scenario_codes[rows], week_codes[rows]), uplift)
+    return scenarios, weeks, totals
+
+def scenario_summary(results, residuals=None, by_week=False, n_samples=N_PATHS, seed=0):
+    """Total baseline, scenario forecast and uplift per scenario (and week with `by_week`)
+
+    The 90% uplift bounds are the mean uplift plus the 5th/95th percentile
+    deviations of the jointly sampled total uplift (see uplift_samples)
+    from its sample mean.
+    """
+    keys = ['scenario', 'week_start'] if by_week else ['scenario']
+    summary = results.groupby(keys, sort=False)[['baseline', 'forecast', 'uplift']].sum()
+    scenarios, weeks, totals = uplift_samples(results, residuals, n_samples, seed)
+    if by_week:
+        index = pd.MultiIndex.from_product([scenarios, weeks], names=keys)
+    else:
+        index, totals = pd.Index(scenarios, name='scenario'), totals.sum(axis=1)
+    lower, upper = np.quantile(totals - totals.mean(axis=-1, keepdims=True), [LOWER_ALPHA, UPPER_ALPHA], axis=-1)
+    offsets = pd.DataFrame({'lower': lower.ravel(), 'upper': upper.ravel()}, index=index).reindex(summary.index)
+    summary['uplift_lower_90'] = summary['uplift'] + np.minimum(offsets['lower'], 0)
+    summary['uplift_upper_90'] = summary['uplift'] + np.maximum(offsets['upper'], 0)
+    summary['uplift_pct'] = summary['uplift'] / summary['baseline'].replace(0, np.nan)
+    summary['rows'] = results.groupby(keys, sort=False).size()
+    return summary
@@ -0,0 +1,422 @@
+"""HTTP forecast service with micro-batching and hot model reload.
+
+A small asyncio server (standard library only) for replenishment systems
+that need forecasts on demand:
+
+    python -m src.serving --port 8000
+
+    curl -s localhost:8000/forecast -d '{"market": "Delhi", "sku_id": ["S001", "S002"], "weeks": 4,
+                                         "overrides": [{"price_change": -0.1}]}'
+
+POST /forecast takes one request object, or {"requests": [...]}, with a
+`market`, one or more `sku_id`s, optional `weeks` (the first n horizon
+weeks, or a list of 1-based weeks) and optional scenario `overrides` in
+the src.scenarios format. GET /health, GET /metrics (p50/p99 latency,
+batch sizes) and POST /reload are also served.
+
+The newest stored mean/lower/upper model set and the future feature rows
+are loaded once at startup. Concurrent requests are queued and coalesced
+into micro-batches (up to `max_batch_rows` rows or `max_wait_ms` of
+waiting) that are scored with a single make_predictions call off the
+event loop. A watcher polls the model store and, when a newer version
+appears, loads it and the future rows in the background and swaps them
+in with one assignment; batches in flight finish on the version their
+requests were admitted with. Overrides are validated per request before
+it is queued, and a batch that fails is re-scored request by request, so
+one bad request cannot fail the others it was batched with.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from src.calibration import apply_calibration, ARTIFACT as CALIBRATION_ARTIFACT
+from src.config import DATA_DIR, MODEL_DIR, FEATURE_DIR
+from src.data_processing import load_typed_data, prepare_future_data
+from src.feature_store import build_feature_frames
+from src.modeling import make_predictions, FEATURES, CATEGORICAL
+from src.model_store import list_versions, load_models, load_artifact, MODEL_NAMES
+from src.scenarios import override_mask, apply_override, validate_override
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_ROWS = 50_000
+MAX_WAIT_MS = 5
+RELOAD_INTERVAL = 30
+LATENCY_WINDOW = 10_000
+MAX_BODY_BYTES = 1 << 20
+RESPONSE_COLUMNS = ['market', 'sku_id', 'week_start', 'forecast', 'lower_90', 'upper_90']
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+ServingState = namedtuple('ServingState', ['version', 'models', 'calibration', 'future_df', 'series', 'week',
+                                           'loaded_at'])
+PendingRequest = namedtuple('PendingRequest', ['state', 'rows', 'future'])
+
+# One long-lived prediction thread keeps LightGBM's OpenMP team warm instead of
+# spinning up a new team on whichever default-executor thread picks up a batch
+_predictor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast-predict")
+
+def servable_version(store_dir=MODEL_DIR, features=FEATURES, categorical=CATEGORICAL):
+    """Newest stored mean/lower/upper version trained on the serving feature set, or None"""
+    for manifest in list_versions(store_dir):
+        if (manifest['models'] == MODEL_NAMES and manifest['features'] == list(features)
+                and manifest['categorical'] == list(categorical)):
+            return manifest['version']
+    return None
+
+def load_state(version, store_dir=MODEL_DIR, data_dir=DATA_DIR, feature_dir=FEATURE_DIR):
+    """Load a model version, its calibration and the future feature rows indexed by series"""
+    models = load_models(version, store_dir, names=MODEL_NAMES)
+    if models is None:
+        raise ValueError(f"Unknown model version: {version}")
+    panel, price_plan_fut, promos_fut, weather_fut, calendar_fut = load_typed_data(data_dir)
+    future_df = prepare_future_data(calendar_fut, price_plan_fut, weather_fut, promos_fut)
+    _, future_df = build_feature_frames(panel, future_df, FEATURES + ['week_start', 'units'], feature_dir)
+    series = {
+        (str(market), str(sku)): positions
+        for (market, sku), positions in future_df.groupby(['market', 'sku_id'], observed=True).indices.items()
+    }
+    week = pd.factorize(future_df['week_start'], sort=True)[0] + 1
+    logger.info("Loaded model version %s and %d future rows for %d series", version, len(future_df), len(series))
+    return ServingState(version, tuple(models[name] for name in MODEL_NAMES),
+                        load_artifact(version, CALIBRATION_ARTIFACT, store_dir), future_df, series, week,
+                        datetime.now(timezone.utc).isoformat(timespec='seconds'))
+
+def select_rows(state, request):
+    """Future rows of one request with its overrides applied
+
+    Overrides are validated and cast here, so a malformed request fails
+    with a ValueError (400) before it can join a micro-batch.
+    """
+    market, skus = request.get('market'), request.get('sku_id')
+    if market is None or skus is None:
+        raise ValueError("Each request needs a 'market' and a 'sku_id'")
+    skus = [skus] if isinstance(skus, str) else list(skus)
+    unknown = [sku for sku in skus if (str(market), str(sku)) not in state.series]
+    if unknown:
+        raise ValueError(f"Unknown series in market {market}: {unknown}")
+    positions = np.concatenate([state.series[(str(market), str(sku))] for sku in skus])
+    weeks = request.get('weeks')
+    if weeks is not None:
+        wanted = np.arange(1, int(weeks) + 1) if np.isscalar(weeks) else np.asarray(weeks, dtype=int)
+        positions = positions[np.isin(state.week[positions], wanted)]
+    overrides = request.get('overrides') or []
+    if not isinstance(overrides, list):
+        raise ValueError("'overrides' must be a list of override objects")
+    overrides = [validate_override(override) for override in overrides]
+    rows = state.future_df.iloc[positions].copy()
+    if overrides:
+        keys = {
+            'market': rows['market'].astype(str).values,
+            'sku_id': rows['sku_id'].astype(str).values,
+            'week_start': rows['week_start'].values,
+            'week': state.week[positions]
+        }
+        for override in overrides:
+            apply_override(rows, override, override_mask(keys, override))
+    return rows
+
+def predict_batch(state, frames):
+    """Score the rows of several requests with one make_predictions call
+
+    Returns one list of response records per frame; the records of the
+    whole batch are formatted at once.
+    """
+    rows = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    predictions = make_predictions(*state.models, rows, FEATURES, CATEGORICAL)
+    if state.calibration is not None:
+        predictions = apply_calibration(predictions, state.calibration)
+    output = predictions[RESPONSE_COLUMNS].astype({'market': str, 'sku_id': str})
+    output['week_start'] = output['week_start'].dt.strftime('%Y-%m-%d')
+    records = output.to_dict('records')
+    bounds = np.cumsum([0] + [len(frame) for frame in frames])
+    return [records[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+def new_metrics():
+    return {
+        'requests': 0,
+        'errors': 0,
+        'batches': 0,
+        'reloads': 0,
+        'latency_ms': deque(maxlen=LATENCY_WINDOW),
+        'batch_rows': deque(maxlen=LATENCY_WINDOW),
+        'batch_requests': deque(maxlen=LATENCY_WINDOW)
+    }
+
+def metrics_summary(service):
+    """JSON-ready latency percentiles and batch statistics over the recent window"""
+    metrics, state = service['metrics'], service['state']
+    latency = np.asarray(metrics['latency_ms'])
+    batch_rows = np.asarray(metrics['batch_rows'])
+    batch_requests = np.asarray(metrics['batch_requests'])
+    return {
+        'model_version': state.version,
+        'loaded_at': state.loaded_at,
+        'requests': metrics['requests'],
+        'errors': metrics['errors'],
+        'batches': metrics['batches'],
+        'reloads': metrics['reloads'],
+        'queue_depth': service['queue'].qsize(),
+        'latency_ms': {
+            'window': len(latency),
+            'p50': float(np.percentile(latency, 50)) if len(latency) else None,
+            'p99': float(np.percentile(latency, 99)) if len(latency) else None,
+            'max': float(latency.max()) if len(latency) else None
+        },
+        'batch': {
+            'mean_rows': float(batch_rows.mean()) if len(batch_rows) else None,
+            'max_rows': int(batch_rows.max()) if len(batch_rows) else None,
+            'mean_requests': float(batch_requests.mean()) if len(batch_requests) else None
+        }
+    }
+
+async def score_group(loop, group):
+    """Score requests admitted with the same state, one result (or exception) per request
+
+    If the batch fails, its requests are re-scored one at a time so that
+    only the request that caused the failure gets the error.
+    """
+    state = group[0].state
+    try:
+        return await loop.run_in_executor(_predictor, predict_batch, state, [pending.rows for pending in group])
+    except Exception as e:
+        if len(group) == 1:
+            logger.exception("Prediction failed")
+            return [e]
+        logger.warning("Batch of %d requests failed (%s); scoring them one at a time", len(group), e)
+    results = []
+    for pending in group:
+        try:
+            results.extend(await loop.run_in_executor(_predictor, predict_batch, state, [pending.rows]))
+        except Exception as e:
+            logger.exception("Prediction failed")
+            results.append(e)
+    return results
+
+async def batch_worker(service, max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS):
+    """Coalesce queued requests into micro-batches and score each with one vectorized predict"""
+    queue, metrics = service['queue'], service['metrics']
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        n_rows = len(batch[0].rows)
+        deadline = loop.time() + max_wait_ms / 1000
+        while n_rows < max_batch_rows:
+            timeout = deadline - loop.time()
+            if timeout <= 0 and queue.empty():
+                break
+            try:
+                pending = queue.get_nowait() if not queue.empty() else await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(pending)
+            n_rows += len(pending.rows)
+
+        # Requests admitted before a hot swap are scored with the version they were selected from
+        by_state = {}
+        for pending in batch:
+            by_state.setdefault(id(pending.state), []).append(pending)
+        for group in by_state.values():
+            results = await score_group(loop, group)
+            for pending, result in zip(group, results):
+                if pending.future.done():
+                    continue
+                if isinstance(result, Exception):
+                    pending.future.set_exception(result)
+                else:
+                    pending.future.set_result(result)
+            metrics['batches'] += 1
+            metrics['batch_rows'].append(sum(len(pending.rows) for pending in group))
+            metrics['batch_requests'].append(len(group))
+
+async def reload_models(service):
+    """Load the newest servable version in the background and swap it in; returns True on a swap"""
+    async with service['reload_lock']:
+        store_dir = service['store_dir']
+        version = servable_version(store_dir)
+        if version is None or version == service['state'].version:
+            return False
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, load_state, version, store_dir, service['data_dir'],
+                                           service['feature_dir'])
+        previous, service['state'] = service['state'].version, state
+        service['metrics']['reloads'] += 1
+        logger.info("Hot-swapped model version %s -> %s", previous, version)
+        return True
+
+async def watch_models(service, interval=RELOAD_INTERVAL):
+    """Poll the model store and hot-swap new versions"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reload_models(service)
+        except (OSError, ValueError, KeyError, lgb.basic.LightGBMError) as e:
+            logger.error("Model reload failed, keeping version %s: %s", service['state'].version, e)
+
+async def forecast(service, payload):
+    """Select, queue and await the rows of a /forecast payload"""
+    if not isinstance(payload, dict):
+        raise ValueError("Expected a JSON object")
+    requests = payload['requests'] if 'requests' in payload else [payload]
+    if not requests:
+        raise ValueError("No forecast requests given")
+    state = service['state']
+    frames = [select_rows(state, request) for request in requests]
+    rows = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    if rows.empty:
+        return {'model_version': state.version, 'forecasts': []}
+    future = asyncio.get_running_loop().create_future()
+    await service['queue'].put(PendingRequest(state, rows, future))
+    records = await future
+    if 'requests' in payload:
+        for record, i in zip(records, np.repeat(np.arange(len(frames)), [len(frame) for frame in frames])):
+            record['request'] = int(i)
+    return {'model_version': state.version, 'forecasts': records}
+
+async def read_request(reader):
+    """Parse one HTTP/1.1 request into (method, path, headers, body), or None at end of stream"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = header.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError(f"Request body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), path.split('?', 1)[0], headers, body
+
+async def route(service, method, path, body):
+    """Dispatch a request and return (status, JSON-ready payload)"""
+    if path == '/forecast':
+        if method != 'POST':
+            return 405, {'error': "Use POST /forecast"}
+        return 200, await forecast(service, json.loads(body or b'{}'))
+    if path == '/health':
+        return 200, {'status': 'ok', 'model_version': service['state'].version}
+    if path == '/metrics':
+        return 200, metrics_summary(service)
+    if path == '/reload':
+        if method != 'POST':
+            return 405, {'error': "Use POST /reload"}
+        swapped = await reload_models(service)
+        return 200, {'reloaded': swapped, 'model_version': service['state'].version}
+    return 404, {'error': f"Unknown path {path}"}
+
+async def handle_connection(service, reader, writer):
+    """Serve requests on one keep-alive connection"""
+    metrics = service['metrics']
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            start = time.perf_counter()
+            try:
+                status, payload = await route(service, method, path, body)
+            except (ValueError, KeyError, TypeError) as e:
+                status, payload = 400, {'error': str(e)}
+            except Exception as e:
+                logger.exception("Request to %s failed", path)
+                status, payload = 500, {'error': str(e)}
+            if path == '/forecast':
+                metrics['requests'] += 1
+                metrics['errors'] += status != 200
+                metrics['latency_ms'].append((time.perf_counter() - start) * 1000)
+
+            data = json.dumps(payload).encode()
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            writer.write(
+                f"HTTP/1.1 {status} {STATUS[status]}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                .encode('latin-1') + data
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_service(host='127.0.0.1', port=8000, store_dir=MODEL_DIR, data_dir=DATA_DIR,
+                        feature_dir=FEATURE_DIR, reload_interval=RELOAD_INTERVAL, max_batch_rows=MAX_BATCH_ROWS,
+                        max_wait_ms=MAX_WAIT_MS):
+    """Load the newest servable models and start serving; returns (server, service)"""
+    version = servable_version(store_dir)
+    if version is None:
+        raise ValueError(f"No stored mean/lower/upper models in {store_dir}; run python -m src.forecast first")
+    loop = asyncio.get_running_loop()
+    state = await loop.run_in_executor(None, load_state, version, store_dir, data_dir, feature_dir)
+    service = {
+        'state': state,
+        'queue': asyncio.Queue(),
+        'metrics': new_metrics(),
+        'reload_lock': asyncio.Lock(),
+        'store_dir': store_dir,
+        'data_dir': data_dir,
+        'feature_dir': feature_dir
+    }
+    service['tasks'] = [asyncio.create_task(batch_worker(service, max_batch_rows, max_wait_ms))]
+    if reload_interval:
+        service['tasks'].append(asyncio.create_task(watch_models(service, reload_interval)))
+    server = await asyncio.start_server(partial(handle_connection, service), host, port)
+    logger.info("Serving model version %s on %s", version,
+                ", ".join(f"{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets))
+    return server, service
+
+async def serve(**kwargs):
+    server, _ = await start_service(**kwargs)
+    async with server:
+        await server.serve_forever()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP forecast service with micro-batching and hot model reload")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="model store directory")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory containing the input CSV files")
+    parser.add_argument("--feature-dir", default=FEATURE_DIR, help="feature store directory")
+    parser.add_argument("--reload-interval", type=float, default=RELOAD_INTERVAL,
+                        help="seconds between model store checks for new versions (0 disables)")
+    parser.add_argument("--max-batch-rows", type=int, default=MAX_BATCH_ROWS, help="rows per micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="how long a micro-batch waits for more requests")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        asyncio.run(serve(host=args.host, port=args.port, store_dir=args.model_dir, data_dir=args.data_dir,
+                          feature_dir=args.feature_dir, reload_interval=args.reload_interval,
+                          max_batch_rows=args.max_batch_rows, max_wait_ms=args.max_wait_ms))
+    except (OSError, ValueError) as e:
+        logger.error("Forecast service failed: %s", e)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
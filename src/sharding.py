@@ -0,0 +1,143 @@
+"""Per-segment model shards with a global fallback.
+
+train_df is partitioned by a shard key (market by default) and each
+shard gets its own mean/lower/upper boosters, trained in parallel worker
+processes. Shards are stored as independent versions in a 'shards'
+sub-store of the model store, each fingerprinted on its own rows:
+
+    <store_dir>/shards/<version>/manifest.json   ('shard_by', 'shard', 'n_rows', ...)
+
+so new data in one market only retrains that market's shard. Shards with
+too few rows, and shard values unseen at training time, are predicted by
+the global model. It is stored in the main model store, tagged with a
+fingerprint of the sparse shards' rows ('sparse_version'), and the newest
+global version with a matching tag is reused while only dense shards
+change; otherwise it is refitted in the same pool as the shards.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import lightgbm as lgb
+import pandas as pd
+
+from src.config import MODEL_DIR
+from src.modeling import train_models, make_predictions, thread_budget
+from src.model_store import (
+    data_fingerprint, training_config, save_models, load_models, list_versions, MODEL_NAMES
+)
+from src.profiling import instrumented
+
+logger = logging.getLogger(__name__)
+
+SHARD_DIR = "shards"
+GLOBAL_SHARD = "global"
+MIN_SHARD_ROWS = 200
+
+ShardedModels = namedtuple('ShardedModels', ['shard_by', 'shards', 'global_models', 'versions'])
+
+def shard_store_dir(store_dir=MODEL_DIR):
+    return os.path.join(store_dir, SHARD_DIR)
+
+def _train_shard(shard_df, features, categorical, num_threads):
+    """Worker: train one shard and return its boosters as model strings"""
+    models = train_models(shard_df, features, categorical, num_threads=num_threads)
+    return [booster.model_to_string() for booster in models]
+
+def stored_global_version(sparse_version, store_dir=MODEL_DIR):
+    """Newest stored global fallback fitted while the sparse shards had these rows, or None"""
+    return next((m['version'] for m in list_versions(store_dir) if m.get('sparse_version') == sparse_version), None)
+
+@instrumented()
+def train_or_load_sharded_models(train_df, features, categorical, shard_by='market', store_dir=MODEL_DIR,
+                                 min_rows=MIN_SHARD_ROWS, retrain=False, retrain_shards=None, retrain_global=False,
+                                 n_jobs=None):
+    """Load or train one model set per shard plus the global fallback
+
+    Only shards whose rows changed (or listed in `retrain_shards`, or all
+    with `retrain`) are trained, in parallel worker processes. The global
+    fallback is refitted on all rows only when the rows of the sparse
+    shards it serves changed (or with `retrain_global` whenever any row
+    changed), in the same pool. Returns a ShardedModels tuple; `versions`
+    maps each shard (and 'global') to its stored version.
+    """
+    if shard_by not in train_df:
+        raise ValueError(f"Shard key column '{shard_by}' is not in the training data")
+    retrain_shards = {str(s) for s in retrain_shards or []}
+    shard_dir = shard_store_dir(store_dir)
+    config = dict(training_config(), shard_by=shard_by)
+    keys = train_df[shard_by].astype(str)
+    counts = keys.value_counts()
+    sparse_df = train_df[keys.isin(counts.index[counts < min_rows]).values]
+
+    global_config = training_config()
+    global_version = data_fingerprint(train_df, features, categorical, global_config)
+    sparse_version = data_fingerprint(sparse_df, features, categorical, dict(config, shard=GLOBAL_SHARD))
+    if not (retrain or retrain_global):
+        global_version = stored_global_version(sparse_version, store_dir) or global_version
+    global_models = None if retrain else load_models(global_version, store_dir, names=MODEL_NAMES)
+    if global_models is not None:
+        global_models = tuple(global_models[name] for name in MODEL_NAMES)
+
+    shards, versions, missing = {}, {GLOBAL_SHARD: global_version}, {}
+    for shard, shard_df in train_df.groupby(keys.values, observed=True, sort=True):
+        if len(shard_df) < min_rows:
+            continue
+        version = data_fingerprint(shard_df, features, categorical, dict(config, shard=shard))
+        models = None if retrain or shard in retrain_shards else load_models(version, shard_dir, names=MODEL_NAMES)
+        if models is None:
+            missing[shard] = (shard_df, version)
+        else:
+            shards[shard] = tuple(models[name] for name in MODEL_NAMES)
+        versions[shard] = version
+    logger.info("Shards by %s: %d loaded, %d to train; global fallback %s", shard_by, len(shards), len(missing),
+                "loaded" if global_models is not None else "to train")
+
+    if missing or global_models is None:
+        n_workers, n_threads = thread_budget(len(missing) + (global_models is None), n_jobs)
+        # spawn, not fork: LightGBM's OpenMP threads do not survive a fork
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            # The global fallback trains alongside the shards, not before them
+            global_future = None
+            if global_models is None:
+                global_future = pool.submit(_train_shard, train_df, features, categorical, n_threads)
+            futures = {
+                shard: pool.submit(_train_shard, shard_df, features, categorical, n_threads)
+                for shard, (shard_df, _) in missing.items()
+            }
+            for shard, future in futures.items():
+                shard_df, version = missing[shard]
+                models = tuple(lgb.Booster(model_str=model_str) for model_str in future.result())
+                save_models(dict(zip(MODEL_NAMES, models)), version, features, categorical, config, shard_dir,
+                            metadata={'n_rows': len(shard_df), 'shard_by': shard_by, 'shard': shard})
+                shards[shard] = models
+            if global_future is not None:
+                global_models = tuple(lgb.Booster(model_str=model_str) for model_str in global_future.result())
+                save_models(dict(zip(MODEL_NAMES, global_models)), global_version, features, categorical,
+                            global_config, store_dir,
+                            metadata={'n_rows': len(train_df), 'last_week': train_df['week_start'].max(),
+                                      'sparse_version': sparse_version})
+    return ShardedModels(shard_by, shards, global_models, versions)
+
+def sharded_version(sharded):
+    """Version id of a whole sharded model set, changing whenever any shard or the fallback does"""
+    return hashlib.sha256(json.dumps(sharded.versions, sort_keys=True).encode()).hexdigest()[:16]
+
+def make_sharded_predictions(sharded, future_df, features, categorical):
+    """Predict each row with its shard's models, or the global models for sparse or unseen shards
+
+    Adds a 'shard' column naming the model set used for each row.
+    """
+    keys = future_df[sharded.shard_by].astype(str)
+    routed = keys.where(keys.isin(list(sharded.shards)), GLOBAL_SHARD)
+    parts = []
+    for shard, rows in future_df.groupby(routed.values, sort=False):
+        models = sharded.shards.get(shard, sharded.global_models)
+        parts.append(make_predictions(*models, rows, features, categorical).assign(shard=shard))
+    if not parts:
+        return make_predictions(*sharded.global_models, future_df, features, categorical).assign(shard=GLOBAL_SHARD)
+    return pd.concat(parts).loc[future_df.index]
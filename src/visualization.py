@@ -3,10 +3,17 @@ import plotly.express as px
 from plotly.subplots import make_subplots
 import pandas as pd
 
+from src.profiling import instrumented
+
+# Draw the forecast plot with WebGL traces from this many SKUs on
+WEBGL_MIN_SKUS = 10
+
+@instrumented()
 def plot_forecast_interactive(predictions, selected_skus, selected_market):
     """Interactive forecast plot with Plotly"""
     fig = go.Figure()
     colors = px.colors.qualitative.Set2
+    scatter = go.Scattergl if len(selected_skus) >= WEBGL_MIN_SKUS else go.Scatter
     
     for idx, sku in enumerate(selected_skus):
         sku_data = predictions[
@@ -16,7 +23,7 @@ def plot_forecast_interactive(predictions, selected_skus, selected_market):
         
         color = colors[idx % len(colors)]
         
-        fig.add_trace(go.Scatter(
+        fig.add_trace(scatter(
             x=sku_data['week_start'],
             y=sku_data['forecast'],
             mode='lines+markers',
@@ -25,7 +32,7 @@ def plot_forecast_interactive(predictions, selected_skus, selected_market):
             marker=dict(size=6)
         ))
         
-        fig.add_trace(go.Scatter(
+        fig.add_trace(scatter(
             x=sku_data['week_start'].tolist() + sku_data['week_start'].tolist()[::-1],
             y=sku_data['upper_90'].tolist() + sku_data['lower_90'].tolist()[::-1],
             fill='toself',
@@ -48,6 +55,7 @@ def plot_forecast_interactive(predictions, selected_skus, selected_market):
     )
     return fig
 
+@instrumented()
 def plot_driver_attribution(model, features):
     """Plot feature importance"""
     importance = pd.DataFrame({
@@ -76,19 +84,28 @@ def plot_driver_attribution(model, features):
     )
     return fig
 
-def plot_weather_impact(predictions, selected_market):
-    """Weather impact heatmap"""
-    market_data = predictions[predictions['market'] == selected_market].copy()
+def weather_pivot(market_data):
+    """Average forecast by binned temperature (rows) and rain (columns)"""
+    market_data = market_data.copy()
     market_data['temp_bin'] = pd.cut(market_data['temp_c'], bins=5)
     market_data['rain_bin'] = pd.cut(market_data['rain_mm'], bins=5)
     
-    pivot_data = market_data.pivot_table(
+    return market_data.pivot_table(
         values='forecast',
         index='temp_bin',
         columns='rain_bin',
-        aggfunc='mean'
+        aggfunc='mean',
+        observed=False
     )
-    
+
+def plot_weather_impact(predictions, selected_market):
+    """Weather impact heatmap"""
+    market_data = predictions[predictions['market'] == selected_market]
+    return weather_figure(weather_pivot(market_data))
+
+@instrumented()
+def weather_figure(pivot_data):
+    """Weather impact heatmap from a weather_pivot table"""
     fig = go.Figure(data=go.Heatmap(
         z=pivot_data.values,
         x=[str(col) for col in pivot_data.columns],
@@ -106,23 +123,26 @@ def plot_weather_impact(predictions, selected_market):
     )
     return fig
 
+def shock_types(market_data):
+    """Label each row Normal, Promo, Holiday or Promo+Holiday"""
+    shock_type = pd.Series('Normal', index=market_data.index)
+    shock_type[market_data['promo_flag'] == 1] = 'Promo'
+    shock_type[market_data['holiday_flag'] == 1] = 'Holiday'
+    shock_type[(market_data['promo_flag'] == 1) & (market_data['holiday_flag'] == 1)] = 'Promo+Holiday'
+    return shock_type
+
 def plot_shock_analysis(predictions, selected_market, selected_skus):
     """Analyze shock impact (promos, holidays)"""
     market_data = predictions[
         (predictions['market'] == selected_market) &
         (predictions['sku_id'].isin(selected_skus))
-    ].copy()
-    
-    market_data['shock_type'] = 'Normal'
-    market_data.loc[market_data['promo_flag'] == 1, 'shock_type'] = 'Promo'
-    market_data.loc[market_data['holiday_flag'] == 1, 'shock_type'] = 'Holiday'
-    market_data.loc[
-        (market_data['promo_flag'] == 1) & (market_data['holiday_flag'] == 1),
-        'shock_type'
-    ] = 'Promo+Holiday'
-    
-    shock_summary = market_data.groupby('shock_type')['forecast'].agg(['mean', 'std', 'count'])
-    
+    ]
+    shock_summary = market_data['forecast'].groupby(shock_types(market_data)).agg(['mean', 'std', 'count'])
+    return shock_figure(shock_summary, selected_market)
+
+@instrumented()
+def shock_figure(shock_summary, selected_market):
+    """Bar chart of mean forecast (with std error bars) per shock type"""
     fig = go.Figure()
     fig.add_trace(go.Bar(
         x=shock_summary.index,
@@ -143,20 +163,25 @@ def plot_shock_analysis(predictions, selected_market, selected_skus):
     )
     return fig
 
-def plot_uncertainty_width(predictions, selected_market):
-    """Analyze uncertainty width across time"""
-    market_data = predictions[predictions['market'] == selected_market].copy()
-    
-    weekly_uncertainty = market_data.groupby('week_start').agg({
+def weekly_uncertainty(market_data):
+    """Weekly mean forecast and bounds with the resulting 90% CI width"""
+    weekly = market_data.groupby('week_start').agg({
         'forecast': 'mean',
         'upper_90': 'mean',
         'lower_90': 'mean'
     }).reset_index()
     
-    weekly_uncertainty['uncertainty_width'] = (
-        weekly_uncertainty['upper_90'] - weekly_uncertainty['lower_90']
-    )
-    
+    weekly['uncertainty_width'] = weekly['upper_90'] - weekly['lower_90']
+    return weekly
+
+def plot_uncertainty_width(predictions, selected_market):
+    """Analyze uncertainty width across time"""
+    market_data = predictions[predictions['market'] == selected_market]
+    return uncertainty_figure(weekly_uncertainty(market_data), selected_market)
+
+@instrumented()
+def uncertainty_figure(weekly_uncertainty, selected_market):
+    """Forecast line and CI width bars from a weekly_uncertainty frame"""
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(
         go.Scatter(
@@ -188,4 +213,140 @@ def plot_uncertainty_width(predictions, selected_market):
     fig.update_xaxes(title_text="Week Starting")
     fig.update_yaxes(title_text="Forecasted Units", secondary_y=False)
     fig.update_yaxes(title_text="Uncertainty Width", secondary_y=True)
-    return fig
\ No newline at end of file
+    return fig
+
+@instrumented()
+def plot_scenario_uplift(weekly_summary, scenario_name):
+    """Baseline vs scenario forecast by week with the uplift interval
+
+    `weekly_summary` is scenario_summary(..., by_week=True), whose uplift
+    bounds are sampled intervals of the weekly totals.
+    """
+    weekly = weekly_summary.xs(scenario_name, level='scenario').sort_index().reset_index()
+    
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(
+        go.Scatter(
+            x=weekly['week_start'],
+            y=weekly['baseline'],
+            mode='lines+markers',
+            name='Baseline',
+            line=dict(color='gray', width=2, dash='dash')
+        ),
+        secondary_y=False
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=weekly['week_start'],
+            y=weekly['forecast'],
+            mode='lines+markers',
+            name='Scenario',
+            line=dict(color='#1f77b4', width=2)
+        ),
+        secondary_y=False
+    )
+    fig.add_trace(
+        go.Bar(
+            x=weekly['week_start'],
+            y=weekly['uplift'],
+            error_y=dict(
+                type='data',
+                symmetric=False,
+                array=weekly['uplift_upper_90'] - weekly['uplift'],
+                arrayminus=weekly['uplift'] - weekly['uplift_lower_90']
+            ),
+            name='Uplift (90% CI)',
+            marker_color='#2ca02c',
+            opacity=0.5
+        ),
+        secondary_y=True
+    )
+    
+    fig.update_layout(
+        title=f'Scenario Uplift - {scenario_name}',
+        height=400,
+        template='plotly_white',
+        hovermode='x unified'
+    )
+    fig.update_xaxes(title_text="Week Starting")
+    fig.update_yaxes(title_text="Forecasted Units", secondary_y=False)
+    fig.update_yaxes(title_text="Uplift", secondary_y=True)
+    return fig
+
+@instrumented()
+def plot_forecast_drivers(drivers, selected_market):
+    """Stacked weekly driver contributions (summed over the selected SKUs)"""
+    driver_columns = [col for col in drivers.columns if col.startswith('driver_')]
+    weekly = drivers.groupby('week_start')[driver_columns].sum().reset_index()
+    colors = px.colors.qualitative.Set2
+    
+    fig = go.Figure()
+    for idx, column in enumerate(driver_columns):
+        if not weekly[column].abs().sum():
+            continue
+        fig.add_trace(go.Bar(
+            x=weekly['week_start'],
+            y=weekly[column],
+            name=column.replace('driver_', '').capitalize(),
+            marker_color='lightgray' if column == 'driver_base' else colors[idx % len(colors)]
+        ))
+    fig.add_trace(go.Scatter(
+        x=weekly['week_start'],
+        y=weekly[driver_columns].sum(axis=1),
+        mode='lines+markers',
+        name='Model Forecast',
+        line=dict(color='black', width=2)
+    ))
+    
+    fig.update_layout(
+        title=f'Forecast Drivers by Week - {selected_market}',
+        xaxis_title='Week Starting',
+        yaxis_title='Contribution to Forecasted Units',
+        barmode='relative',
+        height=450,
+        template='plotly_white',
+        hovermode='x unified'
+    )
+    return fig
+
+def plot_stage_timeline(stages, run_label):
+    """Gantt-style timeline of one run's stages (nested stages below their parents)"""
+    stages = stages.sort_values('start_s')
+    labels = ['\u2003' * int(depth) + name for depth, name in zip(stages['depth'], stages['name'])]
+    
+    fig = go.Figure(go.Bar(
+        x=stages['wall_s'],
+        base=stages['start_s'],
+        y=labels,
+        orientation='h',
+        marker=dict(color=stages['depth'], colorscale='Blues_r', cmin=0, cmax=max(stages['depth'].max(), 1) + 1),
+        customdata=stages[['rows', 'rows_per_s', 'rss_growth_mb']].values,
+        hovertemplate='%{y}<br>%{x:.3f}s<br>rows: %{customdata[0]:,}<br>rows/s: %{customdata[1]:,.0f}'
+                      '<br>peak RSS growth: %{customdata[2]:.1f} MB<extra></extra>'
+    ))
+    
+    fig.update_layout(
+        title=f'Stage Timeline - {run_label}',
+        xaxis_title='Seconds since run start',
+        yaxis=dict(autorange='reversed'),
+        height=max(300, 22 * len(stages) + 120),
+        template='plotly_white',
+        showlegend=False
+    )
+    return fig
+
+def plot_stage_trends(table, top_n=8):
+    """Wall time of the slowest top-level stages across runs"""
+    top_level = table[table['depth'] == 0]
+    slowest = top_level.groupby('name')['wall_s'].mean().nlargest(top_n).index
+    trend = top_level[top_level['name'].isin(slowest)].groupby(['started_at', 'name'])['wall_s'].sum().reset_index()
+    
+    fig = px.line(trend, x='started_at', y='wall_s', color='name', markers=True,
+                  labels={'started_at': 'Run Started (UTC)', 'wall_s': 'Wall Time (s)', 'name': 'Stage'})
+    fig.update_layout(
+        title='Stage Wall Time Across Runs',
+        height=400,
+        template='plotly_white',
+        hovermode='x unified'
+    )
+    return fig